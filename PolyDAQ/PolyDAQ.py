@@ -24,6 +24,14 @@ import new_config as config     # The GUI configuration file; customizable for
                                 # Different experiments, different hardware configurations 
                                             
 import PolyDAQ_A2D_thread       # Module for getting data from the board
+import PolyDAQ_Acq_Process      # Same, but in a separate process
+import PolyDAQ_Multi_Board      # Same, but from several boards at once
+import PolyDAQ_Data_Store       # Where a run's data is kept, and how rows are written
+import PolyDAQ_Rate_Probe       # Remembers how fast each set of channels can be read
+import PolyDAQ_Trigger          # Keeps only the data around an event
+import PolyDAQ_Discovery        # Finds which serial ports have PolyDAQs on them
+import PolyDAQ_Calibration      # Turns A/D readings into real units
+import PolyDAQ_Raw_Record       # Saves the raw A/D readings for recalibration later
 
 
 import PolyDAQ_PlotManager \
@@ -32,6 +40,18 @@ import PolyDAQ_PlotManager \
                                 # talks to PolyDAQ_Plotter.py, which has plot drawing class
 
 
+#--------------------------------------------------------------------------------------
+# This function returns a list of the ports on which simulated boards are running
+# (see PolyDAQ_Sim_Board.py). Each simulator makes a link to its pseudo-terminal with
+# a name starting with config.sim_port_prefix; links left behind by simulators which
+# have gone away point to nothing and are left out.
+
+def simulated_ports ():
+
+    return [a_port for a_port in sorted (glob.glob (config.sim_port_prefix + '*'))
+            if os.path.exists (a_port)]
+
+
 #--------------------------------------------------------------------------------------
 # This function scans for serial ports and returns a list of the ports found.  On a
 # Linux system, it looks for USB serial ports named /dev/ttyUSB* and Bluetooth serial  
@@ -42,7 +62,15 @@ def scan_system_and_serial_ports ():
     system_name = platform.system ()
 
     if system_name == "Windows":
-        # Scan for available ports.
+        # PySerial can usually list the ports without opening every one of them
+        try:
+            import serial.tools.list_ports
+            return ['Choose Port'] + sorted ([a_port[0] for a_port
+                                             in serial.tools.list_ports.comports ()])
+        except ImportError:
+            pass
+
+        # Otherwise scan for available ports.
         available = []
         for i in range (256):
             try:
@@ -55,11 +83,34 @@ def scan_system_and_serial_ports ():
 
     elif system_name == "Darwin":
         # Mac
-        return ['Choose Port'] + glob.glob ('/dev/tty*') + glob.glob ('/dev/cu*')
+        return ['Choose Port'] + glob.glob ('/dev/tty*') + glob.glob ('/dev/cu*') \
+               + simulated_ports ()
 
     else:
         # Assume Linux or something else
-        return ['Choose Port'] + glob.glob ('/dev/ttyUSB*') #+ glob.glob ('/dev/ttyS?') 
+        return ['Choose Port'] + glob.glob ('/dev/ttyUSB*') \
+               + simulated_ports () #+ glob.glob ('/dev/ttyS?') 
+
+
+#--------------------------------------------------------------------------------------
+# This function returns a list of the ports to put in the port box and a list of the
+# text to show for each. With config.discover_ports set, only the ports which answer
+# as a PolyDAQ are listed, each along with the version it reported; if none answers,
+# or discovery is turned off, every port is listed.
+
+def list_polydaq_ports ():
+
+    port_names = scan_system_and_serial_ports ()
+    if not config.discover_ports:
+        return port_names, port_names
+
+    found = PolyDAQ_Discovery.discover_polydaqs (port_names[1:])
+    if not found:
+        return port_names, port_names
+
+    return (['Choose Port'] + [port_name for port_name, version in found],
+            ['Choose Port'] + [port_name + '  (' + version + ')'
+                               for port_name, version in found])
 
 
 #--------------------------------------------------------------------------------------
@@ -81,6 +132,9 @@ class Window (PyQt4.QtGui.QMainWindow):
         self.file_path = config.data_file_path
         self.file_name = config.data_file_name + '.' + config.data_file_extension
 
+        # If the raw A/D readings are being saved, the writer for the raw file
+        self.raw_recorder = None
+
         # -----------------------------------------------------------------------------
         # Construct Menu Bar
         # This is the menu bar at the top of the window.
@@ -106,6 +160,9 @@ class Window (PyQt4.QtGui.QMainWindow):
 
         balanceBridge = toolsMenu.addAction ('Auto-Balance Strain Bridge')
         balanceBridge.triggered.connect (self.balance_bridges)
+
+        boardVersion = toolsMenu.addAction ('Ask Board Version')
+        boardVersion.triggered.connect (self.ask_board_version)
 #        calibrate = hardwareMenu.addAction ('Calibrate A/D Board')
 #        calibrate.triggered.connect (self.calibrateBoard)
 
@@ -194,14 +251,32 @@ class Window (PyQt4.QtGui.QMainWindow):
         self.update_timer.start ()
 
         # Create a thread for data acquisition. The thread is a daemon, meaning that
-        # when the GUI thread exits, the daemon thread will not keep Python running
-        self.my_acq_thread = PolyDAQ_A2D_thread.data_acq_thread \
-                             (0.1)   
+        # when the GUI thread exits, the daemon thread will not keep Python running.
+        # If the configuration asks for it, a separate process does the job instead,
+        # with room in its shared memory for every channel there is
+        if config.board_ports:
+            self.my_acq_thread = PolyDAQ_Multi_Board.multi_board_session \
+                                 (0.1, len (config.board_ports))
+        elif config.acquisition_process:
+            num_channels = 0
+            for a_plot in config.plots:
+                num_channels += len (a_plot['channels'])
+            self.my_acq_thread = PolyDAQ_Acq_Process.data_acq_process \
+                                 (0.1, num_channels)
+        else:
+            self.my_acq_thread = PolyDAQ_A2D_thread.data_acq_thread \
+                                 (0.1)   
 #                            (config.rates[self.timebase_box.currentIndex ()])
 
         self.my_acq_thread.daemon = True
         self.my_acq_thread.start ()
 
+        # Commands such as bridge balances are carried out by the data acquisition
+        # thread, which says when each is done from its own thread. A Qt signal gets
+        # the news over to this one, which is the only one allowed to touch the GUI
+        self.connect (self, PyQt4.QtCore.SIGNAL ("commandDone(PyQt_PyObject)"),
+                      self.show_command_result)
+
         # Set initial values -----------------------------------------------------------
 
         # Gray out most of the buttons
@@ -212,6 +287,9 @@ class Window (PyQt4.QtGui.QMainWindow):
         self.start_stop_grp.setEnabled (False)
 
         self.serial_port_ready = False      # The serial port isn't yet ready to use
+        self.board_name = ''                # What the board said when it was opened
+        self.measurands = []                # The channels which are to be read
+        self.rate_cache = PolyDAQ_Rate_Probe.row_time_cache ()
         self.running = False                # Not taking and displaying data now
         self.serial_string = ""             # String holds characters from serial port
 
@@ -276,9 +354,14 @@ class Window (PyQt4.QtGui.QMainWindow):
         port_name = self.ser_port_list[self.serial_port_box.currentIndex ()]
 
         # Ask the data acquisition thread to attempt to open the serial port. The
-        # thread will return a text string indicating if things went well
-        [result_string, self.serial_port_ready] = \
-                            self.my_acq_thread.set_serial_port (port_name, config.baud_rate)
+        # thread will return a text string indicating if things went well. If the
+        # configuration lists ports for several boards, all of them are opened instead
+        if config.board_ports:
+            [result_string, self.serial_port_ready] = \
+                    self.my_acq_thread.set_serial_ports (config.board_ports, config.baud_rate)
+        else:
+            [result_string, self.serial_port_ready] = \
+                    self.my_acq_thread.set_serial_port (port_name, config.baud_rate)
 
         self.statusBox.append (result_string)
         self.statusBox.moveCursor (PyQt4.QtGui.QTextCursor.End)
@@ -295,6 +378,10 @@ class Window (PyQt4.QtGui.QMainWindow):
             self.start_stop_grp.setEnabled (True)
 #            self.histogram_btn.setEnabled (True)
 
+            # If channels were already chosen, see how fast this board can read them
+            self.board_name = result_string
+            self.check_sample_rates ()
+
         # Make sure the port list is updated in case somebody plugged in a USB port
         # or turned on a Bluetooth device or something like that
         self.serial_port_list = scan_system_and_serial_ports ()
@@ -388,10 +475,10 @@ class Window (PyQt4.QtGui.QMainWindow):
         self.connect (self.serial_port_box,
                       PyQt4.QtCore.SIGNAL ("currentIndexChanged(QString)"),
                       self.set_serial_port)
-        self.ser_port_list = scan_system_and_serial_ports ()
+        self.ser_port_list, port_labels = list_polydaq_ports ()
         self.serial_port_box.setInsertPolicy (PyQt4.QtGui.QComboBox.InsertAtTop)
         for index in range (0, len (self.ser_port_list)):   
-            self.serial_port_box.addItem (self.ser_port_list[index])
+            self.serial_port_box.addItem (port_labels[index])
 
         # Show Data Filename (and path, though commented out now)
 #        self.FileName_lbl = PyQt4.QtGui.QLabel ("Data File:")  
@@ -529,6 +616,8 @@ class Window (PyQt4.QtGui.QMainWindow):
         '''
 
         measurands = []       # measurand list to be sent to board, PolyDAQ_A2D_thread
+        boards = []           # which board each measurand is read from
+        intervals = []        # how often each measurand is read, if not every row
 #        slopes = []           # calibration slopes
 #        offsets = []          # calibration offsets (y-intercepts)
 
@@ -544,6 +633,8 @@ class Window (PyQt4.QtGui.QMainWindow):
                 # If this channel's checkbox is checked, add the channel to the list
                 if (a_channel['cbox'].isChecked ()):
                     measurands.append (a_channel['command'])
+                    boards.append (a_channel.get ('board', 0))
+                    intervals.append (a_channel.get ('interval'))
 #                    slopes.append (a_channel['slope'])
 #                    offsets.append (a_channel['offset'])
                     a_channel['edit'].setEnabled (True)
@@ -555,8 +646,20 @@ class Window (PyQt4.QtGui.QMainWindow):
         self.statusBox.append ('(DAQ Channels ' + str (measurands) + ')')
         self.statusBox.moveCursor (PyQt4.QtGui.QTextCursor.End)
 
-        # Tell the data taking thread what the measurands are
-        self.my_acq_thread.set_measurands (measurands) #, slopes, offsets)
+        # Tell the data taking thread what the measurands are, and when there are
+        # several boards, which board each one is on
+        if config.board_ports:
+            self.statusBox.append ('(Boards ' + str (boards) + ')')
+            self.my_acq_thread.set_measurands (measurands, boards)
+        else:
+            self.my_acq_thread.set_measurands (measurands) #, slopes, offsets)
+
+        # Channels which needn't be read every time have intervals of their own
+        self.my_acq_thread.set_channel_intervals (intervals)
+
+        # Find out how fast the board can read these channels
+        self.measurands = measurands
+        self.check_sample_rates ()
 
 
     #----------------------------------------------------------------------------------
@@ -631,6 +734,48 @@ class Window (PyQt4.QtGui.QMainWindow):
                       PyQt4.QtCore.SIGNAL ('valueChanged(int)'),
                       self.auto_or_manual_stop)
 
+        # Triggered capture: wait for a reading on one channel to meet a condition,
+        # then keep only the data from a little before to a little after it
+        self.trigger_cbox = PyQt4.QtGui.QCheckBox ('Trigger on')
+        self.trigger_cbox.setToolTip (' Record only around an event ')
+        self.trigger_channel_box = PyQt4.QtGui.QComboBox ()
+        for a_plot in config.plots:
+            for a_channel in a_plot['channels']:
+                self.trigger_channel_box.addItem (a_channel['abbrev'])
+        self.trigger_kind_box = PyQt4.QtGui.QComboBox ()
+        for a_kind in PolyDAQ_Trigger.TRIGGER_KINDS:
+            self.trigger_kind_box.addItem (a_kind)
+        self.trigger_kind_box.setCurrentIndex (
+                                PolyDAQ_Trigger.TRIGGER_KINDS.index ('rising'))
+
+        self.trigger_level_lbl = PyQt4.QtGui.QLabel ('Level')
+        self.trigger_level_box = PyQt4.QtGui.QDoubleSpinBox ()
+        self.trigger_upper_lbl = PyQt4.QtGui.QLabel ('to')
+        self.trigger_upper_box = PyQt4.QtGui.QDoubleSpinBox ()
+        for a_box in (self.trigger_level_box, self.trigger_upper_box):
+            a_box.setRange (-1e6, 1e6)
+            a_box.setDecimals (3)
+
+        self.trigger_time_lbl = PyQt4.QtGui.QLabel ('Keep (s)')
+        self.pre_trigger_box = PyQt4.QtGui.QDoubleSpinBox ()
+        self.pre_trigger_box.setPrefix ('before ')
+        self.pre_trigger_box.setValue (1.0)
+        self.post_trigger_box = PyQt4.QtGui.QDoubleSpinBox ()
+        self.post_trigger_box.setPrefix ('after ')
+        self.post_trigger_box.setValue (5.0)
+        for a_box in (self.pre_trigger_box, self.post_trigger_box):
+            a_box.setRange (0.0, 3600.0)
+
+        self.connect (self.trigger_cbox,
+                      PyQt4.QtCore.SIGNAL ('clicked()'),
+                      self.trigger_on_or_off)
+        self.connect (self.trigger_kind_box,
+                      PyQt4.QtCore.SIGNAL ('currentIndexChanged(int)'),
+                      self.trigger_on_or_off)
+
+        # Initially, capture isn't triggered
+        self.trigger_on_or_off ()
+
 
         layout = PyQt4.QtGui.QGridLayout ()
 
@@ -644,6 +789,17 @@ class Window (PyQt4.QtGui.QMainWindow):
         layout.addWidget (self.stop_time_box,   3, 1)  
         layout.addWidget (self.units_lbl,     3, 2)    
 
+        layout.addWidget (self.trigger_cbox,        4, 0)
+        layout.addWidget (self.trigger_channel_box, 4, 1)
+        layout.addWidget (self.trigger_kind_box,    4, 2, 1, 2)
+        layout.addWidget (self.trigger_level_lbl,   5, 0)
+        layout.addWidget (self.trigger_level_box,   5, 1)
+        layout.addWidget (self.trigger_upper_lbl,   5, 2)
+        layout.addWidget (self.trigger_upper_box,   5, 3)
+        layout.addWidget (self.trigger_time_lbl,    6, 0)
+        layout.addWidget (self.pre_trigger_box,     6, 1)
+        layout.addWidget (self.post_trigger_box,    6, 2, 1, 2)
+
         self.time_settings_grp.setLayout (layout)
 
         return self.time_settings_grp
@@ -665,6 +821,92 @@ class Window (PyQt4.QtGui.QMainWindow):
         self.time_per_point = config.rates[self.tbase_index]  #### THIS IS FOR DAQ THREAD
 
 
+    #----------------------------------------------------------------------------------
+
+    def check_sample_rates (self):
+        ''' This method finds out how long it takes to read a row of the chosen 
+        channels, from the cache if they've been timed on this board before or else by
+        having the data acquisition thread read a few rows. Those are read in that
+        thread while the GUI carries on, and the answer comes back through the
+        commandDone signal to row_time_measured ().
+        '''
+
+        if not self.serial_port_ready or not self.measurands:
+            self.show_sample_rates (None)
+            return
+
+        row_time = self.rate_cache.get (self.board_name, self.measurands)
+        if row_time is not None:
+            self.show_sample_rates (row_time)
+            return
+
+        # Remember which board and channels are being timed, as they may have been
+        # changed again by the time the answer comes
+        rate_key = (self.board_name, list (self.measurands))
+
+        def row_time_done (request):
+            request.rate_key = rate_key
+            self.command_finished (request)
+
+        self.my_acq_thread.queue_row_time (config.rate_probe_rows, row_time_done)
+
+
+    #----------------------------------------------------------------------------------
+
+    def row_time_measured (self, request):
+        ''' This method is given the finished request for a row time which
+        check_sample_rates () asked for. The time is cached, and if the same channels
+        are still chosen on the same board, the timebase box is brought up to date.
+        '''
+
+        board_name, measurands = request.rate_key
+
+        row_time = None
+        if request.error is not None:
+            self.statusBox.append ("Couldn't time rows of these channels: "
+                                   + str (request.error))
+            self.statusBox.moveCursor (PyQt4.QtGui.QTextCursor.End)
+        elif request.result is not None:
+            row_time = request.result
+            self.rate_cache.put (board_name, measurands, row_time)
+
+        if board_name == self.board_name and measurands == self.measurands:
+            self.show_sample_rates (row_time)
+
+
+    #----------------------------------------------------------------------------------
+
+    def show_sample_rates (self, row_time):
+        ''' This method marks and grays out the sample times in the timebase box which
+        are too short for rows which take row_time seconds to read. If the current 
+        sample time is one of them, the fastest one which isn't is chosen.
+        '''
+
+        # If there's no row time, as in streaming mode, every rate is offered
+        if row_time is None:
+            sustainable = [True] * len (config.rates)
+        else:
+            sustainable = PolyDAQ_Rate_Probe.sustainable_rates (config.rates, row_time)
+
+        for index, a_rate in enumerate (config.rates):
+            self.timebase_box.model ().item (index).setEnabled (sustainable[index])
+            if sustainable[index]:
+                self.timebase_box.setItemText (index, str (a_rate))
+            else:
+                self.timebase_box.setItemText (index, str (a_rate) + ' (too fast)')
+
+        if row_time is not None:
+            self.statusBox.append ('Fastest sample time for these channels: about ' 
+                + '{:.3f}'.format (PolyDAQ_Rate_Probe.fastest_interval (row_time)) 
+                + ' s')
+            self.statusBox.moveCursor (PyQt4.QtGui.QTextCursor.End)
+
+            current_index = self.timebase_box.currentIndex ()
+            if current_index >= 0 and not sustainable[current_index] \
+                    and True in sustainable:
+                self.timebase_box.setCurrentIndex (sustainable.index (True))
+
+
 
     #----------------------------------------------------------------------------------
 
@@ -689,6 +931,89 @@ class Window (PyQt4.QtGui.QMainWindow):
             self.statusBox.moveCursor (PyQt4.QtGui.QTextCursor.End)
 
 
+    #----------------------------------------------------------------------------------
+
+    def trigger_on_or_off (self):
+        ''' This method enables the trigger settings when triggered capture is 
+        checked and grays them out when it isn't. The upper level is only used by a
+        window trigger.
+        '''
+
+        trigger_on = self.trigger_cbox.isChecked ()
+
+        for a_widget in (self.trigger_channel_box, self.trigger_kind_box,
+                         self.trigger_level_lbl, self.trigger_level_box,
+                         self.trigger_time_lbl, self.pre_trigger_box,
+                         self.post_trigger_box):
+            a_widget.setEnabled (trigger_on)
+
+        window_on = trigger_on and self.trigger_kind_box.currentText () == 'window'
+        self.trigger_upper_lbl.setEnabled (window_on)
+        self.trigger_upper_box.setEnabled (window_on)
+
+
+    #----------------------------------------------------------------------------------
+
+    def close_raw_recorder (self):
+        ''' This method stops saving raw readings and closes the raw file, if one is
+            open, saying in the status box where it went.
+            '''
+
+        if self.raw_recorder is None:
+            return
+
+        self.my_acq_thread.set_raw_recorder (None)
+        self.raw_recorder.close ()
+        self.statusBox.append ('Raw readings saved in ' + self.raw_recorder.file_name)
+        self.raw_recorder = None
+
+
+    #----------------------------------------------------------------------------------
+
+    def make_trigger (self):
+        ''' This method makes a capture trigger from the trigger settings, or returns
+        None if triggered capture isn't checked. The trigger channel must be one of
+        the channels being recorded; if it isn't, or the settings don't make sense, 
+        the user is told and False is returned.
+        '''
+
+        if not self.trigger_cbox.isChecked ():
+            return None
+
+        # Find where the trigger channel is in the list of channels being recorded,
+        # which holds the checked channels in order
+        channel_number = 0
+        checked_before = 0
+        measurand_index = None
+        for a_plot in config.plots:
+            for a_channel in a_plot['channels']:
+                if a_channel['cbox'].isChecked ():
+                    if channel_number == self.trigger_channel_box.currentIndex ():
+                        measurand_index = checked_before
+                    checked_before += 1
+                channel_number += 1
+
+        if measurand_index is None:
+            PyQt4.QtGui.QMessageBox.critical (self, 'Error',
+                                              'The trigger channel is not selected!', 
+                                              PyQt4.QtGui.QMessageBox.Ok)
+            return False
+
+        try:
+            trigger = PolyDAQ_Trigger.capture_trigger (measurand_index,
+                            str (self.trigger_kind_box.currentText ()),
+                            self.trigger_level_box.value (),
+                            self.trigger_upper_box.value (),
+                            self.pre_trigger_box.value (),
+                            self.post_trigger_box.value ())
+        except ValueError as error:
+            PyQt4.QtGui.QMessageBox.critical (self, 'Error', str (error), 
+                                              PyQt4.QtGui.QMessageBox.Ok)
+            return False
+
+        return trigger
+
+
     #----------------------------------------------------------------------------------
 
     def createStartStopGroup (self):
@@ -774,6 +1099,11 @@ class Window (PyQt4.QtGui.QMainWindow):
                                               PyQt4.QtGui.QMessageBox.Ok)
                 return
 
+            # If capture is triggered, make sure the trigger makes sense
+            trigger = self.make_trigger ()
+            if trigger is False:
+                return
+
             # If port is ready, tell the data acquisition thread to get to work
             if (self.serial_port_ready):
 
@@ -785,10 +1115,6 @@ class Window (PyQt4.QtGui.QMainWindow):
 
                 self.running = True
 
-                # Tells 'idle' method that initial data array is empty; variable used
-                # as a way to see if array has been added to
-                self.previous_length = 0
-
                 self.data_file = open (self.file_path + '/' + self.file_name, 'w', 1024)
 
                 self.data_file.write ('PolyDAQ data collection began:' + ',' 
@@ -796,6 +1122,11 @@ class Window (PyQt4.QtGui.QMainWindow):
 
                 self.data_file.write ('Data Acquired at Station ' + str(config.station) + '.\n')
 
+                # Say which calibrations the data was worked out with, so that if
+                # they're corrected later, it's known which runs need fixing
+                calibration_id = PolyDAQ_Calibration.default_registry ().set_id ()
+                self.data_file.write ('Calibration set:,' + calibration_id + '\n')
+
 #                self.data_file.write ('Calibration Constants...')
 #                for a_plot in config.plots:
 #                    for a_channel in a_plot['channels']:
@@ -819,11 +1150,26 @@ class Window (PyQt4.QtGui.QMainWindow):
                                                               (',' + a_channel['name'])
                 self.data_file.write (',Notes\n')  
 
+                # Save the raw readings beside the data file, if asked to, so the run
+                # can be recalibrated with PolyDAQ_Recalibrate.py if need be
+                self.raw_recorder = None
+                if config.record_raw_counts:
+                    channel_names = [a_channel['name'] for a_plot in config.plots
+                                     for a_channel in a_plot['channels']
+                                     if a_channel['cbox'].isChecked ()]
+                    raw_file_name = os.path.splitext (self.file_name)[0] + '.' \
+                                    + config.raw_file_extension
+                    self.raw_recorder = PolyDAQ_Raw_Record.raw_count_writer \
+                                        (self.file_path + '/' + raw_file_name,
+                                         self.measurands, calibration_id,
+                                         config.station, channel_names)
+                self.my_acq_thread.set_raw_recorder (self.raw_recorder)
 
 #New from Plot Manager:
 
                 self.myManager.resetDisplays ()
 
+                self.my_acq_thread.set_trigger (trigger)
                 self.my_acq_thread.start_taking_data ()
                 self.addNote.setEnabled (True)
                 self.start_time = time.time ()
@@ -836,6 +1182,8 @@ class Window (PyQt4.QtGui.QMainWindow):
                 self.statusBox.append ('\nAcquiring data.')
                 self.statusBox.append ('Recording started ' + time.strftime \
                                                 ('%a, %m/%d/%y at %I:%M%p') + '.\n')
+                if trigger is not None:
+                    self.statusBox.append (trigger.status_text ())
                 self.statusBox.append ('\n')
                 self.eraseThisManyCharacters = 0
                 self.statusBox.moveCursor (PyQt4.QtGui.QTextCursor.End)
@@ -849,9 +1197,15 @@ class Window (PyQt4.QtGui.QMainWindow):
                         
             self.my_acq_thread.stop_taking_data ()
 
+            # Save the rows which came in since the last idle pass, so the end of
+            # the run isn't left out of the file
+            new_rows = self.my_acq_thread.read_new_rows ()
+            if (len (new_rows) > 0):
+                self.saveNewRows (new_rows)
 
-            # close the data file
+            # close the data file, and the raw file if there is one
             self.data_file.close ()
+            self.close_raw_recorder ()
 
             # Reset the Start button 
             
@@ -864,6 +1218,7 @@ class Window (PyQt4.QtGui.QMainWindow):
             self.statusBox.append ('\nRecording stopped ' 
                                     + time.strftime ("%a, %m/%d/%y at %I:%M%p")+'.')
             self.statusBox.append ('\nData saved to file ' + '"'+self.file_name+'"' )
+            self.statusBox.append (self.my_acq_thread.timing_text ())
                                     	
             self.statusBox.moveCursor (PyQt4.QtGui.QTextCursor.End)
 
@@ -873,7 +1228,8 @@ class Window (PyQt4.QtGui.QMainWindow):
 
 #New from Plot Manager
             self.myManager.reattachAllDataToAllPlots (self.my_acq_thread.time_array, \
-                                           self.my_acq_thread.data_array, self.running)
+                                           self.my_acq_thread.data_array, self.running, \
+                                           self.my_acq_thread.due_array)
             self.running = False
 
             #This "tries" to close the earmark window if it was left open
@@ -951,19 +1307,10 @@ class Window (PyQt4.QtGui.QMainWindow):
 
             if reply == PyQt4.QtGui.QMessageBox.Ok:
 
-                # balance the bridges
-                
-
-
-                response_string = self.my_acq_thread.balance_bridge ('L');
-                self.statusBox.append (response_string)
-                self.statusBox.moveCursor (PyQt4.QtGui.QTextCursor.End)
-
-                time.sleep (1)
-
-                response_string = self.my_acq_thread.balance_bridge ('M');
-                self.statusBox.append (response_string)
-                self.statusBox.moveCursor (PyQt4.QtGui.QTextCursor.End)                
+                # balance the bridges. The balances are queued, one after the other,
+                # and each one's answer shows up in the status box when it comes
+                self.my_acq_thread.queue_balance ('L', self.command_finished)
+                self.my_acq_thread.queue_balance ('M', self.command_finished)
                 
 
 
@@ -979,6 +1326,42 @@ class Window (PyQt4.QtGui.QMainWindow):
 #                    event.ignore ()
 
 
+    #----------------------------------------------------------------------------------
+    # This function asks the board which version it is; the answer shows up in the 
+    # status box when it comes.
+
+    def ask_board_version (self):
+
+        self.my_acq_thread.queue_version (self.command_finished)
+
+
+    #----------------------------------------------------------------------------------
+    # This function is given to the data acquisition thread to call when a command is
+    # done. It's called from that thread, so all it does is send a signal to this one.
+
+    def command_finished (self, request):
+
+        self.emit (PyQt4.QtCore.SIGNAL ("commandDone(PyQt_PyObject)"), request)
+
+
+    #----------------------------------------------------------------------------------
+    # This function shows what came of a command in the status box.
+
+    def show_command_result (self, request):
+
+        # A row time asked for by check_sample_rates () goes to the timebase box
+        if getattr (request, 'rate_key', None) is not None:
+            self.row_time_measured (request)
+            return
+
+        if request.error is not None:
+            self.statusBox.append ('Command ' + repr (request.command) + ': '
+                                   + request.error)
+        elif request.result is not None:
+            self.statusBox.append (str (request.result).strip ())
+        self.statusBox.moveCursor (PyQt4.QtGui.QTextCursor.End)
+
+
     #----------------------------------------------------------------------------------
     # This function opens a dialog that allows users to add a memo to the data file at any time.  The note 
     # will appear to the right of the last column, at the moment in time the user clicks "add note."
@@ -1058,6 +1441,61 @@ class Window (PyQt4.QtGui.QMainWindow):
 
 
 
+    #==================================================================================
+
+    def saveNewRows (self, new_rows):
+        ''' This method writes rows just taken from the data acquisition thread to the
+        data file, along with any earmark note, and updates the current data boxes and
+        the plots' ranges. It's used by idleProcess() as rows come in and once more 
+        when a run is stopped, so the last rows the thread took aren't lost.
+        '''
+
+        # Each row holds its time in the first column and a reading from
+        # every channel which is active (only those were read) after that
+        time_copy = new_rows[:, 0]
+        data_copy = new_rows[:, 1:]
+
+        # Go through the just-copied data, writing the data we have just
+        # grabbed to the data file and updating the current data boxes
+        for row_index in range (len (new_rows)):
+
+            ch_count = 0
+            # Write the time and every active channel's reading (only those
+            # were read) to the current line in the data file
+            self.data_file.write (PolyDAQ_Data_Store.csv_row_text \
+                                  (time_copy[row_index], data_copy[row_index]))
+
+            # For every channel which is active, update readout
+            for a_plot in config.plots:
+                for a_channel in a_plot['channels']:
+                    if a_channel['cbox'].isChecked ():
+                        data = (data_copy[row_index])[ch_count]
+
+                        # A channel which wasn't read in this row holds
+                        # NaN, which isn't equal even to itself; its
+                        # readout keeps showing its last reading
+                        if data == data:
+                            a_channel['readout'].setText ('{:.4f}'.format (data))
+
+                            if data < a_plot['ymin']:
+                                a_plot['ymin'] = data     # Also check if we have
+                            if data > a_plot['ymax']:        # a new min. or max.
+                                a_plot['ymax'] = data
+                        ch_count += 1
+
+            # Add earmark if there is one!
+            if self.note <> '':
+                self.data_file.write (','+ str (self.note))
+
+                self.earmarkStatus.setText('          The following note: \n\n              '+ self.note + '\n\n          was added at approx. '+ \
+                                           str ('{:.3f}'.format (time_copy[row_index]*self.timeConversionFactor))+ ' '+self.units_string)
+                self.note = ''
+
+            # Carriage return at the end of the set of data
+            self.data_file.write ('\n')
+
+
+
     #==================================================================================
 
     def idleProcess (self):
@@ -1072,99 +1510,22 @@ class Window (PyQt4.QtGui.QMainWindow):
 
         if self.running: 
 
-            # Lock the data acquisition task for a moment and check array sizes
-            self.my_acq_thread.data_lock.acquire ()
-            self.current_length = len (self.my_acq_thread.time_array)
-            self.my_acq_thread.data_lock.release ()
-
-            
+            # Take every row the data acquisition thread has finished since last time
+            # out of the ring buffer. The ring is read without a lock; bringing the
+            # plotted arrays up to date takes the data lock only for as long as it
+            # takes to copy the new rows, so the GUI hardly holds up the thread
+            new_rows = self.my_acq_thread.read_new_rows ()
 
-            # Check if the data arrays have changed size; if so, update the plots and 
-            # file.  In other words, if array has grown...
-            
-            if (self.current_length > self.previous_length):
-                               
-                time_copy = []              # Holds a copy of each row's time reading
-                data_copy = []              # Holds copies of each row's channel data
-                row_index = 0               # Which row is being worked with now
-
-#                # Lock the data acquisition task for a moment and check array sizes
-#                self.my_acq_thread.data_lock.acquire ()
-#                self.current_length = len (self.my_acq_thread.time_array)
-
-#                self.my_acq_thread.data_lock.release ()
-
-                for num in range (self.previous_length, self.current_length):
-
-                    
-                    # channel count in the truncated channel list (only those read)
-                    ch_count = 0
-                    data_copy.append ([])
-
-                    # Put a lock on the data array so the acquisition task can't write
-                    # to the array at the same time as we are trying to read it
-                    self.my_acq_thread.data_lock.acquire ()
-
-                    # Get the time for this row
-                    time_copy.append (self.my_acq_thread.time_array[num])
-
-                    # For every channel which is active, grab a copy of its data
-                    for a_plot in config.plots:
-                        for a_channel in a_plot['channels']:
-                            if a_channel['cbox'].isChecked ():
-                                
-                                data_copy[row_index].append \
-                                        (self.my_acq_thread.data_array[ch_count][num])
-                                ch_count += 1
-
-                    # Release the lock on the data so the acquisition task can work
-                    self.my_acq_thread.data_lock.release ()
-
-                    # On to the next row
-                    row_index += 1
-
-                # Go through the just-copied data, this time writing the data we have
-                # just grabbed to the data file and updating the current data boxes
-                row_index = 0
-                for num in range (self.previous_length, self.current_length):
-
-                    ch_count = 0
-                    # Write the time to the current line in the data file
-                    self.data_file.write (str ('{:.3f}'.format (time_copy[row_index])))
-
-                    # For every channel which is active, update readout and write data
-                    for a_plot in config.plots:
-                        for a_channel in a_plot['channels']:
-                            if a_channel['cbox'].isChecked ():
-                                data = (data_copy[row_index])[ch_count]
-                                a_channel['readout'].setText ('{:.4f}'.format (data))
-                                self.data_file.write (',' + str (data))
-
-                                if data < a_plot['ymin']:
-                                    a_plot['ymin'] = data     # Also check if we have
-                                if data > a_plot['ymax']:        # a new min. or max.
-                                    a_plot['ymax'] = data
-                                ch_count += 1
-
-                    # Add earmark if there is one!
-                    if self.note <> '':
-                        self.data_file.write (','+ str (self.note))
-                        
-                        self.earmarkStatus.setText('          The following note: \n\n              '+ self.note + '\n\n          was added at approx. '+ \
-                                                   str ('{:.3f}'.format (time_copy[row_index]*self.timeConversionFactor))+ ' '+self.units_string)
-                        self.note = ''                    
-                    
-                    # Carriage return at the end of the set of data
-                    self.data_file.write ('\n')
-                    row_index += 1                
-
-                self.previous_length = self.current_length
-                
+            # If any new rows have come in, update the plots and file
+            if (len (new_rows) > 0):
 
+                # Write the rows to the data file and update the readouts
+                self.saveNewRows (new_rows)
 
 #New from Plot Manager...
                 self.myManager.updateDisplays (self.running, self.time_per_point,    \
-                        self.my_acq_thread.time_array, self.my_acq_thread.data_array)
+                        self.my_acq_thread.time_array, self.my_acq_thread.data_array, \
+                        self.my_acq_thread.due_array)
 
 # Display elapsed time in status box 
                 for indx in range (0, self.eraseThisManyCharacters+1):
@@ -1196,19 +1557,27 @@ class Window (PyQt4.QtGui.QMainWindow):
                 # Update the displays anyway, because you don't want to wait for
                 # the next data point (especially if the data rate is slow!)
                 self.myManager.updateDisplays (self.running, self.time_per_point,    \
-                        self.my_acq_thread.time_array, self.my_acq_thread.data_array)
+                        self.my_acq_thread.time_array, self.my_acq_thread.data_array, \
+                        self.my_acq_thread.due_array)
                 time.sleep (0.1)
 
+            # Once a triggered capture has everything it needs, stop and save it
+            if self.running and self.trigger_cbox.isChecked () \
+                    and self.my_acq_thread.trigger_state () == 'done':
+                self.start_or_stop ()
+
 
         # If it's not running, update the plots anyway...to keep graphics features like
         # time axes updating.
         else:   # even when not collecting data, user may want to look at curves or even manipulate blank plots.  This line keeps the plots updated.         
             self.myManager.updateDisplays(self.running, self.time_per_point, \
 #                                          [x*self.timeConversionFactor for x in self.my_acq_thread.time_array], self.my_acq_thread.data_array)
-                                         self.my_acq_thread.time_array, self.my_acq_thread.data_array)
+                                         self.my_acq_thread.time_array, self.my_acq_thread.data_array,
+                                         self.my_acq_thread.due_array)
 
             if self.unitsHaveChanged: #if so, you need to recalculate the time scale for the plot's curves.  This does that!
-                self.myManager.reattachAllDataToAllPlots(self.my_acq_thread.time_array, self.my_acq_thread.data_array, self.running)
+                self.myManager.reattachAllDataToAllPlots(self.my_acq_thread.time_array, self.my_acq_thread.data_array, self.running,
+                                                         self.my_acq_thread.due_array)
                 
 
             time.sleep (0.1)
@@ -1298,6 +1667,12 @@ class Window (PyQt4.QtGui.QMainWindow):
                                  'Selecting a faster rate will not cause an error; \n'+ \
                                  'the software will simply collect data as fast as it\n'+ \
                                  'can.  \n\n' +\
+                                 'When you choose channels, PolyDAQ times a few \n' + \
+                                 'readings and marks sample times which are too \n' + \
+                                 'fast for them.\n\n' + \
+                                 'For figures measured on this computer, run \n' + \
+                                 'PolyDAQ_Benchmark.py, which times every step \n' + \
+                                 'from the serial port to the plots.\n\n' + \
                                  'PolyDAQ saves the actual time step in the data \n' + \
                                  'file, so you can check the actual sample rate.' \
                                  , PyQt4.QtGui.QMessageBox.Ok)
@@ -1330,6 +1705,7 @@ class Window (PyQt4.QtGui.QMainWindow):
             if reply == PyQt4.QtGui.QMessageBox.Yes:
                 # close the data file
                 self.data_file.close ()
+                self.close_raw_recorder ()
                 sys.exit (0)     # this command works, whether it is an event or not
             else:
                 # if exit is called from the menu, it didn't come from an EVENT!
@@ -9,6 +9,46 @@ import time
 import serial
 import threading
 import new_config as config
+import PolyDAQ_Protocol
+import PolyDAQ_Pipeline
+import PolyDAQ_Stream
+import PolyDAQ_Scheduler
+import PolyDAQ_Data_Store
+import PolyDAQ_Ring_Buffer
+import PolyDAQ_Clock_Sync
+import PolyDAQ_Reconnect
+import PolyDAQ_Client
+import PolyDAQ_Calibration
+
+
+# The kinds of trouble which are counted for each channel: readings which never came,
+# readings which came but couldn't be made sense of, and leftover or stray characters
+# which had to be thrown away to get back in step with the board
+ERROR_KINDS = ['timeouts', 'parse_errors', 'resyncs']
+
+# What goes wrong when a serial port goes away in the middle of a run: PySerial
+# raises its own exception for some things, and the operating system's gets through
+# for others
+PORT_ERRORS = (serial.SerialException, OSError, IOError)
+
+# Between runs, how long the thread waits for more of a command's answer each time it
+# looks; short enough that a run can start right away
+COMMAND_WAIT_TIME = 0.05
+
+# During a run, commands are only looked at until this long before the next row is
+# due, so there's time to get ready for the row
+COMMAND_MARGIN = 0.002
+
+# This thread is the only one which talks to the board, except for the stream reader
+# while the board is streaming. Everything else it's asked to do waits in a queue in
+# order of priority: reading data comes first, then control commands which change
+# what the board does, then diagnostics which only ask it things
+PRIORITY_SCAN = 0
+PRIORITY_CONTROL = 1
+PRIORITY_DIAGNOSTIC = 2
+
+# The error given to a request which this thread didn't get done in time
+OWNER_TIMEOUT_ERROR = 'No answer from the data acquisition thread'
 
 
 #======================================================================================
@@ -27,10 +67,21 @@ class data_acq_thread (threading.Thread):
 
         threading.Thread.__init__ (self, name = "DataAcqThread")
 
-        # Create arrays to store data and a lock to prevent their corruption
+        # Create a store for the data and a lock to prevent its corruption. This
+        # thread only ever stores the raw A/D readings, leaving the arithmetic of
+        # calibration out of the loop which takes data; the readings are calibrated a
+        # block at a time by whoever reads them, into a second store which is kept
+        # up to date by the thread which uses it, with a lock of its own. Both stores
+        # are replaced with ones of the right width when a run starts
         self.data_lock = threading.Lock ()
-        self.time_array = []
-        self.data_array = [[]]
+        self.raw_store = PolyDAQ_Data_Store.sample_store (0)
+        self.store_lock = threading.Lock ()
+        self.store = PolyDAQ_Data_Store.sample_store (0)
+
+        # Each finished row is also put in a ring buffer, from which the GUI takes the
+        # new rows without any locking. It too is replaced when a run starts, and it
+        # too holds raw readings, which are calibrated as they're taken out
+        self.ring = PolyDAQ_Ring_Buffer.row_ring_buffer (1)
 
         # Save the starting value of the time interval between data points
         self.run_interval = run_interval
@@ -38,17 +89,103 @@ class data_acq_thread (threading.Thread):
         # Start up in the not-running state (not saving data)
         self.running = False
 
-        # Create the serial port object; it hasn't been set up yet
+        # Create the serial port object; it hasn't been set up yet. The same goes for
+        # the pipelined transport which is used to talk through it in pipeline mode
         self.serial_port = None
+        self.pipeline = None
+
+        # If the port goes away during a run, as when a USB cable is bumped, the run
+        # is put on hold and the supervisor thread looks for the board to come back.
+        # It's found again by the name and speed of its port, and recognized by what
+        # it says in answer to the "v" command
+        self.port_name = None
+        self.baud_rate = None
+        self.board_greeting = None
+        self.port_is_lost = False
+        self.supervisor = None
+        if config.auto_reconnect:
+            self.supervisor = PolyDAQ_Reconnect.port_supervisor_thread (self)
+            self.supervisor.start ()
+
+        # How long a command takes to get to the board, once it has been measured
+        self.latency = 0.0
+
+        # If the board timestamps its readings, this keeps track of how its clock
+        # lines up with ours; the scan methods leave the board time of each reading
+        # in the row they just took in sample_times
+        self.clock_sync = PolyDAQ_Clock_Sync.clock_sync_estimator ()
+        self.last_sync_time = None
+        self.sample_times = []
+
+        # A reading which doesn't come, or comes garbled, doesn't stop the run; it's
+        # stored as a gap and counted. The scan methods leave a list of what went
+        # wrong with each reading in the row they just took in sample_errors, and
+        # the counts for each measurand are kept in channel_errors
+        self.sample_errors = []
+        self.channel_errors = []
+
+        # In streaming mode a separate thread reads the frames the board sends; it
+        # only exists while data is being taken. Its frame decoder is kept after the
+        # run so its counts of bad and lost frames can be reported
+        self.stream_reader = None
+        self.stream_decoder = None
+        self.stream_start_us = None
+        self.stream_time_offset = 0.0
 
         # Set an empty list of things to measure; when someone calls the method
         # set_measurands(), this list will be filled or updated
         self.measurands = []
 
-        # Record the starting time, and set it as the most recent and next run times
+        # The calibrations for this station, and the function which turns each
+        # measurand's A/D readings into real units, looked up by its command when the
+        # measurands are set
+        self.calibrations = PolyDAQ_Calibration.default_registry ()
+        self.calibrators = {}
+
+        # If the raw readings are being saved, the writer which saves them
+        self.raw_recorder = None
+
+        # For each measurand, the time between its readings if it's to be read less
+        # often than every row (None if not), and the time of the run at which it's
+        # next due to be read
+        self.channel_intervals = []
+        self.next_due = []
+
+        # In triggered capture mode, this decides which rows are kept; otherwise
+        # every row is
+        self.trigger = None
+
+        # Record the starting time. The scheduler works out when each row of data is
+        # due, from a monotonic clock, and keeps count of late and missed samples
         self.start_time = time.time ()
-        self.next_run_time = self.start_time
-        self.last_run_time = self.start_time
+        self.scheduler = PolyDAQ_Scheduler.sample_scheduler (run_interval,
+                                                             config.overrun_policy)
+
+        # This event is set while data is being taken, so that the thread can sleep
+        # soundly the rest of the time. The wake event is set when a run is started
+        # or a command is queued, to get the thread out of bed
+        self.run_event = threading.Event ()
+        self.wake_event = threading.Event ()
+
+        # Commands other than the rows of a run, such as bridge balances, and calls
+        # to methods which use the port, are queued here for this thread to carry
+        # out in between rows, most urgent first. Each is kept as a list of its
+        # priority, a count which keeps equal priorities in order, the request, its
+        # timeout, when it was queued, and, for a method call, the method and its
+        # arguments. The command which has been sent and is waiting for its answer is
+        # current_command, and what has come of the answer so far is in command_rx.
+        # While it's waiting, rows are held off, since the board would only answer
+        # them after it and reading a row would throw its answer away
+        self.command_queue = []
+        self.command_count = 0
+        self.command_lock = threading.Lock ()
+        self.current_command = None
+        self.command_rx = ''
+        self.held_rows = 0
+
+        # How long each kind of command, and each row, has taken since the port was
+        # opened; this is used to decide which commands fit between rows
+        self.command_stats = PolyDAQ_Scheduler.latency_stats ()
 
         # Create a lock for the serial port. This lock will be used to prevent calls
         # to functions in this class from other threads from trying to use the serial
@@ -67,57 +204,604 @@ class data_acq_thread (threading.Thread):
             '''
 
         while (True):
-            # Check if it's time to take data yet; if so, do it and update the timer
-            now_time = time.time ()
-            if (now_time >= self.next_run_time):
-                self.next_run_time += self.run_interval
-
-                # If we're in data taking mode, take data and put it in the array; 
-                # if not, go to sleep for a while to save processor cycles
-                if (self.running and (self.serial_port != None)):
+            # If we're not in data taking mode, carry out any commands for the board,
+            # or if there aren't any, sleep until somebody starts a run or sends one
+            if not self.run_event.is_set ():
+                if self.commands_pending ():
+                    self.service_commands (COMMAND_WAIT_TIME)
+                else:
+                    self.wake_event.wait ()
+                    self.wake_event.clear ()
+                continue
+
+            # Until the next row is nearly due, carry out commands which can be done
+            # in time as they come in
+            self.service_between_rows ()
+
+            # Wait until exactly the time at which the next row is due; if the run is
+            # stopped in the meantime, go back to sleep
+            due_time = self.scheduler.wait_for_next ()
+            if due_time is not None:
+
+                # No row is taken while a command is waiting for its answer
+                if self.current_command is not None:
+                    self.held_rows += 1
+                    continue
+
+                now_time = self.scheduler.elapsed ()
+
+                # Take data and put it in the array. In streaming mode the stream 
+                # reader thread does the work instead
+                if (self.running and (self.serial_port != None)
+                        and not self.port_is_lost and config.scan_mode != 'stream'):
+                    # Channels with their own intervals aren't read in every row; if
+                    # none at all are due, there's no row this time
+                    due = self.due_channels (now_time)
+                    if not due:
+                        continue
+
+                    # Remember which run's store and ring buffer this row is for
+                    store = self.raw_store
+                    ring = self.ring
+
                     # Grab serial port lock so nobody else can butt in on our port use
                     self.serial_lock.acquire ()
 
-                    # Grab the global data lock so other threads can't mess with the
-                    # data arrays while this thread is writing to them
-                    self.data_lock.acquire ()
-
+                    port_failed = False
                     try:
-                        self.time_array += [(now_time - self.start_time)]
+                        values = self.scan_row (due)
 
-                        # For each item in the list of measurands, send the item as a
-                        # command to the PolyDAQ and get a string of data back
-                        for index, item in enumerate (self.measurands):
+                    # If the port has gone away, the row can't be finished
+                    except PORT_ERRORS:
+                        port_failed = True
 
+                    # No matter how the try block came out, we will get here
+                    finally:
+                        self.serial_lock.release ()
 
-                            # original data collection:
-                            self.serial_port.timeout = 0.20
-                            self.serial_port.flushInput()                # clear the buffer, or else channels get confused!
-                            self.serial_port.write (item)                # send the board the channel name
-                            response_string = self.serial_port.readline ()  # read its value
-                            #print ('response string, channel ', item[1], '= ', response_string)        #### JRR
-                            self.serial_port.timeout = 0
-
-                            # We should get a string containing an integer; find the
-                            # integer in the string. It is an A/D reading
-                            try:
-                                a2d_reading = int (response_string)
-#                                self.data_array[index] += [float(a2d_reading)*self.slopes[index]
- #                                                  + self.offsets[index]]
-                                self.data_array[index] += [config.calibrationEquation(a2d_reading,item)]
+                    # A row counts as a command too, queued when it fell due
+                    self.command_stats.add ('scan row', now_time - due_time,
+                                      self.scheduler.elapsed () - now_time, port_failed)
 
-                            except ValueError:
-                                a2d_reading = -99
+                    if port_failed:
+                        self.port_failed ()
+                        continue
 
-                                self.data_array[index] += -999e9
+                    # If the board timestamps its readings, the row's time is when
+                    # the board read its first channel
+                    if config.board_timestamps:
+                        now_time = self.board_row_time (now_time)
 
-                    # No matter how the outer try block came out, we will get here
+                    # Grab the global data lock just long enough to add the row, so
+                    # other threads can't change the store while it's being changed,
+                    # then hand the row to the GUI. If a new run was started while 
+                    # this row was being read, the row belongs to neither run and is
+                    # dropped
+                    self.data_lock.acquire ()
+                    try:
+                        if store is self.raw_store:
+                            self.keep_row (store, ring, now_time, values)
                     finally:
                         self.data_lock.release ()
-                        self.serial_lock.release ()
 
-            # Sleep until the next time this task is supposed to run
-            time.sleep (self.run_interval / 20.0)
+                    # Every so often, ping the board to keep the clock fit up to date
+                    if config.board_timestamps and (PolyDAQ_Scheduler.monotonic ()
+                            - self.last_sync_time > config.clock_sync_interval):
+                        try:
+                            self.sync_clock ()
+                        except PORT_ERRORS:
+                            self.port_failed ()
+
+
+    #----------------------------------------------------------------------------------
+
+    @property
+    def time_array (self):
+        ''' The times of the rows taken so far in this run, as a view of the
+            calibrated store's time column. The store is brought up to date each time
+            read_new_rows() finds new rows, so the view holds the rows read so far and
+            can be read without holding any lock.
+            '''
+
+        return self.store.time_view ()
+
+
+    @property
+    def data_array (self):
+        ''' A list holding, for each channel, a view of the calibrated readings taken
+            so far in this run. Like the time view, these can be read without a lock.
+            '''
+
+        return self.store.channel_views ()
+
+
+    @property
+    def due_array (self):
+        ''' A list holding, for each channel, a view of whether it was due to be read
+            in each row taken so far in this run, so the plots can tell a reading
+            which is missing from one which was never asked for.
+            '''
+
+        return self.store.due_views ()
+
+
+    #----------------------------------------------------------------------------------
+
+    def calibrate_store (self):
+        ''' This method brings the calibrated store up to date with the raw one. The
+            rows which have come in since the last time are copied out of the raw
+            store, with the data lock held only for as long as that takes, then
+            calibrated all at once and added to the calibrated store.
+            '''
+
+        self.store_lock.acquire ()
+        try:
+            self.data_lock.acquire ()
+            try:
+                raw_store = self.raw_store
+                store = self.store
+                start = len (store)
+                end = len (raw_store)
+                times = raw_store.time_view ()[start:end].copy ()
+                readings = raw_store.channels[:, start:end].T.copy ()
+            finally:
+                self.data_lock.release ()
+
+            if end > start:
+                store.append_rows (times, self.calibrate_readings (readings).T,
+                                   (readings != PolyDAQ_Data_Store.NOT_DUE).T)
+        finally:
+            self.store_lock.release ()
+
+
+    #----------------------------------------------------------------------------------
+
+    def calibrate_readings (self, readings):
+        ''' This method converts a block of raw A/D readings, one column for each
+            measurand and one row for each sample, into real units.
+            '''
+
+        return self.calibrations.calibrate_block (self.measurands, readings)
+
+
+    #----------------------------------------------------------------------------------
+
+    def new_ring (self, width):
+        ''' This method makes an empty ring buffer for a run, with room in each row
+            for the given number of items. A ring buffer in ordinary memory does the
+            job here; a class which needs the rows to go somewhere else, such as
+            memory shared with another process, can make it differently.
+            '''
+
+        return PolyDAQ_Ring_Buffer.row_ring_buffer (width, config.ring_buffer_rows)
+
+
+    #----------------------------------------------------------------------------------
+
+    def read_new_raw_rows (self):
+        ''' This method takes every row which has been finished since the last time
+            rows were read out of the ring buffer, raw readings and all. The rows come
+            back as a 2D array with the time in the first column and the channels
+            after it.
+            '''
+
+        return self.ring.drain ()
+
+
+    #----------------------------------------------------------------------------------
+
+    def read_new_rows (self):
+        ''' This method is called by the GUI to get every row which has been finished
+            since the last time it asked. The rows come back as a 2D array with the
+            time in the first column and the calibrated channels after it. If raw
+            readings are being recorded, the rows are written to the raw file first.
+            When new rows have come in, the calibrated store is brought up to date
+            too, so the views from time_array and friends take them in.
+            '''
+
+        new_rows = self.read_new_raw_rows ()
+        if len (new_rows) > 0:
+            if self.raw_recorder is not None:
+                self.raw_recorder.write_rows (new_rows)
+            new_rows[:, 1:] = self.calibrate_readings (new_rows[:, 1:])
+            self.calibrate_store ()
+
+        return new_rows
+
+
+    #----------------------------------------------------------------------------------
+
+    def set_raw_recorder (self, recorder):
+        ''' This method gives the thread a raw_count_writer from PolyDAQ_Raw_Record
+            to which the raw readings are written as the GUI reads rows, or None to
+            stop recording them.
+            '''
+
+        self.raw_recorder = recorder
+
+
+    #----------------------------------------------------------------------------------
+
+    def scan_row (self, due = None):
+        ''' This method asks the board for one row of data using whichever scan mode
+            the configuration file has chosen. It is called with the serial port lock
+            held, and returns a list of raw A/D readings, one for each measurand. If
+            given a list of the indices of the measurands which are due, only those
+            are read; the others get the marker for a reading which wasn't due, and
+            no board time.
+            '''
+
+        if due is None or len (due) == len (self.measurands):
+            measurands = self.measurands
+        else:
+            measurands = [self.measurands[index] for index in due]
+
+        if config.scan_mode == 'batch':
+            values = self.scan_batch (measurands)
+        elif config.scan_mode == 'pipeline':
+            values = self.scan_pipelined (measurands)
+        else:
+            values = self.scan_polled (measurands)
+
+        # Count whatever went wrong against the measurands it went wrong with
+        if measurands is self.measurands:
+            indices = range (len (self.measurands))
+        else:
+            indices = due
+        for place, index in enumerate (indices):
+            for an_error in self.sample_errors[place]:
+                self.channel_errors[index][an_error] += 1
+
+        if measurands is self.measurands:
+            return values
+
+        # Spread the readings out into a row with a place for every measurand
+        row = [PolyDAQ_Data_Store.NOT_DUE] * len (self.measurands)
+        row_times = [None] * len (self.measurands)
+        for place, index in enumerate (due):
+            row[index] = values[place]
+            row_times[index] = self.sample_times[place]
+        self.sample_times = row_times
+
+        return row
+
+
+    #----------------------------------------------------------------------------------
+
+    def due_channels (self, run_time):
+        ''' This method returns a list of the indices of the measurands which are due
+            to be read in a row taken at the given time into the run. A measurand
+            without an interval of its own, or with one no longer than the sample
+            time, is read in every row. The others are read in the row nearest to
+            each of their due times; if one has fallen more than a whole interval
+            behind, it starts over from now rather than trying to catch up.
+            '''
+
+        due = []
+
+        for index in range (len (self.measurands)):
+            if index >= len (self.channel_intervals):
+                interval = None
+            else:
+                interval = self.channel_intervals[index]
+
+            if not interval or interval <= self.run_interval:
+                due.append (index)
+
+            elif run_time >= self.next_due[index] - self.run_interval / 2.0:
+                due.append (index)
+                self.next_due[index] += interval
+                if self.next_due[index] < run_time:
+                    self.next_due[index] = run_time + interval
+
+        return due
+
+
+    #----------------------------------------------------------------------------------
+
+    def scan_polled (self, measurands = None):
+        ''' This method reads one row of data the original way, sending each item in
+            the list of measurands as a command to the PolyDAQ and waiting for the
+            string of data it sends back before going on to the next channel. It is
+            called from run() with the serial port lock held, and returns a list of 
+            raw A/D readings, one for each channel. It reads all the measurands
+            unless given a list of some of them.
+            '''
+
+        if measurands is None:
+            measurands = self.measurands
+
+        values = []
+        self.sample_times = []
+        self.sample_errors = []
+
+        # For each item in the list of measurands, send the item as a
+        # command to the PolyDAQ and get a string of data back
+        for index, item in enumerate (measurands):
+            errors = []
+
+            # Anything already waiting is left over from a late or stray response
+            if self.serial_port.inWaiting () > 0:
+                errors.append ('resyncs')
+
+            # original data collection:
+            self.serial_port.timeout = 0.20
+            self.serial_port.flushInput()                # clear the buffer, or else channels get confused!
+            self.serial_port.write (item)                # send the board the channel name
+            response_string = self.serial_port.readline ()  # read its value
+            #print ('response string, channel ', item[1], '= ', response_string)        #### JRR
+            self.serial_port.timeout = 0
+
+            # We should get a string containing an integer; find the
+            # integer in the string. It is an A/D reading, perhaps followed by the
+            # board's time for it
+            try:
+                a2d_reading, board_time = PolyDAQ_Protocol.split_timestamp \
+                                          (response_string)
+#                self.data_array[index] += [float(a2d_reading)*self.slopes[index]
+ #                                  + self.offsets[index]]
+                values.append (a2d_reading)
+                self.sample_times.append (board_time)
+
+            # Nothing at all means the board didn't answer in time; anything else
+            # is a garbled reading. Either way the row gets a gap for this channel
+            except ValueError:
+                if response_string.strip () == '':
+                    errors.append ('timeouts')
+                else:
+                    errors.append ('parse_errors')
+
+                values.append (PolyDAQ_Data_Store.NO_READING)
+                self.sample_times.append (None)
+
+            self.sample_errors.append (errors)
+
+        return values
+
+
+    #----------------------------------------------------------------------------------
+
+    def scan_batch (self, measurands = None):
+        ''' This method reads one row of data with a single batched scan command. The
+            whole list of measurands goes to the PolyDAQ in one write and all the
+            readings come back in one framed line, so a row costs one serial round 
+            trip rather than one per channel. It is called from run() with the serial
+            port lock held, and returns a list of raw A/D readings. It reads all the
+            measurands unless given a list of some of them.
+            '''
+
+        if measurands is None:
+            measurands = self.measurands
+
+        # The channels are read together, so leftovers thrown away before the scan
+        # are counted against the first of them
+        self.sample_errors = [[] for item in measurands]
+        if self.serial_port.inWaiting () > 0:
+            self.sample_errors[0].append ('resyncs')
+
+        self.serial_port.timeout = 0.20
+        self.serial_port.flushInput ()
+        self.serial_port.write (PolyDAQ_Protocol.batch_scan_command (measurands))
+        response_string = self.serial_port.readline ()
+        self.serial_port.timeout = 0
+
+        # If the response is missing, garbled or short, every channel in the row gets
+        # a gap, so the columns stay lined up with the time array
+        try:
+            readings, self.sample_times = PolyDAQ_Protocol.parse_batch_response \
+                                  (response_string, len (measurands), True)
+        except ValueError:
+            if response_string.strip () == '':
+                an_error = 'timeouts'
+            else:
+                an_error = 'parse_errors'
+            for errors in self.sample_errors:
+                errors.append (an_error)
+
+            self.sample_times = [None] * len (measurands)
+            return [PolyDAQ_Data_Store.NO_READING] * len (measurands)
+
+        return readings
+
+
+    #----------------------------------------------------------------------------------
+
+    def scan_pipelined (self, measurands = None):
+        ''' This method reads one row of data through the pipelined transport, which
+            keeps several tagged channel commands in flight at once and matches the
+            responses by sequence number. There's no flushing of the input buffer and
+            no fiddling with timeouts for each channel. It is called from run() with
+            the serial port lock held, and returns a list of raw A/D readings. It
+            reads all the measurands unless given a list of some of them.
+            '''
+
+        if measurands is None:
+            measurands = self.measurands
+
+        resyncs_before = self.pipeline.resyncs
+        responses = self.pipeline.transact (measurands)
+        values = []
+        self.sample_times = []
+        self.sample_errors = [[] for item in measurands]
+
+        # Stray lines can't be told apart by channel, so they're counted against the
+        # first channel of the row
+        if self.pipeline.resyncs > resyncs_before:
+            self.sample_errors[0] += ['resyncs'] * (self.pipeline.resyncs
+                                                    - resyncs_before)
+
+        for index, item in enumerate (measurands):
+            # A missing response is None: the board didn't answer in time
+            if responses[index] is None:
+                self.sample_errors[index].append ('timeouts')
+                values.append (PolyDAQ_Data_Store.NO_READING)
+                self.sample_times.append (None)
+                continue
+
+            try:
+                a2d_reading, board_time = PolyDAQ_Protocol.split_timestamp \
+                                          (responses[index])
+                values.append (a2d_reading)
+                self.sample_times.append (board_time)
+
+            except ValueError:
+                self.sample_errors[index].append ('parse_errors')
+                values.append (PolyDAQ_Data_Store.NO_READING)
+                self.sample_times.append (None)
+
+        return values
+
+
+    #----------------------------------------------------------------------------------
+
+    def sync_clock (self, num_pings = 1):
+        ''' This method pings the board a number of times, adding each exchange to the
+            clock fit. It returns the number of pings which were answered.
+            '''
+
+        answered = 0
+
+        self.serial_lock.acquire ()
+        try:
+            self.serial_port.timeout = 0.20
+            for a_ping in range (num_pings):
+                self.serial_port.flushInput ()
+                send_time = PolyDAQ_Scheduler.monotonic ()
+                self.serial_port.write (PolyDAQ_Protocol.PING_COMMAND)
+                response_string = self.serial_port.readline ()
+                receive_time = PolyDAQ_Scheduler.monotonic ()
+
+                try:
+                    board_time = PolyDAQ_Protocol.parse_ping_response (response_string)
+                except ValueError:
+                    continue
+
+                self.clock_sync.add_exchange (send_time, board_time, receive_time)
+                answered += 1
+
+            self.serial_port.timeout = 0
+        finally:
+            self.serial_lock.release ()
+
+        self.last_sync_time = PolyDAQ_Scheduler.monotonic ()
+
+        return answered
+
+
+    #----------------------------------------------------------------------------------
+
+    def board_row_time (self, host_time):
+        ''' This method works out the time of the row just taken from the board's 
+            timestamps: the time, from the start of the run, at which the first
+            channel which has a timestamp was read. Every channel in the row is given
+            that time. If there aren't any timestamps, or the clocks haven't been
+            synchronized, the row keeps the time it was given.
+            '''
+
+        if not self.clock_sync.synced ():
+            return host_time
+
+        stamped = [board_time for board_time in self.sample_times
+                   if board_time is not None]
+        if not stamped:
+            return host_time
+
+        return self.clock_sync.board_to_host (stamped[0]) - self.scheduler.start_time
+
+
+    #----------------------------------------------------------------------------------
+
+    def store_stream_row (self, timestamp_us, readings):
+        ''' This method is called by the stream reader thread with each good frame
+            from the board. The time of the row is the board's time, counted from the
+            first frame of the run, so it doesn't pick up any host or USB jitter.
+            '''
+
+        if self.stream_start_us is None:
+            self.stream_start_us = timestamp_us
+
+        row_time = self.stream_time_offset + (timestamp_us - self.stream_start_us) / 1e6
+
+        # The board sends every channel in every frame; channels which have their own
+        # intervals only keep the readings which are due
+        due = self.due_channels (row_time)
+        if not due:
+            return
+
+        values = [PolyDAQ_Data_Store.NOT_DUE] * len (self.measurands)
+        for index in due:
+            values[index] = readings[index]
+
+        self.data_lock.acquire ()
+        try:
+            self.keep_row (self.raw_store, self.ring, row_time, values)
+        finally:
+            self.data_lock.release ()
+
+
+    #----------------------------------------------------------------------------------
+
+    def keep_row (self, store, ring, row_time, values):
+        ''' This method puts a row of raw readings in the raw store and hands it to
+            the GUI through the ring buffer. In triggered capture mode the trigger
+            decides whether to keep it, and may hand back a batch of rows it was
+            holding from before the trigger. It's called with the data lock held.
+            '''
+
+        if self.trigger is None:
+            kept_rows = [(row_time, values)]
+        else:
+            kept_rows = self.trigger.process (row_time, values)
+
+        for kept_time, kept_values in kept_rows:
+            store.append_row (kept_time, kept_values)
+            ring.push (kept_time, kept_values)
+
+
+    #----------------------------------------------------------------------------------
+
+    def start_streaming (self):
+        ''' This method tells the board to start sending frames of the current
+            measurands at the current interval, and starts a stream reader thread to
+            catch them.
+            '''
+
+        self.stream_start_us = None
+
+        self.serial_lock.acquire ()
+        self.serial_port.flushInput ()
+        self.serial_port.write (PolyDAQ_Protocol.stream_start_command \
+                                (self.run_interval, self.measurands))
+        self.serial_lock.release ()
+
+        self.stream_reader = PolyDAQ_Stream.stream_reader_thread (self.serial_port,
+                                self.serial_lock, len (self.measurands),
+                                self.store_stream_row,
+                                error_function = self.port_failed)
+        self.stream_reader.start ()
+        self.stream_decoder = self.stream_reader.decoder
+
+
+    #----------------------------------------------------------------------------------
+
+    def stop_streaming (self):
+        ''' This method tells the board to stop sending frames, then stops the 
+            stream reader thread once it has taken in what was already on the way.
+            '''
+
+        # If the port has gone away the board can't be told, but then it isn't
+        # going to be sending anything here anyway
+        self.serial_lock.acquire ()
+        try:
+            self.serial_port.write (PolyDAQ_Protocol.STREAM_STOP_COMMAND)
+        except PORT_ERRORS:
+            pass
+        finally:
+            self.serial_lock.release ()
+
+        if self.stream_reader is not None:
+            self.stream_reader.stop ()
+            self.stream_reader = None
 
 
     #----------------------------------------------------------------------------------
@@ -126,18 +810,35 @@ class data_acq_thread (threading.Thread):
         ''' This method is used to set the serial port to which we're connecting.  It 
             opens (or attempts to open) the port; if successful, the port's ready; if 
             not, an error indication is given.  If the port is successfully opened, 
-            the other buttons will be activated. 
+            the other buttons will be activated. The work is done by this thread.
+            '''
+
+        return self.run_in_owner (self.open_serial_port, (port_name, baud_rate),
+                                  failed = [OWNER_TIMEOUT_ERROR, False])
+
+
+    #----------------------------------------------------------------------------------
+
+    def open_serial_port (self, port_name, baud_rate):
+        ''' This method opens the port for set_serial_port(), in this thread, and 
+            greets the board on it.
             '''
 
+        # Times measured on another port don't say anything about this one
+        self.command_stats = PolyDAQ_Scheduler.latency_stats ()
+
+        # Grab the serial port lock so nobody else can butt in on our port use, and
+        # make sure it's let go however the opening turns out
+        self.serial_lock.acquire ()
         try:
-            # Grab the serial port lock so nobody else can butt in on our port use
-            self.serial_lock.acquire ()
-                        
             # Port mode is 8 data bits, 1 stop bit, no parity, timeout = 0.  The zero
             # timeout means return immediately from a read rather than waiting
             self.serial_port = serial.Serial (port_name, baud_rate, serial.EIGHTBITS, 
                 serial.PARITY_NONE, serial.STOPBITS_ONE, 0)
-            self.serial_lock.release ()
+            self.pipeline = PolyDAQ_Pipeline.pipelined_transport (self.serial_port,
+                                                                  config.pipeline_depth)
+            self.port_name = port_name
+            self.baud_rate = baud_rate
 
         # If there was a problem opening the port, complain
         except serial.SerialException:
@@ -152,21 +853,203 @@ class data_acq_thread (threading.Thread):
         # No exception; greet the PolyDAQ and set it up. Use a timeout for getting a 
         # response to the "v" command.  Tell it to oversample!
         else:
-            self.serial_lock.acquire ()
+            init_response = self.greet_board ()
+            self.board_greeting = init_response
+
+        finally:
+            self.serial_lock.release ()
+
+        # If the board is to timestamp its readings, get a first idea of how its
+        # clock lines up with ours
+        if config.board_timestamps and init_response != '':
+            self.enable_timestamps ()
+
+        # If PolyDAQ doesn't respond, complain; otherwise we're ready to go
+        if init_response == '':
+            return ([("<b>ERROR:</b> No response from PolyDAQ \nStart again by clicking CHOOSE PORT."), False])
+            self.serial_port = None
+
+        # If we got this far, we can return a response string
+        return (["Connected to " + init_response, True])
+
+
+    #----------------------------------------------------------------------------------
+
+    def greet_board (self):
+        ''' This method asks the board on the serial port which version it is and
+            tells it how much to oversample. It returns what the board said, which is
+            an empty string if it said nothing. The caller must hold the serial lock.
+            '''
+
+        self.serial_port.timeout = 0.5
+        self.serial_port.write ("v")
+        response = self.serial_port.read (32)
+        self.serial_port.timeout = 0
+        self.serial_port.write ("O" + str(config.oversampling) + "\n")
+
+        return response
+
+
+    #----------------------------------------------------------------------------------
+
+    def run_time (self):
+        ''' This method returns the number of seconds since the run started.
+            '''
+
+        if config.scan_mode == 'stream':
+            return time.time () - self.start_time
+
+        return self.scheduler.elapsed ()
+
+
+    #----------------------------------------------------------------------------------
+
+    def port_failed (self):
+        ''' This method is called when the serial port stops working during a run.
+            Data taking is put on hold, a row with no readings marks where the gap in
+            the data begins, and the supervisor, if there is one, is told to look for
+            the board. Without a supervisor the run takes no more data.
+            '''
+
+        if self.port_is_lost or not self.running:
+            return
+        self.port_is_lost = True
+
+        run_time = self.run_time ()
+        self.data_lock.acquire ()
+        try:
+            self.keep_row (self.raw_store, self.ring, run_time,
+                           [PolyDAQ_Data_Store.NO_READING] * len (self.measurands))
+        finally:
+            self.data_lock.release ()
+
+        if self.supervisor is not None:
+            self.supervisor.port_lost (self.port_name, run_time)
+
+
+    #----------------------------------------------------------------------------------
+
+    def reconnect (self, port_name):
+        ''' This method tries to pick a run back up on the port port_name after the
+            old port was lost. The port is opened the way the old one was, and the
+            board on it must greet us the same way the old one did; it's then set up
+            again and data taking carries on into the same store and data file. It
+            returns True if the run is going again. The work is done by this thread.
+            '''
+
+        return self.run_in_owner (self.reopen_port, (port_name,), failed = False)
+
+
+    #----------------------------------------------------------------------------------
+
+    def reopen_port (self, port_name):
+        ''' This method does the work of reconnect(), in this thread.
+            '''
+
+        self.serial_lock.acquire ()
+        try:
+            try:
+                self.serial_port.close ()
+            except PORT_ERRORS:
+                pass
+
+            try:
+                self.serial_port = serial.Serial (port_name, self.baud_rate,
+                    serial.EIGHTBITS, serial.PARITY_NONE, serial.STOPBITS_ONE, 0)
+                greeting = self.greet_board ()
+            except PORT_ERRORS + (ValueError,):
+                return False
+
+            if greeting == '' or greeting.strip () != self.board_greeting.strip ():
+                self.serial_port.close ()
+                return False
+
+            self.pipeline = PolyDAQ_Pipeline.pipelined_transport (self.serial_port,
+                                                                  config.pipeline_depth)
+        finally:
+            self.serial_lock.release ()
+
+        # The board may have been reset, so its clock has to be fit all over again,
+        # and a stream has to be started again; its rows go on from the present time
+        try:
+            if config.board_timestamps:
+                self.clock_sync = PolyDAQ_Clock_Sync.clock_sync_estimator ()
+                self.enable_timestamps ()
+
+            if config.scan_mode == 'stream':
+                if self.stream_reader is not None:
+                    self.stream_reader.stop ()
+                self.stream_time_offset = self.run_time ()
+                self.start_streaming ()
+        except PORT_ERRORS:
+            return False
+
+        self.port_name = port_name
+        if self.supervisor is not None:
+            self.supervisor.port_back (port_name, self.run_time ())
+        self.port_is_lost = False
+
+        return True
+
+
+    #----------------------------------------------------------------------------------
+
+    def measure_latency (self, tries = 3):
+        ''' This method estimates how long it takes a command to get from here to the
+            PolyDAQ: half the shortest round trip of several "v" commands, in seconds.
+            The estimate is saved as well as returned. If the board never answers,
+            the latency is taken to be zero. The work is done by this thread.
+            '''
+
+        return self.run_in_owner (self.time_round_trips, (tries,), PRIORITY_DIAGNOSTIC,
+                                  0.0)
+
+
+    #----------------------------------------------------------------------------------
+
+    def time_round_trips (self, tries):
+        ''' This method does the work of measure_latency(), in this thread.
+            '''
+
+        shortest = None
+
+        self.serial_lock.acquire ()
+        try:
             self.serial_port.timeout = 0.5
-            self.serial_port.write ("v")
-            init_response = self.serial_port.read (32)
+            for attempt in range (tries):
+                self.serial_port.flushInput ()
+                sent_time = PolyDAQ_Scheduler.monotonic ()
+                self.serial_port.write ("v")
+                response_string = self.serial_port.readline ()
+                round_trip = PolyDAQ_Scheduler.monotonic () - sent_time
+
+                if response_string != '' and (shortest is None or round_trip < shortest):
+                    shortest = round_trip
+
             self.serial_port.timeout = 0
-            self.serial_port.write ("O" + str(config.oversampling) + "\n")
+        finally:
             self.serial_lock.release ()
 
-            # If PolyDAQ doesn't respond, complain; otherwise we're ready to go
-            if init_response == '':
-                return ([("<b>ERROR:</b> No response from PolyDAQ \nStart again by clicking CHOOSE PORT."), False])
-                self.serial_port = None
+        if shortest is None:
+            self.latency = 0.0
+        else:
+            self.latency = shortest / 2.0
 
-            # If we got this far, we can return a response string
-            return (["Connected to " + init_response, True])
+        return self.latency
+
+
+    #----------------------------------------------------------------------------------
+
+    def enable_timestamps (self):
+        ''' This method asks the board to timestamp its readings and pings it several
+            times to fit its clock against ours.
+            '''
+
+        self.serial_lock.acquire ()
+        self.serial_port.write (PolyDAQ_Protocol.timestamp_command (True))
+        self.serial_lock.release ()
+
+        self.sync_clock (8)
 
 
     #----------------------------------------------------------------------------------
@@ -178,11 +1061,143 @@ class data_acq_thread (threading.Thread):
             PolyDAQ to send back one A/D reading from channel 0. 
             '''
 
+        self.calibrations = PolyDAQ_Calibration.default_registry ()
+        self.calibrators = dict (zip (measurands,
+                                      self.calibrations.calibrators_for (measurands)))
         self.measurands = measurands
+        self.channel_intervals = []
+        self.reset_error_counts ()
 #        self.slopes = slopes
 #        self.offsets = offsets
         
 
+    #----------------------------------------------------------------------------------
+
+    def reset_error_counts (self):
+        ''' This method sets the counts of each kind of error for each measurand to
+            zero.
+            '''
+
+        self.channel_errors = [dict ([(an_error, 0) for an_error in ERROR_KINDS])
+                               for item in self.measurands]
+
+
+    #----------------------------------------------------------------------------------
+
+    def command_latency_report (self):
+        ''' This method returns a dictionary which holds, for each kind of command
+            this thread has carried out since the port was opened, rows included, how
+            many there were, how many failed, and how long they waited and took.
+            '''
+
+        return self.command_stats.report ()
+
+
+    #----------------------------------------------------------------------------------
+
+    def channel_error_counts (self):
+        ''' This method returns a list holding, for each measurand, a dictionary with
+            the measurand's command and the number of each kind of error it's had
+            since the run started.
+            '''
+
+        counts = []
+        for index, item in enumerate (self.measurands):
+            a_count = dict (self.channel_errors[index])
+            a_count['channel'] = item
+            counts.append (a_count)
+
+        return counts
+
+
+    #----------------------------------------------------------------------------------
+
+    def set_channel_intervals (self, intervals):
+        ''' This method sets, for each measurand, the time between its readings if
+            it's to be read less often than every row, or None if it's to be read in
+            every row. It must be called after set_measurands(), which forgets the
+            old intervals.
+            '''
+
+        self.channel_intervals = list (intervals)
+
+
+    #----------------------------------------------------------------------------------
+
+    def measure_row_time (self, num_rows = 5):
+        ''' This method finds out how long it really takes to read a row of the
+            measurands which have been set, by reading several rows one right after
+            another and timing each. It returns the middle one of the times, in
+            seconds, so one row held up by the operating system doesn't count. In
+            streaming mode the board sets its own pace, so there's nothing to measure
+            and None is returned, as it is if there's no port or no measurands or if
+            data is being taken. The work is done by this thread.
+            '''
+
+        return self.run_in_owner (self.time_rows, (num_rows,), PRIORITY_SCAN)
+
+
+    #----------------------------------------------------------------------------------
+
+    def queue_row_time (self, num_rows = 5, callback = None):
+        ''' This method has this thread do what measure_row_time() does, without
+            waiting for it; the request's result is the row time, or None.
+            '''
+
+        return self.queue_command ('time_rows', 'call', None, callback, PRIORITY_SCAN,
+                                   (self.time_rows, (num_rows,)))
+
+
+    #----------------------------------------------------------------------------------
+
+    def time_rows (self, num_rows):
+        ''' This method does the work of measure_row_time(), in this thread.
+            '''
+
+        if (self.serial_port == None or not self.measurands or self.running
+                or config.scan_mode == 'stream'):
+            return None
+
+        row_times = []
+
+        self.serial_lock.acquire ()
+        try:
+            for row in range (num_rows):
+                start_time = PolyDAQ_Scheduler.monotonic ()
+                self.scan_row ()
+                row_times.append (PolyDAQ_Scheduler.monotonic () - start_time)
+        finally:
+            self.serial_lock.release ()
+
+        row_times.sort ()
+
+        return row_times[len (row_times) // 2]
+
+
+    #----------------------------------------------------------------------------------
+
+    def set_trigger (self, trigger):
+        ''' This method turns on triggered capture with a capture_trigger object from
+            PolyDAQ_Trigger, or turns it off if given None. The trigger is armed each
+            time a run starts.
+            '''
+
+        self.trigger = trigger
+
+
+    #----------------------------------------------------------------------------------
+
+    def trigger_state (self):
+        ''' This method returns the state of the triggered capture: 'armed',
+            'triggered' or 'done', or None if capture isn't triggered.
+            '''
+
+        if self.trigger is None:
+            return None
+
+        return self.trigger.state
+
+
     #----------------------------------------------------------------------------------
 
     def set_interval (self, new_time_interval):
@@ -190,6 +1205,8 @@ class data_acq_thread (threading.Thread):
             '''
 
         self.run_interval = new_time_interval
+        self.scheduler.set_interval (new_time_interval)
+        self.wake_event.set ()
 
     #----------------------------------------------------------------------------------
 
@@ -199,22 +1216,53 @@ class data_acq_thread (threading.Thread):
             which each data point is recorded can be computed.
             '''
 
-        # Set up the timing variables which control when data is to be taken
+        # Record when the run started; the scheduler is started once the arrays are
+        # ready, since that's when data is to start being taken
         self.start_time = time.time ()
-        self.next_run_time = self.start_time
-        self.last_run_time = self.start_time
 
-        # Lock the data arrays, then initialize the data arrays. The main data array
-        # must be a list of empty lists; the number of lists is the number of data
-        # items to acquire each time data is acquired
+        # Lock the data stores, then replace them with empty ones which have a column
+        # for each of the data items to acquire each time data is acquired. The ring
+        # buffer gets a fresh start too, with room for the time and every item
+        self.store_lock.acquire ()
         self.data_lock.acquire ()
-        self.time_array = []
-        self.data_array = []
-        for item in enumerate (self.measurands):
-            self.data_array += [[]]
+        self.raw_store = PolyDAQ_Data_Store.sample_store (len (self.measurands))
+        self.store = PolyDAQ_Data_Store.sample_store (len (self.measurands),
+                                        due_flags = True)
+        self.ring = self.new_ring (1 + len (self.measurands))
         self.data_lock.release ()
+        self.store_lock.release ()
+
+        # Every channel is due in the first row, and nothing has gone wrong yet
+        self.next_due = [0.0] * len (self.measurands)
+        self.reset_error_counts ()
+        self.stream_decoder = None
+        self.stream_time_offset = 0.0
+        self.port_is_lost = False
+        self.held_rows = 0
+        if self.supervisor is not None:
+            self.supervisor.reset ()
+
+        # The trigger's levels are in real units, so it needs to calibrate the raw
+        # readings from its channel
+        if self.trigger is not None:
+            self.trigger.calibrator = self.calibrators[self.measurands
+                                                       [self.trigger.channel]]
+            self.trigger.arm ()
+
+        # Make sure the board is still timestamping; it forgets if it's been reset
+        if config.board_timestamps and self.serial_port != None:
+            self.run_in_owner (self.enable_timestamps)
+
+        if config.scan_mode == 'stream' and self.serial_port != None:
+            self.run_in_owner (self.start_streaming)
+
         self.running = True
 
+        if config.scan_mode != 'stream':
+            self.scheduler.start ()
+            self.run_event.set ()
+            self.wake_event.set ()
+
 
     #----------------------------------------------------------------------------------
 
@@ -224,45 +1272,415 @@ class data_acq_thread (threading.Thread):
             '''
 
         self.running = False
+        self.run_event.clear ()
+        self.scheduler.stop ()
+        self.wake_event.set ()
+
+        if self.stream_reader is not None:
+            self.run_in_owner (self.stop_streaming)
 
 
     #----------------------------------------------------------------------------------
 
-    def balance_bridge (self, command_string):
-        ''' This function will only be called for a PolyDAQ 2 with its D/A converter
-            based strain gauge bridge balancers. It asks the PolyDAQ 2 to run an 
-            auto-balance on one bridge and returns the string which the PolyDAQ sent 
-            over the serial port.
+    def timing_text (self):
+        ''' This method returns a line of text saying how well the last run kept to 
+            its sampling schedule: how many samples were taken, missed, and late.
             '''
 
-        # Grab serial port lock so nobody else can butt in on our port use, then 
-        # send the "L" and "M" commands to attempt auto-balance of each bridge
+        text = self.scheduler.timing_text ()
+        if config.board_timestamps:
+            text += '\n' + self.clock_sync.sync_text ()
+        if self.trigger is not None:
+            text += '\n' + self.trigger.status_text ()
+        if self.supervisor is not None and self.supervisor.gaps:
+            text += '\n' + self.supervisor.gap_text ()
+        if self.held_rows > 0:
+            text += '\n' + str (self.held_rows) + ' rows skipped while the board ' \
+                    + 'carried out commands'
+        if self.command_stats.report ():
+            text += '\n' + self.command_stats.latency_text ()
+        if self.stream_decoder is not None:
+            decoder = self.stream_decoder
+            text += '\nStream: ' + str (decoder.frames) + ' frames, ' \
+                    + str (decoder.crc_errors) + ' bad, ' + str (decoder.lost_frames) \
+                    + ' lost, ' + str (decoder.resyncs) + ' resyncs'
+
+        # Say which channels had trouble, if any did
+        troubles = []
+        for a_count in self.channel_error_counts ():
+            if sum ([a_count[an_error] for an_error in ERROR_KINDS]) > 0:
+                troubles.append (a_count['channel'] + ': '
+                                 + str (a_count['timeouts']) + ' timeouts, '
+                                 + str (a_count['parse_errors']) + ' garbled, '
+                                 + str (a_count['resyncs']) + ' resyncs')
+        if troubles:
+            text += '\nReading errors (left as gaps) on channel ' \
+                    + '; '.join (troubles)
+        if self.ring.overruns > 0:
+            text += '\nRing buffer full: ' + str (self.ring.overruns) \
+                    + ' rows not saved to file'
+
+        return text
+
+
+    #----------------------------------------------------------------------------------
+
+    def queue_command (self, command, answer_kind, timeout, callback = None,
+                       priority = PRIORITY_CONTROL, call = None):
+        ''' This method asks for a command to be sent to the board by this thread,
+            in between rows if a run is going, and returns a request object right
+            away. The answer kind is None for a command without an answer, 'line' for
+            one answered with a line, or 'balance' for one whose answer ends with a
+            line saying "balance". The request is done when its answer comes or
+            timeout seconds after it was sent; then its callback, if there is one, is
+            called from this thread with the request as its argument.
+
+            If call is given, it's a method and a tuple of its arguments; instead of
+            sending the command, this thread calls the method, and the request's
+            result is whatever the method returns. The command is then just the name
+            under which its times are kept.
+            '''
+
+        request = PolyDAQ_Client.polydaq_request (command, answer_kind, None, callback)
+
+        # The port belongs to the stream reader while the board is streaming, and
+        # it's no use queueing commands which can't be sent
+        if call is None and self.serial_port is None:
+            request.finish (error = 'Not connected')
+        elif call is None and self.stream_reader is not None:
+            request.finish (error = "Can't be sent while the board is streaming")
+        else:
+            self.command_lock.acquire ()
+            self.command_queue.append ([priority, self.command_count, request, timeout,
+                                        PolyDAQ_Scheduler.monotonic (), call])
+            self.command_count += 1
+            self.command_lock.release ()
+            self.wake_event.set ()
+
+        return request
+
+
+    #----------------------------------------------------------------------------------
+
+    def run_in_owner (self, method, arguments = (), priority = PRIORITY_CONTROL,
+                      failed = None):
+        ''' This method has this thread call one of its methods which uses the port,
+            waits for it, and returns what it returned. Called from this thread, or
+            before this thread has been started, the method is just called. If this
+            thread doesn't get it done within config.call_max_wait seconds, as when
+            it's stuck on a port which has died, it's given up on and failed is
+            returned.
+            '''
+
+        if threading.current_thread () is self or not self.is_alive ():
+            return method (*arguments)
+
+        request = self.run_command (method.__name__, 'call', None, priority,
+                                    (method, arguments))
+        if isinstance (request.error, Exception):
+            raise request.error
+        if request.error is not None:
+            return failed
+
+        return request.result
+
+
+    #----------------------------------------------------------------------------------
+
+    def commands_pending (self):
+        ''' This method returns True if there are commands waiting to be sent or
+            waiting for their answers.
+            '''
+
+        return self.current_command is not None or len (self.command_queue) > 0
+
+
+    #----------------------------------------------------------------------------------
+
+    def next_command (self, until):
+        ''' This method takes the most urgent command out of the queue which can be
+            expected to be done by the monotonic clock time until, or None if there
+            isn't one. A command which has waited longer than config.command_max_wait
+            is taken whether it can be done in time or not, so a slow one can't be put
+            off forever. If until is None, there's no hurry.
+            '''
+
+        now = PolyDAQ_Scheduler.monotonic ()
+
+        self.command_lock.acquire ()
+        try:
+            for entry in sorted (self.command_queue):
+                priority, count, request, timeout, queued_time, call = entry
+                expected = self.command_stats.expected (request.command) or 0.0
+
+                if (until is None or now + expected <= until
+                        or now - queued_time > config.command_max_wait):
+                    self.command_queue.remove (entry)
+                    return entry
+        finally:
+            self.command_lock.release ()
+
+        return None
+
+
+    #----------------------------------------------------------------------------------
+
+    def service_between_rows (self):
+        ''' This method is called by this thread during a run, after each row. Until
+            the next row is nearly due, it carries out the commands which can be done
+            in time, waking up to look at new ones as they're queued.
+            '''
+
+        while self.run_event.is_set ():
+            self.wake_event.clear ()
+            until = self.scheduler.next_deadline - COMMAND_MARGIN
+            if self.commands_pending ():
+                self.service_commands (until = until)
+
+            remaining = until - PolyDAQ_Scheduler.monotonic ()
+            if remaining <= 0.0 or not self.wake_event.wait (remaining):
+                return
+
+
+    #----------------------------------------------------------------------------------
+
+    def service_commands (self, wait_time = 0.0, until = None):
+        ''' This method is called by this thread to get on with the queued commands.
+            While no command is waiting for its answer, the next one which can be
+            done before the monotonic clock time until is carried out; then whatever
+            of the current command's answer has come in is taken, waiting up to
+            wait_time seconds for some, or until the time until if that's given.
+            Requests are finished, and their callbacks called, once the serial port
+            lock has been let go.
+            '''
+
+        while self.current_command is None:
+            entry = self.next_command (until)
+            if entry is None:
+                return
+
+            if not self.start_command (entry):
+                break
+
+        if self.current_command is None:
+            return
+
+        if until is not None:
+            wait_time = max (0.0, until - PolyDAQ_Scheduler.monotonic ())
+
+        self.read_command_answer (wait_time)
+
+
+    #----------------------------------------------------------------------------------
+
+    def start_command (self, entry):
+        ''' This method carries out a queued command: it calls the method, or sends
+            the command and, if there's an answer to wait for, makes it the current
+            command. It returns True if the command is done already.
+            '''
+
+        priority, count, request, timeout, queued_time, call = entry
+        request.queued_time = queued_time
+        request.sent_time = PolyDAQ_Scheduler.monotonic ()
+
+        if call is not None:
+            method, arguments = call
+            try:
+                result = method (*arguments)
+            except Exception as error:
+                self.finish_command (request, None, error)
+            else:
+                self.finish_command (request, result, None)
+            return True
+
+        port_failed = False
         self.serial_lock.acquire ()
-        self.serial_port.timeout = 0.20
+        try:
+            self.serial_port.flushInput ()
+            self.serial_port.write (request.command)
+            request.deadline = request.sent_time + timeout
+            self.command_rx = ''
+        except PORT_ERRORS:
+            port_failed = True
+        finally:
+            self.serial_lock.release ()
+
+        if port_failed:
+            self.finish_command (request, None, 'Serial port failed')
+            self.port_failed ()
+        elif request.answer_kind is None:
+            self.finish_command (request, None, None)
+        else:
+            self.current_command = request
+            return False
 
-        self.serial_port.write (command_string);
+        return True
 
-        while True:
-        
-            response_string = self.serial_port.readline ()
-            if "balance" in response_string:
+
+    #----------------------------------------------------------------------------------
+
+    def read_command_answer (self, wait_time):
+        ''' This method takes in whatever of the current command's answer has come,
+            waiting up to wait_time seconds for some, and finishes the command if
+            its answer is all there or its deadline has passed.
+            '''
+
+        request = self.current_command
+        result = None
+        error = None
+        port_failed = False
+
+        self.serial_lock.acquire ()
+        try:
+            self.serial_port.timeout = min (wait_time, max (0.0, request.deadline
+                                            - PolyDAQ_Scheduler.monotonic ()))
+            self.command_rx += self.serial_port.read (max (1,
+                                                self.serial_port.inWaiting ()))
+            self.serial_port.timeout = 0
+
+            # A balance may send other lines before the one which says how it went
+            while '\n' in self.command_rx:
+                a_line, self.command_rx = self.command_rx.split ('\n', 1)
+                if request.answer_kind == 'balance' and 'balance' not in a_line:
+                    continue
+                result = a_line.strip ()
                 break
 
-        self.serial_port.timeout = 0
-        self.serial_lock.release ()
+            if result is None and PolyDAQ_Scheduler.monotonic () >= request.deadline:
+                error = 'Timed out'
+
+        # If the port has gone away, so has any hope of an answer
+        except PORT_ERRORS:
+            error = 'Serial port failed'
+            port_failed = True
+
+        finally:
+            self.serial_lock.release ()
+
+        if result is not None or error is not None:
+            self.current_command = None
+            self.finish_command (request, result, error)
+
+        if port_failed:
+            self.port_failed ()
+
+
+    #----------------------------------------------------------------------------------
+
+    def finish_command (self, request, result, error):
+        ''' This method records how long a command took and finishes its request.
+            '''
+
+        self.command_stats.add (request.command, request.sent_time - request.queued_time,
+                          PolyDAQ_Scheduler.monotonic () - request.sent_time,
+                          error is not None)
+        request.finish (result, error)
+
+
+    #----------------------------------------------------------------------------------
+
+    def run_command (self, command, answer_kind, timeout, priority = PRIORITY_CONTROL,
+                     call = None):
+        ''' This method queues a command and waits until it's done, which can't be
+            much longer than its timeout unless other commands are ahead of it. It
+            returns the finished request. If the command isn't done within its
+            timeout and config.command_max_wait more, or config.call_max_wait for a
+            method call, which has no timeout, this thread must be stuck; the command
+            is taken out of the queue if it's still there, and the request finished
+            with an error.
+            '''
+
+        if timeout is None:
+            wait_limit = config.call_max_wait
+        else:
+            wait_limit = timeout + config.command_max_wait
+
+        done_event = threading.Event ()
+        request = self.queue_command (command, answer_kind, timeout,
+                                      lambda request: done_event.set (), priority, call)
+        if not done_event.wait (wait_limit):
+            self.drop_command (request)
+            request.finish (error = OWNER_TIMEOUT_ERROR)
+
+        return request
+
+
+    #----------------------------------------------------------------------------------
+
+    def drop_command (self, request):
+        ''' This method takes a request out of the command queue, if it's still
+            waiting there to be sent.
+            '''
+
+        self.command_lock.acquire ()
+        try:
+            self.command_queue[:] = [entry for entry in self.command_queue
+                                     if entry[2] is not request]
+        finally:
+            self.command_lock.release ()
 
-        return response_string
+
+    #----------------------------------------------------------------------------------
+
+    def queue_balance (self, command_string, callback = None):
+        ''' This method is only for a PolyDAQ 2 with its D/A converter based strain
+            gauge bridge balancers. It queues an auto-balance of one bridge, "L" or
+            "M"; the request's result is the line saying how it went.
+            '''
+
+        return self.queue_command (command_string, 'balance', config.balance_timeout,
+                                   callback)
+
+
+    #----------------------------------------------------------------------------------
+
+    def queue_version (self, callback = None):
+        ''' This method queues a "v" command; the request's result is the line in
+            which the board says what it is.
+            '''
+
+        return self.queue_command ("v", 'line', 0.5, callback)
+
+
+    #----------------------------------------------------------------------------------
+
+    def queue_reset (self, callback = None):
+        ''' This method queues an "R" command, asking the AVR to reset itself.
+            Reset functionality is currently NOT implemented on the PolyDAQ 2.
+            '''
+
+        def reset_sent (request):
+            # A reset starts the board's clock over, so the old clock fit is no good
+            self.clock_sync = PolyDAQ_Clock_Sync.clock_sync_estimator ()
+            if callback is not None:
+                callback (request)
+
+        return self.queue_command ("R", None, 0.5, reset_sent)
+
+
+    #----------------------------------------------------------------------------------
+
+    def balance_bridge (self, command_string):
+        ''' This function will only be called for a PolyDAQ 2 with its D/A converter
+            based strain gauge bridge balancers. It asks the PolyDAQ 2 to run an 
+            auto-balance on one bridge, waits for it, and returns the string which the
+            PolyDAQ sent over the serial port, or says what went wrong.
+            '''
+
+        request = self.run_command (command_string, 'balance', config.balance_timeout)
+        if request.error is not None:
+            return 'Bridge ' + command_string + ' balance failed: ' + request.error
+
+        return request.result
 
 
     #----------------------------------------------------------------------------------
 
     def reset_avr (self):
         ''' This method is called by the main GUI thread when its reset AVR button is 
-            pressed. It writes an "R" to the serial port, asking the AVR to reset 
+            pressed. It has an "R" sent to the serial port, asking the AVR to reset 
             itself.  Reset functionality is currently NOT implemented on the PolyDAQ 2.
             ''' 
 
-        self.serial_lock.acquire ()
-        self.serial_port.write ("R")
-        self.serial_lock.release ()
+        self.queue_reset ()
 
@@ -0,0 +1,527 @@
+#**************************************************************************************
+# File: PolyDAQ_Acq_Process.py
+#   This module runs data acquisition in a process of its own rather than a thread in
+#   the GUI's process, so that redrawing plots and writing files can't make it late.
+#   Rows of data come back through a ring buffer in shared memory, and commands such
+#   as start, stop, and balance go through a pipe.
+#
+#**************************************************************************************
+
+import time
+import multiprocessing
+import threading
+
+import new_config as config
+import PolyDAQ_A2D_thread
+import PolyDAQ_Client
+import PolyDAQ_Ring_Buffer
+import PolyDAQ_Data_Store
+import PolyDAQ_Calibration
+
+
+# The commands which the GUI may send through the control pipe; each is the name of
+# a method of the data acquisition thread in the other process
+CONTROL_COMMANDS = ['set_serial_port', 'set_measurands', 'set_channel_intervals',
+                    'set_trigger', 'trigger_state', 'set_interval',
+                    'start_taking_data', 'stop_taking_data', 'timing_text',
+                    'channel_error_counts', 'command_latency_report', 'measure_row_time', 'balance_bridge', 'reset_avr',
+                    'start_remote_command', 'remote_command_result']
+
+# How often the GUI's process asks whether a command it queued in the acquisition
+# process is done
+REMOTE_POLL_TIME = 0.05
+
+
+#======================================================================================
+
+class shared_ring_acq_thread (PolyDAQ_A2D_thread.data_acq_thread):
+    ''' Class which is an ordinary data acquisition thread, except that it puts the
+    rows it takes into a ring buffer in shared memory, where another process can
+    read them.
+    '''
+
+    def __init__ (self, run_interval, row_memory, index_memory, ring_rows):
+
+        self.row_memory = row_memory
+        self.index_memory = index_memory
+        self.ring_rows = ring_rows
+
+        # Commands queued for the other process, by number, so it can ask about them
+        self.remote_requests = {}
+        self.next_remote_number = 0
+
+        PolyDAQ_A2D_thread.data_acq_thread.__init__ (self, run_interval)
+
+
+    #----------------------------------------------------------------------------------
+
+    def new_ring (self, width):
+        ''' This method makes an empty ring buffer for a run in the shared memory. The
+            counters are reset here, before any rows are taken, so the reader in the
+            other process starts with a clean slate.
+            '''
+
+        ring = PolyDAQ_Ring_Buffer.row_ring_buffer (width, self.ring_rows,
+                                                    self.row_memory, self.index_memory)
+        ring.indices[:] = 0
+
+        return ring
+
+
+    #----------------------------------------------------------------------------------
+
+    def start_remote_command (self, method_name, arguments):
+        ''' This method queues a command with one of the queue methods, such as
+            queue_balance(), for the other process, and returns a number by which it
+            can ask about it. Request objects can't go through the pipe, callbacks
+            and all, so the other process keeps its own and asks how this one is
+            getting on.
+            '''
+
+        if method_name not in ['queue_balance', 'queue_version', 'queue_reset',
+                               'queue_row_time']:
+            raise ValueError ('Unknown queued command ' + repr (method_name))
+
+        number = self.next_remote_number
+        self.next_remote_number += 1
+        self.remote_requests[number] = getattr (self, method_name) (*arguments)
+
+        return number
+
+
+    #----------------------------------------------------------------------------------
+
+    def remote_command_result (self, number):
+        ''' This method returns None if the command with the given number isn't done
+            yet, or its result and error if it is; then it's forgotten.
+            '''
+
+        request = self.remote_requests[number]
+        if not request.done:
+            return None
+
+        del self.remote_requests[number]
+        return (request.result, request.error)
+
+
+#======================================================================================
+
+class data_acq_process (multiprocessing.Process):
+    ''' Class which runs data acquisition in a separate process.
+
+    The GUI uses an object of this class just as it would a data_acq_thread: it has
+    the same methods for choosing the port, channels and interval, starting and
+    stopping, and so on. Each of these sends the name of the method and its
+    arguments through a pipe to the other process, which calls that method of its own
+    data acquisition thread and sends back the result. Each call waits for its
+    answer, so by the time stop_taking_data() returns, no more rows are coming.
+
+    Rows of data come the other way through a ring buffer in shared memory. They
+    hold raw A/D readings, so the acquisition process never does any calibration
+    arithmetic; the GUI takes them with read_new_rows(), which calibrates each batch
+    of rows all at once and keeps a copy of the run in a store in this process, so
+    time_array and data_array work as they do for the thread.
+    '''
+
+    def __init__ (self, run_interval, max_channels):
+
+        multiprocessing.Process.__init__ (self, name = "DataAcqProcess")
+
+        self.run_interval = run_interval
+        self.max_channels = max_channels
+        self.ring_rows = config.ring_buffer_rows
+
+        # Shared memory big enough for a ring buffer with every channel turned on;
+        # runs with fewer channels use the first part of it. There are also two
+        # counters for the head and tail of the ring
+        self.row_memory = multiprocessing.RawArray ('d', self.ring_rows
+                                                    * (1 + max_channels))
+        self.index_memory = multiprocessing.RawArray ('I', 2)
+
+        # The control pipe, one end for each process, and a lock so that two threads
+        # in the GUI's process can't get their commands and answers mixed up
+        self.gui_end, self.acq_end = multiprocessing.Pipe ()
+        self.pipe_lock = threading.Lock ()
+
+        # The GUI's copy of the run's data, and its view of the shared ring buffer
+        self.data_lock = threading.Lock ()
+        self.store = PolyDAQ_Data_Store.sample_store (0)
+        self.ring = PolyDAQ_Ring_Buffer.row_ring_buffer (1, self.ring_rows,
+                                                         self.row_memory,
+                                                         self.index_memory)
+        self.measurands = []
+        self.calibrations = None
+        self.raw_recorder = None
+
+
+    #----------------------------------------------------------------------------------
+
+    def __getstate__ (self):
+        ''' On a system which can't fork, such as Windows, this object is pickled and
+            sent to the new process when it's started. Only the things which the
+            acquisition process needs are sent; locks can't be pickled anyway.
+            '''
+
+        state = self.__dict__.copy ()
+        for name in ['pipe_lock', 'data_lock', 'store', 'ring', 'gui_end',
+                     'calibrations', 'raw_recorder']:
+            del state[name]
+
+        return state
+
+
+    #----------------------------------------------------------------------------------
+
+    def run (self):
+        ''' This is the run method for the process; it runs in the other process. It
+            starts a data acquisition thread, then carries out commands from the
+            pipe until the GUI asks it to quit or goes away.
+            '''
+
+        acq_thread = shared_ring_acq_thread (self.run_interval, self.row_memory,
+                                             self.index_memory, self.ring_rows)
+        acq_thread.daemon = True
+        acq_thread.start ()
+
+        while True:
+            try:
+                command, arguments = self.acq_end.recv ()
+            except (EOFError, IOError):
+                break
+
+            if command == 'quit':
+                break
+
+            # Send back whatever the method returned; if it went wrong, send back the
+            # exception so it can be raised in the GUI's process
+            try:
+                if command not in CONTROL_COMMANDS:
+                    raise ValueError ('Unknown acquisition command ' + repr (command))
+                result = getattr (acq_thread, command) (*arguments)
+            except Exception as error:
+                result = error
+
+            self.acq_end.send (result)
+
+
+    #----------------------------------------------------------------------------------
+
+    def call (self, command, *arguments):
+        ''' This method sends a command to the acquisition process, waits for the
+            answer, and returns it.
+            '''
+
+        self.pipe_lock.acquire ()
+        try:
+            self.gui_end.send ((command, arguments))
+            result = self.gui_end.recv ()
+        finally:
+            self.pipe_lock.release ()
+
+        if isinstance (result, Exception):
+            raise result
+
+        return result
+
+
+    #----------------------------------------------------------------------------------
+
+    @property
+    def time_array (self):
+        ''' The times of the rows read so far in this run, from this process's store.
+            '''
+
+        return self.store.time_view ()
+
+
+    @property
+    def data_array (self):
+        ''' A list holding, for each channel, a view of the readings read so far in
+            this run, from this process's store.
+            '''
+
+        return self.store.channel_views ()
+
+
+    @property
+    def due_array (self):
+        ''' A list holding, for each channel, a view of whether it was due in each
+            row read so far in this run, from this process's store.
+            '''
+
+        return self.store.due_views ()
+
+
+    #----------------------------------------------------------------------------------
+
+    def read_new_rows (self):
+        ''' This method takes every row which the acquisition process has finished
+            since the last time out of the shared ring buffer. The rows are added to
+            this process's store and returned as a 2D array, time first, with the
+            readings calibrated. If raw readings are being recorded, the rows are
+            written to the raw file first.
+            '''
+
+        new_rows = self.ring.drain ()
+
+        if len (new_rows) > 0:
+            if self.raw_recorder is not None:
+                self.raw_recorder.write_rows (new_rows)
+            due = new_rows[:, 1:] != PolyDAQ_Data_Store.NOT_DUE
+            new_rows[:, 1:] = self.calibrations.calibrate_block (self.measurands,
+                                                                 new_rows[:, 1:])
+
+            self.data_lock.acquire ()
+            try:
+                self.store.append_rows (new_rows[:, 0], new_rows[:, 1:].T, due.T)
+            finally:
+                self.data_lock.release ()
+
+        return new_rows
+
+
+    #----------------------------------------------------------------------------------
+
+    def set_raw_recorder (self, recorder):
+        ''' This method gives this process a raw_count_writer to which the raw
+            readings are written as rows are read, or None to stop recording them.
+            The rows are read in this process, so the writer stays here.
+            '''
+
+        self.raw_recorder = recorder
+
+
+    #----------------------------------------------------------------------------------
+
+    def set_serial_port (self, port_name, baud_rate):
+        ''' This method asks the acquisition process to open the serial port. It
+            returns the same list of a message and a success flag the thread does.
+            '''
+
+        return self.call ('set_serial_port', port_name, baud_rate)
+
+
+    #----------------------------------------------------------------------------------
+
+    def set_measurands (self, measurands):
+        ''' This method sets the list of channel commands to be measured.
+            '''
+
+        if len (measurands) > self.max_channels:
+            raise ValueError ('Too many channels for the shared ring buffer')
+
+        self.measurands = list (measurands)
+        self.calibrations = PolyDAQ_Calibration.default_registry ()
+        self.call ('set_measurands', self.measurands)
+
+
+    #----------------------------------------------------------------------------------
+
+    def set_channel_intervals (self, intervals):
+        ''' This method sets, for each measurand, the time between its readings if
+            it's to be read less often than every row, or None.
+            '''
+
+        self.call ('set_channel_intervals', list (intervals))
+
+
+    #----------------------------------------------------------------------------------
+
+    def set_trigger (self, trigger):
+        ''' This method sends a capture trigger, or None, to the acquisition process.
+            The process works with its own copy of the trigger.
+            '''
+
+        self.call ('set_trigger', trigger)
+
+
+    #----------------------------------------------------------------------------------
+
+    def trigger_state (self):
+        ''' This method asks the acquisition process how its triggered capture is
+            going.
+            '''
+
+        return self.call ('trigger_state')
+
+
+    #----------------------------------------------------------------------------------
+
+    def set_interval (self, new_time_interval):
+        ''' This method sets the time interval between data points.
+            '''
+
+        self.run_interval = new_time_interval
+        self.call ('set_interval', new_time_interval)
+
+
+    #----------------------------------------------------------------------------------
+
+    def start_taking_data (self):
+        ''' This method empties this process's store and starts a run in the
+            acquisition process, which resets the shared ring buffer before it takes
+            the first row.
+            '''
+
+        width = 1 + len (self.measurands)
+
+        self.data_lock.acquire ()
+        self.store = PolyDAQ_Data_Store.sample_store (len (self.measurands),
+                                                      due_flags = True)
+        self.data_lock.release ()
+
+        self.call ('start_taking_data')
+
+        self.ring = PolyDAQ_Ring_Buffer.row_ring_buffer (width, self.ring_rows,
+                                                         self.row_memory,
+                                                         self.index_memory)
+
+
+    #----------------------------------------------------------------------------------
+
+    def stop_taking_data (self):
+        ''' This method stops the run in the acquisition process.
+            '''
+
+        self.call ('stop_taking_data')
+
+
+    #----------------------------------------------------------------------------------
+
+    def timing_text (self):
+        ''' This method returns the acquisition process's timing summary for the last
+            run.
+            '''
+
+        return self.call ('timing_text')
+
+
+    #----------------------------------------------------------------------------------
+
+    def command_latency_report (self):
+        ''' This method asks the acquisition process how long its commands to the
+            board have been taking.
+            '''
+
+        return self.call ('command_latency_report')
+
+
+    #----------------------------------------------------------------------------------
+
+    def channel_error_counts (self):
+        ''' This method asks the acquisition process how many reading errors of each
+            kind each measurand has had in this run.
+            '''
+
+        return self.call ('channel_error_counts')
+
+
+    #----------------------------------------------------------------------------------
+
+    def measure_row_time (self, num_rows = 5):
+        ''' This method asks the acquisition process how long it takes to read a row
+            of the measurands which have been set.
+            '''
+
+        return self.call ('measure_row_time', num_rows)
+
+
+    #----------------------------------------------------------------------------------
+
+    def queue_row_time (self, num_rows = 5, callback = None):
+        ''' This method has the acquisition process measure the row time without
+            waiting for it.
+            '''
+
+        return self.queue_remote ('queue_row_time', (num_rows,), callback)
+
+
+    #----------------------------------------------------------------------------------
+
+    def queue_remote (self, method_name, arguments, callback):
+        ''' This method queues a command in the acquisition process and returns a
+            request for it here right away. A little thread asks every so often
+            whether the command is done, and when it is, finishes the request, which
+            calls the callback from that thread.
+            '''
+
+        request = PolyDAQ_Client.polydaq_request (method_name, 'line', None, callback)
+        number = self.call ('start_remote_command', method_name, arguments)
+
+        def wait_for_result ():
+            while True:
+                answer = self.call ('remote_command_result', number)
+                if answer is not None:
+                    request.finish (answer[0], answer[1])
+                    return
+                time.sleep (REMOTE_POLL_TIME)
+
+        waiter = threading.Thread (target = wait_for_result, name = "RemoteCommandThread")
+        waiter.daemon = True
+        waiter.start ()
+
+        return request
+
+
+    #----------------------------------------------------------------------------------
+
+    def queue_balance (self, command_string, callback = None):
+        ''' This method queues a balance of one bridge in the acquisition process.
+            '''
+
+        return self.queue_remote ('queue_balance', (command_string,), callback)
+
+
+    #----------------------------------------------------------------------------------
+
+    def queue_version (self, callback = None):
+        ''' This method asks, through the acquisition process, which version the
+            board is.
+            '''
+
+        return self.queue_remote ('queue_version', (), callback)
+
+
+    #----------------------------------------------------------------------------------
+
+    def queue_reset (self, callback = None):
+        ''' This method queues a reset of the AVR in the acquisition process.
+            '''
+
+        return self.queue_remote ('queue_reset', (), callback)
+
+
+    #----------------------------------------------------------------------------------
+
+    def balance_bridge (self, command_string):
+        ''' This method asks the acquisition process to balance a bridge, returning
+            the PolyDAQ's response.
+            '''
+
+        return self.call ('balance_bridge', command_string)
+
+
+    #----------------------------------------------------------------------------------
+
+    def reset_avr (self):
+        ''' This method asks the acquisition process to reset the AVR.
+            '''
+
+        self.call ('reset_avr')
+
+
+    #----------------------------------------------------------------------------------
+
+    def quit (self):
+        ''' This method asks the acquisition process to finish, and waits until it
+            has.
+            '''
+
+        self.pipe_lock.acquire ()
+        try:
+            self.gui_end.send (('quit', ()))
+        finally:
+            self.pipe_lock.release ()
+
+        self.join ()
+
@@ -0,0 +1,394 @@
+#**************************************************************************************
+# File: PolyDAQ_Benchmark.py
+#   This program measures how fast data can really be taken. It runs the whole path a
+#   reading takes, from the serial port through the data acquisition thread, the file
+#   writer and, if there's a display, the plots, against a simulated board on a
+#   pseudo-terminal, for several channel counts, sample rates and run lengths. The
+#   results are written to a JSON file so they can be compared from one version of the
+#   software to the next.
+#
+#**************************************************************************************
+
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import multiprocessing
+
+import numpy
+
+import new_config as config
+import PolyDAQ_A2D_thread
+import PolyDAQ_Data_Store
+import PolyDAQ_Sim_Board
+
+# The resource module only exists on Unix; without it there's no memory figure
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# The version of the layout of the results file; change it when the layout changes
+RESULTS_FORMAT = 1
+
+# The GUI takes new rows out of the ring buffer about this often
+GUI_UPDATE_TIME = 0.1
+
+# The percentiles of the sample time jitter which are reported
+JITTER_PERCENTILES = [50, 90, 99]
+
+
+#--------------------------------------------------------------------------------------
+# This function runs in a process of its own. It puts a simulated board on a
+# pseudo-terminal, sends back the terminal's name, and keeps serving until told to
+# stop. Keeping the board in another process means the CPU time it uses isn't counted
+# as the acquisition's.
+
+def serve_sim_board (seed, port_queue, stop_event):
+
+    sim_server = PolyDAQ_Sim_Board.sim_pty_server (
+                     PolyDAQ_Sim_Board.sim_polydaq (seed = seed), make_link = False)
+    sim_server.start ()
+    port_queue.put (sim_server.port_name)
+
+    stop_event.wait ()
+    sim_server.stop ()
+
+
+#--------------------------------------------------------------------------------------
+# This function returns how much CPU time this process has used so far, in seconds,
+# counting both its own work and what the operating system did for it.
+
+def cpu_seconds ():
+
+    times = os.times ()
+
+    return times[0] + times[1]
+
+
+#--------------------------------------------------------------------------------------
+# This function returns the largest amount of memory this process has taken so far,
+# in kilobytes, or None where that can't be found out.
+
+def peak_memory_kb ():
+
+    if resource is None:
+        return None
+
+    peak = resource.getrusage (resource.RUSAGE_SELF).ru_maxrss
+
+    # The Mac gives the figure in bytes where Linux gives kilobytes
+    if sys.platform == 'darwin':
+        peak //= 1024
+
+    return peak
+
+
+#--------------------------------------------------------------------------------------
+# This function returns the list of channel dictionaries from the configuration, in
+# the order in which they appear in the GUI.
+
+def all_channels ():
+
+    return [a_channel for a_plot in config.plots for a_channel in a_plot['channels']]
+
+
+#======================================================================================
+
+class plot_load (object):
+    ''' Class which puts the GUI's plots on the screen so that the time it takes to
+    update them can be measured.
+
+    This needs PyQt4, Qwt and a display. If any of those is missing, the available
+    attribute is False and reason says why, and the benchmark leaves the plots out.
+    '''
+
+    def __init__ (self, wanted = True):
+
+        self.available = False
+        self.reason = None
+        self.manager = None
+
+        if not wanted:
+            self.reason = 'Turned off'
+            return
+
+        try:
+            import PyQt4.QtGui
+            import PolyDAQ_PlotManager
+        except ImportError as error:
+            self.reason = 'Cannot import the plotting modules: ' + str (error)
+            return
+
+        if sys.platform.startswith ('linux') and not os.environ.get ('DISPLAY'):
+            self.reason = 'No display to draw the plots on'
+            return
+
+        self.application = PyQt4.QtGui.QApplication.instance ()
+        if self.application is None:
+            self.application = PyQt4.QtGui.QApplication (sys.argv)
+
+        # The plots look at each channel's check box to see which curves to draw
+        for a_channel in all_channels ():
+            a_channel['cbox'] = PyQt4.QtGui.QCheckBox ()
+
+        self.manager = PolyDAQ_PlotManager.PlotManager (config, None)
+        self.manager.allPlotsAndReadouts.show ()
+        self.available = True
+
+
+    #----------------------------------------------------------------------------------
+
+    def choose_channels (self, num_channels):
+        ''' This method checks the check boxes of the first few channels, as the user
+            would in the GUI, and clears the plots for a new run.
+            '''
+
+        for a_plot in config.plots:
+            a_plot['numberOfCurves'] = 0
+
+        for index, a_channel in enumerate (all_channels ()):
+            a_channel['cbox'].setChecked (index < num_channels)
+
+        for a_plot in config.plots:
+            a_plot['numberOfCurves'] = len ([a_channel for a_channel in a_plot['channels']
+                                             if a_channel['cbox'].isChecked ()])
+
+        self.manager.resetDisplays ()
+
+
+    #----------------------------------------------------------------------------------
+
+    def update (self, interval, acq_thread):
+        ''' This method updates the plots with the data so far, as the GUI does each
+            time new rows come in, and lets Qt draw them.
+            '''
+
+        self.manager.updateDisplays (True, interval, acq_thread.time_array,
+                                     acq_thread.data_array, acq_thread.due_array)
+        self.application.processEvents ()
+
+
+#======================================================================================
+
+def run_one (acq_thread, plots, scan_mode, num_channels, interval, run_length):
+    ''' This function takes data for one run and returns a dictionary of the results:
+        how many rows and samples per second were taken, how far the times between
+        rows strayed from the interval, how much CPU time and memory were used, and
+        how long writing rows to a file and updating the plots took.
+        '''
+
+    config.scan_mode = scan_mode
+    measurands = [a_channel['command'] for a_channel in all_channels ()[:num_channels]]
+    acq_thread.set_measurands (measurands)
+    acq_thread.set_interval (interval)
+
+    if plots.available:
+        plots.choose_channels (num_channels)
+
+    # Rows go to a scratch file just as they would to the data file in the GUI
+    data_file = tempfile.TemporaryFile (mode = 'w')
+    rows_written = 0
+    write_time = 0.0
+    plot_times = []
+
+    memory_before = peak_memory_kb ()
+    cpu_before = cpu_seconds ()
+    start_time = time.time ()
+
+    acq_thread.start_taking_data ()
+
+    while True:
+        time.sleep (GUI_UPDATE_TIME)
+        running = time.time () - start_time < run_length
+        if not running:
+            acq_thread.stop_taking_data ()
+
+        new_rows = acq_thread.read_new_rows ()
+
+        write_start = time.time ()
+        for row in new_rows:
+            data_file.write (PolyDAQ_Data_Store.csv_row_text (row[0], row[1:]) + ',\n')
+        write_time += time.time () - write_start
+        rows_written += len (new_rows)
+
+        if plots.available and len (new_rows) > 0:
+            plot_start = time.time ()
+            plots.update (interval, acq_thread)
+            plot_times.append (time.time () - plot_start)
+
+        if not running:
+            break
+
+    wall_time = time.time () - start_time
+    cpu_time = cpu_seconds () - cpu_before
+    memory_after = peak_memory_kb ()
+    data_file.close ()
+
+    # How far each time between rows was from the interval which was asked for
+    times = numpy.array (acq_thread.time_array)
+    jitter = numpy.abs (numpy.diff (times) - interval) * 1000.0
+    if len (jitter) > 0:
+        jitter_ms = dict ([('p' + str (percentile),
+                            float (numpy.percentile (jitter, percentile)))
+                           for percentile in JITTER_PERCENTILES])
+        jitter_ms['max'] = float (jitter.max ())
+    else:
+        jitter_ms = None
+
+    if memory_before is None:
+        memory_growth_kb = None
+    else:
+        memory_growth_kb = memory_after - memory_before
+
+    return {'scan_mode'          : scan_mode,
+            'channels'           : num_channels,
+            'interval'           : interval,
+            'run_length'         : run_length,
+            'rows'               : len (times),
+            'rows_per_second'    : len (times) / wall_time,
+            'samples_per_second' : len (times) * num_channels / wall_time,
+            'requested_rows_per_second' : 1.0 / interval,
+            'jitter_ms'          : jitter_ms,
+            'timing'             : acq_thread.scheduler.timing_report (),
+            'ring_overruns'      : acq_thread.ring.overruns,
+            'channel_errors'     : acq_thread.channel_error_counts (),
+            'command_latency'    : acq_thread.command_latency_report (),
+            'cpu_percent'        : 100.0 * cpu_time / wall_time,
+            'peak_memory_growth_kb' : memory_growth_kb,
+            'store_bytes'        : acq_thread.store.nbytes (),
+            'rows_written'       : rows_written,
+            'csv_us_per_row'     : (1e6 * write_time / rows_written
+                                    if rows_written else None),
+            'plot_updates'       : len (plot_times),
+            'plot_ms_mean'       : (1000.0 * sum (plot_times) / len (plot_times)
+                                    if plot_times else None),
+            'plot_ms_max'        : 1000.0 * max (plot_times) if plot_times else None}
+
+
+#======================================================================================
+
+def run_benchmark (channel_counts, intervals, run_lengths, scan_modes, seed = 1,
+                   show_plots = True, progress = None):
+    ''' This function runs every combination of channel count, interval, run length
+        and scan mode against one simulated board and returns a dictionary holding
+        the settings, a description of the computer, and a list of the results of
+        each run. If given, progress is called with each run's results as it finishes.
+        '''
+
+    # The simulated board gets its own process so its CPU time isn't counted
+    port_queue = multiprocessing.Queue ()
+    stop_event = multiprocessing.Event ()
+    sim_process = multiprocessing.Process (target = serve_sim_board,
+                                           args = (seed, port_queue, stop_event))
+    sim_process.daemon = True
+    sim_process.start ()
+    port_name = port_queue.get (timeout = 10.0)
+
+    # There's no point asking for more channels than the configuration has
+    channel_counts = [count for count in channel_counts if count <= len (all_channels ())]
+
+    original_scan_mode = config.scan_mode
+    results = []
+
+    try:
+        acq_thread = PolyDAQ_A2D_thread.data_acq_thread (intervals[0])
+        acq_thread.daemon = True
+        acq_thread.start ()
+
+        [result_string, ready] = acq_thread.set_serial_port (port_name, config.baud_rate)
+        if not ready:
+            raise IOError ('Simulated board did not answer: ' + result_string)
+
+        plots = plot_load (show_plots)
+
+        for scan_mode in scan_modes:
+            for num_channels in channel_counts:
+                for interval in intervals:
+                    for run_length in run_lengths:
+                        a_result = run_one (acq_thread, plots, scan_mode, num_channels,
+                                            interval, run_length)
+                        results.append (a_result)
+                        if progress is not None:
+                            progress (a_result)
+
+    finally:
+        config.scan_mode = original_scan_mode
+        stop_event.set ()
+        sim_process.join (5.0)
+
+    return {'format'    : RESULTS_FORMAT,
+            'date'      : time.strftime ('%Y-%m-%d %H:%M:%S'),
+            'python'    : platform.python_version (),
+            'platform'  : platform.platform (),
+            'machine'   : platform.machine (),
+            'settings'  : {'channels'     : list (channel_counts),
+                           'intervals'    : list (intervals),
+                           'run_lengths'  : list (run_lengths),
+                           'scan_modes'   : list (scan_modes),
+                           'oversampling' : config.oversampling,
+                           'pipeline_depth' : config.pipeline_depth,
+                           'overrun_policy' : config.overrun_policy,
+                           'seed'         : seed},
+            'plots'     : 'measured' if plots.available else plots.reason,
+            'results'   : results}
+
+
+#--------------------------------------------------------------------------------------
+# This function prints one line of results, to go under the heading printed below.
+
+def print_result (a_result):
+
+    if a_result['jitter_ms'] is None:
+        jitter_text = '      -        -'
+    else:
+        jitter_text = '{:7.2f}  {:7.2f}'.format (a_result['jitter_ms']['p50'],
+                                                a_result['jitter_ms']['p99'])
+
+    print ('{:9s} {:4d} {:8.3f} {:6.1f} {:9.1f} {:9.1f} '.format (a_result['scan_mode'],
+                a_result['channels'], a_result['interval'], a_result['run_length'],
+                a_result['rows_per_second'], a_result['samples_per_second'])
+           + jitter_text + ' {:6.1f}'.format (a_result['cpu_percent']))
+    sys.stdout.flush ()
+
+
+#======================================================================================
+# This code runs only if this file is called as a program on the command line.
+
+if __name__ == '__main__':
+
+    import argparse
+
+    parser = argparse.ArgumentParser (description = 'PolyDAQ acquisition benchmark')
+    parser.add_argument ('--channels', type = int, nargs = '+', default = [1, 2, 4, 8],
+                         help = 'numbers of channels to read')
+    parser.add_argument ('--rates', type = float, nargs = '+',
+                         default = [a_rate for a_rate in config.rates if a_rate <= 0.1],
+                         help = 'seconds between samples; the default is every rate '
+                                'in the configuration up to 0.1 s')
+    parser.add_argument ('--lengths', type = float, nargs = '+', default = [5.0],
+                         help = 'lengths of the runs, seconds')
+    parser.add_argument ('--scan-modes', nargs = '+', default = [config.scan_mode],
+                         choices = ['poll', 'batch', 'pipeline', 'stream'],
+                         help = 'ways of reading a row from the board')
+    parser.add_argument ('--no-plots', action = 'store_true',
+                         help = "don't draw plots even if there's a display")
+    parser.add_argument ('--seed', type = int, default = 1,
+                         help = 'seed for the simulated board')
+    parser.add_argument ('--output', default = 'PolyDAQ_benchmark.json',
+                         help = 'file in which to save the results')
+    args = parser.parse_args ()
+
+    print ('Mode      Chan Interval Length    Rows/s Samples/s  Jit p50  Jit p99   CPU%')
+    report = run_benchmark (args.channels, args.rates, args.lengths, args.scan_modes,
+                            args.seed, not args.no_plots, print_result)
+
+    output_file = open (args.output, 'w')
+    json.dump (report, output_file, indent = 2, sort_keys = True)
+    output_file.close ()
+
+    print ('Plots: ' + report['plots'])
+    print ('Results saved to ' + args.output)
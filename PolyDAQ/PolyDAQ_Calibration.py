@@ -0,0 +1,480 @@
+#**************************************************************************************
+# File: PolyDAQ_Calibration.py
+#   This module turns the calibrations written down in the configuration file into a
+#   function for each channel which converts an A/D reading into real units. The
+#   calibrations for a station are looked up once, when the channels to be measured
+#   are chosen; after that each reading only needs its channel's function called.
+#
+#   Since the board's A/D converters are 12 bits, there are only 4096 readings any
+#   channel can send, so every calibration can also be worked out ahead of time for
+#   all of them and kept in a table. Converting a reading is then just looking it up,
+#   and a whole array of readings is converted at once with numpy.take().
+#
+#   The data acquisition thread keeps raw readings only, so most calibrating is done
+#   a block of rows at a time by whoever takes the data from it, with the equations
+#   worked out by NumPy over whole columns rather than one reading at a time.
+#
+#   Thermocouples are linearized with the NIST polynomials in PolyDAQ_Thermocouple.
+#   Those take much more arithmetic than a straight line, so thermocouple channels
+#   always get lookup tables, which makes them cost no more than any other channel.
+#
+#**************************************************************************************
+
+import hashlib
+import json
+
+import numpy
+
+import new_config as config
+import PolyDAQ_Data_Store
+import PolyDAQ_Thermocouple
+
+
+# How many different readings the board's 12 bit A/D converters can send
+A2D_COUNTS = 4096
+
+
+#--------------------------------------------------------------------------------------
+# This function makes a function which evaluates a polynomial in the A/D reading. The
+# coefficients are given constant first. Horner's method is used, so a polynomial of
+# degree n takes n multiplications; the short ones most channels use get their own
+# functions so there's no loop at all.
+
+def make_polynomial (coefficients):
+
+    coefficients = [float (a_coeff) for a_coeff in coefficients]
+
+    if len (coefficients) == 0:
+        raise ValueError ('A calibration polynomial needs at least one coefficient')
+
+    if len (coefficients) == 1:
+        c0 = coefficients[0]
+        return lambda reading: c0
+
+    if len (coefficients) == 2:
+        c0, c1 = coefficients
+        return lambda reading: c0 + c1 * reading
+
+    if len (coefficients) == 3:
+        c0, c1, c2 = coefficients
+        return lambda reading: c0 + reading * (c1 + reading * c2)
+
+    backwards = coefficients[::-1]
+
+    def polynomial (reading):
+        value = 0.0
+        for a_coeff in backwards:
+            value = value * reading + a_coeff
+        return value
+
+    return polynomial
+
+
+#--------------------------------------------------------------------------------------
+# This function makes a function which evaluates a piecewise polynomial. The pieces are
+# (limit, coefficients) pairs in order of increasing limit; a reading uses the first
+# piece whose limit it doesn't go over, and a limit of None takes everything else.
+
+def make_piecewise (pieces):
+
+    if len (pieces) == 0:
+        raise ValueError ('A piecewise calibration needs at least one piece')
+
+    limits = [a_limit for a_limit, coefficients in pieces]
+    functions = [make_polynomial (coefficients) for a_limit, coefficients in pieces]
+
+    if None in limits[:-1]:
+        raise ValueError ('Only the last piece of a calibration may have no limit')
+
+    # The usual case, one split point, gets a function of its own
+    if len (pieces) == 2 and limits[1] is None:
+        split = limits[0]
+        low, high = functions
+        return lambda reading: low (reading) if reading <= split else high (reading)
+
+    def piecewise (reading):
+        for a_limit, a_function in zip (limits, functions):
+            if a_limit is None or reading <= a_limit:
+                return a_function (reading)
+        return float ('nan')
+
+    return piecewise
+
+
+#--------------------------------------------------------------------------------------
+# This function makes the function for one calibration record from the configuration
+# file, which holds either 'coefficients' or 'pieces'.
+
+def make_calibrator (record):
+
+    if 'coefficients' in record:
+        return make_polynomial (record['coefficients'])
+    if 'pieces' in record:
+        return make_piecewise (record['pieces'])
+    if 'thermocouple' in record:
+        block_function = make_block_calibrator (record)
+        return lambda reading: float (block_function (numpy.array ([reading]))[0])
+
+    raise ValueError ('A calibration needs coefficients, pieces or thermocouple, not '
+                      + repr (sorted (record.keys ())))
+
+
+#--------------------------------------------------------------------------------------
+# This function makes a function which does the same as the one make_calibrator()
+# makes, but to a whole numpy array of readings at once. Polynomials are worked out
+# with numpy.polyval(), and numpy.where() picks which piece of a piecewise one each
+# reading uses. A NaN reading, which marks a gap, stays NaN.
+
+def make_block_calibrator (record):
+
+    if 'coefficients' in record:
+        return make_block_polynomial (record['coefficients'])
+
+    if 'thermocouple' in record:
+        thermocouple_function = make_thermocouple_block (record)
+        cold_junction_temperature = record['cold_junction_temperature']
+        return lambda readings: thermocouple_function (readings,
+                                                       cold_junction_temperature)
+
+    if 'pieces' not in record:
+        raise ValueError ('A calibration needs coefficients, pieces or thermocouple, '
+                          + 'not ' + repr (sorted (record.keys ())))
+
+    # Work from the last piece back, so each piece's limit decides between it and
+    # everything after it
+    pieces = list (record['pieces'])
+    last_limit, last_coefficients = pieces.pop ()
+    if last_limit is not None:
+        raise ValueError ('The last piece of a block calibration must have no limit')
+
+    functions = [(a_limit, make_block_polynomial (coefficients))
+                 for a_limit, coefficients in pieces]
+    last_function = make_block_polynomial (last_coefficients)
+
+    def block_piecewise (readings):
+        values = last_function (readings)
+        for a_limit, a_function in reversed (functions):
+            values = numpy.where (readings <= a_limit, a_function (readings), values)
+        return values
+
+    return block_piecewise
+
+
+#--------------------------------------------------------------------------------------
+# This function makes a function which works out the temperatures for a numpy array of
+# readings from a thermocouple channel, given the cold junction temperature as one
+# number or as an array of them, one for each reading.
+
+def make_thermocouple_block (record):
+
+    kind = record['thermocouple']
+    zero_volts = record['zero_volts']
+    gain = record['gain']
+    PolyDAQ_Thermocouple.nist_polynomials (kind)
+
+    def block_thermocouple (readings, cold_junction_temperature):
+        volts = numpy.asarray (readings, dtype = numpy.float64) * (3.3 / 4095)
+        return PolyDAQ_Thermocouple.ad8495_temperature (kind, volts, zero_volts,
+                                                        cold_junction_temperature, gain)
+
+    return block_thermocouple
+
+
+#--------------------------------------------------------------------------------------
+# This function makes a function which evaluates a polynomial, given constant first,
+# for a whole numpy array of readings.
+
+def make_block_polynomial (coefficients):
+
+    highest_first = numpy.array (coefficients[::-1], dtype = numpy.float64)
+
+    return lambda readings: numpy.polyval (highest_first, readings)
+
+
+#--------------------------------------------------------------------------------------
+# This function makes a numpy array holding what a calibration function gives for each
+# reading from 0 to A2D_COUNTS - 1.
+
+def make_lookup_table (a_function):
+
+    return numpy.array ([a_function (reading) for reading in range (A2D_COUNTS)],
+                        dtype = numpy.float64)
+
+
+#--------------------------------------------------------------------------------------
+# This function makes a function which converts a reading by looking it up in a table
+# made by make_lookup_table(). Readings which aren't in the table, which a board
+# shouldn't send but a garbled line might hold, are worked out with the calibration
+# function itself. A plain list is used for the lookups, as indexing one with an
+# integer is quicker than indexing a numpy array; readings which come as floats, as
+# they do once they've been through a NumPy array, are turned into integers first.
+
+def make_table_lookup (table, a_function):
+
+    values = table.tolist ()
+
+    def lookup (reading):
+        if 0 <= reading < A2D_COUNTS:
+            return values[int (reading)]
+        return a_function (reading)
+
+    return lookup
+
+
+#======================================================================================
+
+class calibration_registry (object):
+    ''' Class which holds the calibration for each channel at one station.
+
+    The records are taken from config.calibrations for the station, with those in
+    config.common_calibrations filling in any channel the station doesn't have its
+    own record for. A function is made for each channel the first time it's asked
+    for and then kept, so asking again costs one dictionary lookup.
+
+    If config.calibration_tables is set, or use_tables is given as True, the
+    functions handed out look readings up in tables of all 4096 of them, made when
+    each channel is first asked for. The tables themselves can be had from
+    lookup_table() and are also used by calibrate_block() to turn a whole block of
+    readings into real units at once.
+
+    Asking for a channel which has no calibration at this station raises a
+    ValueError, so a bad channel list is caught when it's set rather than when the
+    first reading comes in.
+    '''
+
+    def __init__ (self, station = None, calibrations = None,
+                  common_calibrations = None, use_tables = None, set_name = None):
+
+        if station is None:
+            station = config.station
+        if set_name is None:
+            set_name = config.calibration_set
+        if use_tables is None:
+            use_tables = config.calibration_tables
+        if calibrations is None:
+            calibrations = config.calibrations
+        if common_calibrations is None:
+            common_calibrations = config.common_calibrations
+
+        self.station = station
+        self.set_name = set_name
+        self.use_tables = use_tables
+        self.records = dict (common_calibrations)
+        self.records.update (calibrations.get (station, {}))
+        self.equations = {}
+        self.calibrators = {}
+        self.tables = {}
+        self.block_equations = {}
+
+
+    #----------------------------------------------------------------------------------
+
+    def set_id (self):
+        ''' This method returns a string which identifies the calibrations in use at
+            this station: the name of the calibration set, the station, and a short
+            checksum of the calibration records themselves, so that a change to the
+            constants shows up even if nobody remembered to rename the set.
+            '''
+
+        records_text = json.dumps (self.records, sort_keys = True)
+        checksum = hashlib.sha1 (records_text.encode ('utf-8')).hexdigest ()[:8]
+
+        return self.set_name + '/station ' + str (self.station) + '/' + checksum
+
+
+    #----------------------------------------------------------------------------------
+
+    def equation (self, channel):
+        ''' This method returns the function which works out the calibration for
+            the given channel from its coefficients.
+            '''
+
+        try:
+            return self.equations[channel]
+        except KeyError:
+            pass
+
+        if channel not in self.records:
+            raise ValueError ('No calibration for channel ' + repr (channel)
+                              + ' at station ' + str (self.station))
+
+        a_function = make_calibrator (self.records[channel])
+        self.equations[channel] = a_function
+
+        return a_function
+
+
+    #----------------------------------------------------------------------------------
+
+    def block_equation (self, channel):
+        ''' This method returns the function which works out the calibration for a
+            numpy array of readings from the given channel all at once.
+            '''
+
+        try:
+            return self.block_equations[channel]
+        except KeyError:
+            pass
+
+        if channel not in self.records:
+            raise ValueError ('No calibration for channel ' + repr (channel)
+                              + ' at station ' + str (self.station))
+
+        a_function = make_block_calibrator (self.records[channel])
+        self.block_equations[channel] = a_function
+
+        return a_function
+
+
+    #----------------------------------------------------------------------------------
+
+    def lookup_table (self, channel):
+        ''' This method returns a numpy array holding the calibrated value of every
+            reading the given channel's A/D converter can send.
+            '''
+
+        try:
+            return self.tables[channel]
+        except KeyError:
+            pass
+
+        # A thermocouple table is worked out all at once with NumPy, as working out
+        # thousands of NIST polynomials one at a time would take a while
+        if self.is_thermocouple (channel):
+            table = self.block_equation (channel) (numpy.arange (A2D_COUNTS,
+                                                   dtype = numpy.float64))
+        else:
+            table = make_lookup_table (self.equation (channel))
+        self.tables[channel] = table
+
+        return table
+
+
+    #----------------------------------------------------------------------------------
+
+    def is_thermocouple (self, channel):
+        ''' This method returns True if the given channel is a thermocouple, which is
+            always calibrated from a lookup table.
+            '''
+
+        return 'thermocouple' in self.records.get (channel, {})
+
+
+    #----------------------------------------------------------------------------------
+
+    def calibrator (self, channel):
+        ''' This method returns the function which converts A/D readings from the
+            given channel into real units.
+            '''
+
+        try:
+            return self.calibrators[channel]
+        except KeyError:
+            pass
+
+        if self.use_tables or self.is_thermocouple (channel):
+            a_function = make_table_lookup (self.lookup_table (channel),
+                                            self.equation (channel))
+        else:
+            a_function = self.equation (channel)
+        self.calibrators[channel] = a_function
+
+        return a_function
+
+
+    #----------------------------------------------------------------------------------
+
+    def calibrators_for (self, measurands):
+        ''' This method returns a list holding the calibration function for each of
+            the channels in a list of measurands, in the same order.
+            '''
+
+        return [self.calibrator (item) for item in measurands]
+
+
+    #----------------------------------------------------------------------------------
+
+    def calibrate_block (self, measurands, readings):
+        ''' This method converts a block of raw A/D readings into real units. The
+            block is a 2D array with one column for each channel in the list of
+            measurands and a row for each sample, and may hold NaNs where readings
+            are missing; they stay NaN, and the markers for readings which weren't
+            due become NaN too. Each column is converted in one go, from the channel's
+            lookup table if tables are in use, and otherwise from its equation. The
+            result is a new array of 64-bit floats.
+
+            A thermocouple whose cold junction channel is in the block is worked out
+            with that channel's reading in each row as its cold junction temperature,
+            which can't be done from a table. Rows in which the cold junction channel
+            wasn't read use the fixed cold junction temperature instead.
+            '''
+
+        readings = numpy.asarray (readings, dtype = numpy.float64)
+        readings = numpy.where (readings == PolyDAQ_Data_Store.NOT_DUE,
+                                PolyDAQ_Data_Store.NO_READING, readings)
+        values = numpy.empty (readings.shape, dtype = numpy.float64)
+
+        for index, item in enumerate (measurands):
+            column = readings[..., index]
+
+            if self.is_thermocouple (item):
+                cold_junction_channel = self.records[item]['cold_junction_channel']
+                if cold_junction_channel in measurands:
+                    cold_junction_temperature = self.block_equation \
+                        (cold_junction_channel) (readings[..., list (measurands).index
+                                                          (cold_junction_channel)])
+                    cold_junction_temperature = numpy.where (numpy.isnan
+                        (cold_junction_temperature),
+                        self.records[item]['cold_junction_temperature'],
+                        cold_junction_temperature)
+                    values[..., index] = make_thermocouple_block (self.records[item]) \
+                        (column, cold_junction_temperature)
+                    continue
+
+            if not self.use_tables and not self.is_thermocouple (item):
+                values[..., index] = self.block_equation (item) (column)
+                continue
+
+            # NaNs, and anything else which isn't in the table, fail this test and
+            # are worked out from the equation instead
+            in_table = (column >= 0) & (column < A2D_COUNTS)
+            values[..., index] = numpy.take (self.lookup_table (item),
+                numpy.where (in_table, column, 0).astype (numpy.intp))
+            if not in_table.all ():
+                values[..., index][~in_table] = \
+                    self.block_equation (item) (column[~in_table])
+
+        return values
+
+
+# The registry for config.station, made the first time it's needed
+_default_registry = None
+
+
+#--------------------------------------------------------------------------------------
+# This function returns the calibration registry for the station in the configuration
+# file, making it the first time it's called.
+
+def default_registry ():
+
+    global _default_registry
+    if _default_registry is None or _default_registry.station != config.station \
+            or _default_registry.use_tables != config.calibration_tables:
+        _default_registry = calibration_registry ()
+
+    return _default_registry
+
+
+#======================================================================================
+# This test code runs only if this file is called as a program on the command line. It
+# prints what each channel at this station reads for a few A/D readings.
+
+if __name__ == '__main__':
+
+    registry = default_registry ()
+    print ('Calibrations for station ' + str (registry.station))
+    for channel in sorted (registry.records.keys ()):
+        a_function = registry.calibrator (channel)
+        print ('  ' + channel + ': ' + ', '.join (['{:.4g}'.format (a_function (reading))
+                                                 for reading in (0, 100, 2048, 4095)]))
+
@@ -0,0 +1,391 @@
+#**************************************************************************************
+# File: PolyDAQ_Client.py
+#   This module implements an event driven client for the PolyDAQ serial protocol.
+#   Several commands can be outstanding on one port at once, each with a deadline and
+#   a function to be called when its answer comes in, all handled in one thread
+#   without any locks.
+#
+#**************************************************************************************
+
+import os
+import select
+
+import new_config as config
+import PolyDAQ_Protocol
+import PolyDAQ_Scheduler
+
+
+#======================================================================================
+
+class polydaq_request (object):
+    ''' Class which holds one command sent through the client and, once it's done,
+    the answer to it.
+
+    A request is done when its answer has come in, when it has passed its deadline,
+    or right after it's sent if the command has no answer. Then result holds the
+    answer, or error holds a string saying what went wrong, and the callback, if
+    there is one, is called with the request as its argument.
+    '''
+
+    def __init__ (self, command, answer_kind, deadline, callback = None):
+
+        self.command = command
+        self.answer_kind = answer_kind
+        self.deadline = deadline
+        self.callback = callback
+
+        # For a tagged channel reading, the sequence number it was sent with and,
+        # if the board timestamps its readings, the board's time for the reading
+        self.sequence = None
+        self.board_time = None
+
+        # When the request was queued and when it was sent, by the monotonic clock,
+        # for whoever is keeping track of how long commands take
+        self.queued_time = None
+        self.sent_time = None
+
+        self.done = False
+        self.result = None
+        self.error = None
+
+
+    #----------------------------------------------------------------------------------
+
+    def finish (self, result = None, error = None):
+        ''' This method marks the request as done and calls its callback. A request
+            can only be finished once; later calls are ignored.
+            '''
+
+        if self.done:
+            return
+
+        self.done = True
+        self.result = result
+        self.error = error
+
+        if self.callback is not None:
+            self.callback (self)
+
+
+#======================================================================================
+
+class polydaq_client (object):
+    ''' Class which talks to a PolyDAQ through a serial port from an event loop.
+
+    Nothing here blocks. Each command method sends its command, or queues it, and
+    returns a request object right away; poll() waits for the port to have something
+    to read, for up to a given time, and hands out the answers which have come in.
+    A program can call poll() from its own loop, or use run_until() to wait for some
+    particular requests.
+
+    Channel readings are sent as tagged commands, so a number of them can be in
+    flight at once and each answer goes to the right request however the answers
+    are interleaved with others. The version and balance commands get untagged
+    answers, which are handed to those requests in the order they were sent; a
+    balance only counts as done when the line saying "balance" comes in, so channel
+    readings can carry on while a bridge is being balanced. The oversampling and
+    reset commands have no answer and are done as soon as they're sent.
+
+    The port must have a file descriptor that select() can watch, as serial ports do
+    on Linux and the Mac.
+    '''
+
+    def __init__ (self, serial_port, max_in_flight = None, response_timeout = 0.5,
+                  balance_timeout = 5.0):
+
+        self.serial_port = serial_port
+        self.file_number = serial_port.fileno ()
+
+        # How many tagged channel readings may be in flight at once; any more wait
+        # in a queue until there's room, so the board's receive buffer can't overflow
+        if max_in_flight is None:
+            max_in_flight = config.pipeline_depth
+        self.max_in_flight = max (1, max_in_flight)
+
+        self.response_timeout = response_timeout
+        self.balance_timeout = balance_timeout
+
+        # Tagged requests in flight by sequence number, tagged requests waiting to
+        # be sent, and untagged requests waiting for a line, oldest first
+        self.tagged_requests = {}
+        self.queued_requests = []
+        self.line_requests = []
+        self.next_sequence = 0
+
+        # Characters received which don't yet make up a whole line
+        self.rx_buffer = ''
+
+        # Counts of requests which ran out of time and of lines nobody was waiting for
+        self.timeouts = 0
+        self.stray_lines = 0
+
+
+    #----------------------------------------------------------------------------------
+
+    def read_channel (self, channel, callback = None):
+        ''' This method asks for one A/D reading from a channel. The result is the
+            reading as an integer; if the board sent a timestamp with it, that's put
+            in the request's board_time. The deadline is set when the command is sent, so
+            time spent waiting in the queue doesn't count against it.
+            '''
+
+        request = polydaq_request (channel, 'reading', None, callback)
+        self.queued_requests.append (request)
+        self.send_queued ()
+
+        return request
+
+
+    #----------------------------------------------------------------------------------
+
+    def version (self, callback = None):
+        ''' This method asks the PolyDAQ which version it is. The result is the line
+            it sends back.
+            '''
+
+        return self.send_untagged ('v', 'line', self.response_timeout, callback)
+
+
+    #----------------------------------------------------------------------------------
+
+    def set_oversampling (self, oversampling, callback = None):
+        ''' This method tells the PolyDAQ how many readings to average for each one
+            it sends.
+            '''
+
+        return self.send_untagged ('O' + str (oversampling) + '\n', None,
+                                   self.response_timeout, callback)
+
+
+    #----------------------------------------------------------------------------------
+
+    def balance (self, bridge_command, callback = None):
+        ''' This method asks a PolyDAQ 2 to balance one strain gauge bridge; the
+            command is 'L' or 'M'. The result is the line saying how it went.
+            '''
+
+        return self.send_untagged (bridge_command, 'balance', self.balance_timeout,
+                                   callback)
+
+
+    #----------------------------------------------------------------------------------
+
+    def reset (self, callback = None):
+        ''' This method asks the PolyDAQ's AVR to reset itself.
+            '''
+
+        return self.send_untagged ('R', None, self.response_timeout, callback)
+
+
+    #----------------------------------------------------------------------------------
+
+    def deadline_from_now (self, timeout):
+        ''' This method returns the monotonic clock time which is timeout seconds
+            from now.
+            '''
+
+        return PolyDAQ_Scheduler.monotonic () + timeout
+
+
+    #----------------------------------------------------------------------------------
+
+    def send_untagged (self, command, answer_kind, timeout, callback):
+        ''' This method sends a command whose answer, if it has one, is an untagged
+            line, and returns its request.
+            '''
+
+        request = polydaq_request (command, answer_kind,
+                                   self.deadline_from_now (timeout), callback)
+        self.serial_port.write (PolyDAQ_Protocol.serial_bytes (command))
+
+        if answer_kind is None:
+            request.finish ()
+        else:
+            self.line_requests.append (request)
+
+        return request
+
+
+    #----------------------------------------------------------------------------------
+
+    def send_queued (self):
+        ''' This method sends queued channel readings while there's room for them in
+            flight. Each gets a sequence number which isn't in use by another.
+            '''
+
+        while self.queued_requests and len (self.tagged_requests) < self.max_in_flight:
+            request = self.queued_requests.pop (0)
+
+            while self.next_sequence in self.tagged_requests:
+                self.next_sequence = (self.next_sequence + 1) \
+                                     % PolyDAQ_Protocol.SEQUENCE_LIMIT
+            request.sequence = self.next_sequence
+            request.deadline = self.deadline_from_now (self.response_timeout)
+            self.next_sequence = (self.next_sequence + 1) \
+                                 % PolyDAQ_Protocol.SEQUENCE_LIMIT
+
+            self.tagged_requests[request.sequence] = request
+            self.serial_port.write (PolyDAQ_Protocol.serial_bytes \
+                    (PolyDAQ_Protocol.tagged_command (request.sequence, request.command)))
+
+
+    #----------------------------------------------------------------------------------
+
+    def outstanding (self):
+        ''' This method returns the number of requests which aren't done yet.
+            '''
+
+        return len (self.tagged_requests) + len (self.queued_requests) \
+               + len (self.line_requests)
+
+
+    #----------------------------------------------------------------------------------
+
+    def poll (self, timeout = 0.0):
+        ''' This method waits up to timeout seconds for the port to have something to
+            read, reads what's there, and finishes the requests whose answers have
+            come in or whose deadlines have passed. It never waits past the next
+            deadline.
+            '''
+
+        now = PolyDAQ_Scheduler.monotonic ()
+        deadlines = [request.deadline for request in self.line_requests] \
+                    + [request.deadline for request in self.tagged_requests.values ()]
+        if deadlines:
+            timeout = max (0.0, min ([timeout] + [a_deadline - now
+                                                  for a_deadline in deadlines]))
+
+        readable, writable, broken = select.select ([self.file_number], [], [], timeout)
+        if readable:
+            data = os.read (self.file_number, 4096)
+            self.rx_buffer += PolyDAQ_Protocol.serial_text (data)
+            self.handle_lines ()
+
+        self.expire_requests ()
+        self.send_queued ()
+
+
+    #----------------------------------------------------------------------------------
+
+    def handle_lines (self):
+        ''' This method takes whole lines out of the receive buffer and gives each to
+            the request it answers.
+            '''
+
+        while '\n' in self.rx_buffer:
+            a_line, self.rx_buffer = self.rx_buffer.split ('\n', 1)
+            a_line = a_line.strip ()
+            if not a_line:
+                continue
+
+            # A tagged line answers the channel reading with the same sequence number;
+            # if a garbled line was run into it, the tag is the last one in the line
+            tag_index = a_line.rfind (PolyDAQ_Protocol.TAG_CHARACTER)
+            if tag_index >= 0:
+                try:
+                    sequence, text = PolyDAQ_Protocol.parse_tagged_response \
+                                     (a_line[tag_index:])
+                except ValueError:
+                    self.stray_lines += 1
+                    continue
+
+                request = self.tagged_requests.pop (sequence, None)
+                if request is None:
+                    self.stray_lines += 1
+                    continue
+
+                try:
+                    a2d_reading, request.board_time = PolyDAQ_Protocol.split_timestamp \
+                                                      (text)
+                    request.finish (a2d_reading)
+                except ValueError:
+                    request.finish (error = 'Bad reading ' + repr (text))
+                continue
+
+            # An untagged line answers the oldest untagged request; a balance takes
+            # any number of lines, the last of which says "balance"
+            if not self.line_requests:
+                self.stray_lines += 1
+                continue
+
+            request = self.line_requests[0]
+            if request.answer_kind == 'balance' and 'balance' not in a_line:
+                continue
+
+            self.line_requests.pop (0)
+            request.finish (a_line)
+
+
+    #----------------------------------------------------------------------------------
+
+    def expire_requests (self):
+        ''' This method gives up on requests which are past their deadlines.
+            '''
+
+        now = PolyDAQ_Scheduler.monotonic ()
+
+        for sequence, request in list (self.tagged_requests.items ()):
+            if now >= request.deadline:
+                del self.tagged_requests[sequence]
+                self.timeouts += 1
+                request.finish (error = 'Timed out')
+
+        for request in list (self.line_requests):
+            if now >= request.deadline:
+                self.line_requests.remove (request)
+                self.timeouts += 1
+                request.finish (error = 'Timed out')
+
+
+    #----------------------------------------------------------------------------------
+
+    def run_until (self, requests, timeout = None):
+        ''' This method runs the event loop until every request in a list is done, or
+            until timeout seconds have gone by. It returns True if they're all done.
+            '''
+
+        if timeout is not None:
+            give_up_time = self.deadline_from_now (timeout)
+
+        while not all ([request.done for request in requests]):
+            if timeout is None:
+                self.poll (0.1)
+            else:
+                remaining = give_up_time - PolyDAQ_Scheduler.monotonic ()
+                if remaining <= 0.0:
+                    return False
+                self.poll (remaining)
+
+        return True
+
+
+#======================================================================================
+# This test code runs only if this file is called as a program on the command line. It
+# starts a simulated board on a pseudo-terminal and runs a bridge balance while
+# channel readings carry on over the same port.
+
+if __name__ == '__main__':
+
+    import serial
+    import PolyDAQ_Sim_Board
+
+    sim_server = PolyDAQ_Sim_Board.sim_pty_server ()
+    sim_server.start ()
+    port = serial.Serial (sim_server.port_name, config.baud_rate, timeout = 0)
+
+    client = polydaq_client (port)
+
+    def show (request):
+        print ('  ' + repr (request.command) + ' -> ' + repr (request.result)
+               + ('' if request.error is None else ' (' + request.error + ')'))
+
+    requests = [client.version (show), client.set_oversampling (4, show),
+                client.balance ('L', show)]
+    requests += [client.read_channel (a_ch, show) for a_ch in '98769876']
+
+    if client.run_until (requests, 5.0):
+        print ('All done; ' + str (client.timeouts) + ' timeouts, '
+               + str (client.stray_lines) + ' stray lines')
+
+    sim_server.stop ()
+
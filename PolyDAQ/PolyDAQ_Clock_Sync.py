@@ -0,0 +1,172 @@
+#**************************************************************************************
+# File: PolyDAQ_Clock_Sync.py
+#   This module works out how the PolyDAQ's own microsecond clock lines up with the
+#   computer's clock, so that readings timestamped by the board can be given times on
+#   the computer's clock without any of the USB and scheduling jitter which times
+#   taken on the computer pick up.
+#
+#**************************************************************************************
+
+import collections
+
+import PolyDAQ_Protocol
+
+
+#======================================================================================
+
+class clock_sync_estimator (object):
+    ''' Class which estimates the offset and drift between the board clock and the
+    computer's monotonic clock.
+
+    Each ping exchange gives three times: when the computer sent the ping, the board
+    clock time in the answer, and when the answer came back. The board read its clock
+    somewhere in between; the middle of the round trip is the best guess. A straight
+    line is fitted through the recent exchanges, computer time against board time:
+    its slope is the ratio of the two clocks' rates, so it takes care of the drift of
+    the board's crystal, and it gives the computer time of any board time.
+
+    An exchange whose round trip was much longer than the quickest one was held up
+    somewhere, so its middle is a poor guess; such exchanges are left out of the fit.
+
+    The board clock is a 32 bit count of microseconds which starts over every 71.6
+    minutes. Board times are unwrapped into a count which keeps on going, as long as
+    they're looked at at least once every half hour or so.
+    '''
+
+    def __init__ (self, window = 32, round_trip_margin = 1.5):
+
+        # The most recent exchanges, as (board seconds, computer time, round trip)
+        self.exchanges = collections.deque (maxlen = window)
+        self.round_trip_margin = round_trip_margin
+
+        # The unwrapped board time which was seen last, and the number of times the
+        # board clock has started over since the first one
+        self.latest_board_us = None
+        self.wraps = 0
+
+        # The fitted line: computer time = host_origin + slope * (board seconds
+        # - board_origin). Until there's an exchange it can't be used
+        self.board_origin = None
+        self.host_origin = None
+        self.slope = 1.0
+
+
+    #----------------------------------------------------------------------------------
+
+    def unwrap (self, board_us):
+        ''' This method turns a 32 bit board clock time into one which doesn't start
+            over. Times a little older than the newest one seen are fine; they get put
+            before the newest, even if the clock has started over in between.
+            '''
+
+        wrap = PolyDAQ_Protocol.BOARD_CLOCK_WRAP
+        board_us = board_us + self.wraps * wrap
+
+        if self.latest_board_us is None:
+            self.latest_board_us = board_us
+            return board_us
+
+        if board_us - self.latest_board_us < -wrap // 2:
+            self.wraps += 1
+            board_us += wrap
+        elif board_us - self.latest_board_us > wrap // 2:
+            board_us -= wrap
+
+        if board_us > self.latest_board_us:
+            self.latest_board_us = board_us
+
+        return board_us
+
+
+    #----------------------------------------------------------------------------------
+
+    def synced (self):
+        ''' This method returns True once there's been at least one exchange.
+            '''
+
+        return self.board_origin is not None
+
+
+    #----------------------------------------------------------------------------------
+
+    def add_exchange (self, send_time, board_us, receive_time):
+        ''' This method adds one ping exchange, given the computer times at which the
+            ping was sent and the answer came back and the board time in the answer,
+            and fits the line again.
+            '''
+
+        board_seconds = self.unwrap (board_us) / 1e6
+        self.exchanges.append ((board_seconds, (send_time + receive_time) / 2.0,
+                                receive_time - send_time))
+        self.fit ()
+
+
+    #----------------------------------------------------------------------------------
+
+    def fit (self):
+        ''' This method fits a straight line through the exchanges whose round trips
+            were quick enough to trust, by least squares. With only one exchange, or
+            if they were all at nearly the same time, the clocks are taken to run at
+            the same rate.
+            '''
+
+        quickest = min ([round_trip for board_s, host_s, round_trip in self.exchanges])
+        points = [(board_s, host_s) for board_s, host_s, round_trip in self.exchanges
+                  if round_trip <= quickest * self.round_trip_margin + 1e-4]
+
+        # Work relative to the first point to keep the numbers small
+        self.board_origin, self.host_origin = points[0]
+        x_values = [board_s - self.board_origin for board_s, host_s in points]
+        y_values = [host_s - self.host_origin for board_s, host_s in points]
+
+        x_mean = sum (x_values) / len (points)
+        y_mean = sum (y_values) / len (points)
+        x_spread = sum ([(x - x_mean) ** 2 for x in x_values])
+
+        if len (points) < 2 or x_spread < 1e-6:
+            self.slope = 1.0
+        else:
+            self.slope = sum ([(x - x_mean) * (y - y_mean)
+                               for x, y in zip (x_values, y_values)]) / x_spread
+
+        # Move the origin so the line goes through the middle of the points
+        self.host_origin += y_mean - self.slope * x_mean
+
+
+    #----------------------------------------------------------------------------------
+
+    def board_to_host (self, board_us):
+        ''' This method returns the computer monotonic clock time at which the board
+            clock read board_us.
+            '''
+
+        board_seconds = self.unwrap (board_us) / 1e6
+
+        return self.host_origin + self.slope * (board_seconds - self.board_origin)
+
+
+    #----------------------------------------------------------------------------------
+
+    def drift_ppm (self):
+        ''' This method returns how much faster the computer's clock runs than the
+            board's, in parts per million.
+            '''
+
+        return (self.slope - 1.0) * 1e6
+
+
+    #----------------------------------------------------------------------------------
+
+    def sync_text (self):
+        ''' This method returns a one line summary of the clock fit for the status box.
+            '''
+
+        if not self.synced ():
+            return 'Board clock: not synchronized'
+
+        quickest = min ([round_trip for board_s, host_s, round_trip in self.exchanges])
+
+        return 'Board clock: drift ' + '{:.1f}'.format (self.drift_ppm ()) \
+               + ' ppm, best ping ' + '{:.2f}'.format (quickest * 1000.0) + ' ms over ' \
+               + str (len (self.exchanges)) + ' exchanges'
+
@@ -0,0 +1,275 @@
+#**************************************************************************************
+# File: PolyDAQ_Data_Store.py
+#   This module holds the class in which the data from a run is kept: one typed array
+#   for the time column and one for each channel, rather than a Python list with a
+#   whole float object for every reading.
+#
+#**************************************************************************************
+
+import numpy
+
+
+# The value stored for a channel which wasn't read in a row, such as one whose reading
+# timed out or came back garbled. It's Not a Number, so it can't be mistaken for a
+# reading, NumPy functions such as numpy.isnan() can find it, and the plots show it
+# as a gap
+NO_READING = float ('nan')
+
+# The raw reading stored for a slow channel in a row which only a faster one was due
+# in. It's no gap in the data, so the plots join the readings on either side of it;
+# no A/D reading can be minus infinity. Once calibrated it's NO_READING like any
+# other missing reading, and the calibrated store notes which rows it was due in
+NOT_DUE = float ('-inf')
+
+
+#======================================================================================
+
+class sample_store (object):
+    ''' Class which stores rows of data in a column for time and a column for each
+    channel.
+
+    Each column is a NumPy array: 64-bit floats for the time, and 32-bit floats (or
+    whatever type is asked for, such as 16-bit integers for raw A/D counts) for the
+    channels. The arrays are made bigger than needed; when they fill up, new ones
+    twice the size are made and the data copied over, so a long run only needs a
+    handful of copies. A Python list of floats costs 32 bytes or so per reading,
+    where a 32-bit column costs 4, which adds up over a run of several hours.
+
+    Readers get views of the filled part of each column. A view doesn't copy the
+    data, and it stays valid even if the store grows afterwards; it just won't show
+    rows added after it was made.
+
+    If asked for, the store also keeps a set of flags saying whether each channel
+    was due to be read in each row, so a reading which is missing can be told from
+    one which was never asked for.
+    '''
+
+    def __init__ (self, num_channels, initial_rows = 4096,
+                  channel_dtype = numpy.float32, due_flags = False):
+
+        self.num_channels = num_channels
+        self.channel_dtype = channel_dtype
+
+        # The number of rows which have been filled in
+        self.length = 0
+
+        self.times = numpy.empty (initial_rows, dtype = numpy.float64)
+        self.channels = numpy.empty ((num_channels, initial_rows), dtype = channel_dtype)
+
+        if due_flags:
+            self.due = numpy.ones ((num_channels, initial_rows), dtype = numpy.bool_)
+        else:
+            self.due = None
+
+
+    #----------------------------------------------------------------------------------
+
+    def __len__ (self):
+        return self.length
+
+
+    #----------------------------------------------------------------------------------
+
+    def capacity (self):
+        ''' This method returns how many rows fit in the arrays before they must grow.
+            '''
+
+        return len (self.times)
+
+
+    #----------------------------------------------------------------------------------
+
+    def grow (self, rows_needed):
+        ''' This method makes the arrays big enough for at least rows_needed rows,
+            doubling their size as many times as needed.
+            '''
+
+        new_capacity = max (self.capacity (), 1)
+        while new_capacity < rows_needed:
+            new_capacity *= 2
+
+        new_times = numpy.empty (new_capacity, dtype = numpy.float64)
+        new_times[:self.length] = self.times[:self.length]
+
+        new_channels = numpy.empty ((self.num_channels, new_capacity),
+                                    dtype = self.channel_dtype)
+        new_channels[:, :self.length] = self.channels[:, :self.length]
+
+        if self.due is not None:
+            new_due = numpy.ones ((self.num_channels, new_capacity),
+                                  dtype = numpy.bool_)
+            new_due[:, :self.length] = self.due[:, :self.length]
+            self.due = new_due
+
+        self.times = new_times
+        self.channels = new_channels
+
+
+    #----------------------------------------------------------------------------------
+
+    def append_row (self, a_time, values, due = None):
+        ''' This method adds one row: a time and a value for each channel, and if the
+            store keeps them, whether each channel was due. Without due flags, every
+            channel was.
+            '''
+
+        if self.length >= self.capacity ():
+            self.grow (self.length + 1)
+
+        self.times[self.length] = a_time
+        self.channels[:, self.length] = values
+        if self.due is not None:
+            self.due[:, self.length] = True if due is None else due
+
+        # Only count the row once it's all there
+        self.length += 1
+
+
+    #----------------------------------------------------------------------------------
+
+    def append_rows (self, times, values, due = None):
+        ''' This method adds a block of rows at once. The times are a sequence of
+            row times; the values, and the due flags if there are any, are 2D arrays
+            with one row per channel and one column per row of data.
+            '''
+
+        num_rows = len (times)
+        if self.length + num_rows > self.capacity ():
+            self.grow (self.length + num_rows)
+
+        self.times[self.length:self.length + num_rows] = times
+        self.channels[:, self.length:self.length + num_rows] = values
+        if self.due is not None:
+            self.due[:, self.length:self.length + num_rows] = \
+                True if due is None else due
+
+        self.length += num_rows
+
+
+    #----------------------------------------------------------------------------------
+
+    def time_view (self):
+        ''' This method returns a view of the filled part of the time column.
+            '''
+
+        return self.times[:self.length]
+
+
+    #----------------------------------------------------------------------------------
+
+    def channel_view (self, index):
+        ''' This method returns a view of the filled part of one channel's column.
+            '''
+
+        return self.channels[index, :self.length]
+
+
+    #----------------------------------------------------------------------------------
+
+    def channel_views (self):
+        ''' This method returns a list of views, one for each channel.
+            '''
+
+        length = self.length
+        return [self.channels[index, :length] for index in range (self.num_channels)]
+
+
+    #----------------------------------------------------------------------------------
+
+    def due_views (self):
+        ''' This method returns a list of views, one for each channel, of whether the
+            channel was due in each row, or None if the store doesn't keep that.
+            '''
+
+        if self.due is None:
+            return None
+
+        length = self.length
+        return [self.due[index, :length] for index in range (self.num_channels)]
+
+
+    #----------------------------------------------------------------------------------
+
+    def nbytes (self):
+        ''' This method returns the number of bytes the filled part of the store takes.
+            '''
+
+        row_bytes = self.times.itemsize + self.num_channels * self.channels.itemsize
+        if self.due is not None:
+            row_bytes += self.num_channels * self.due.itemsize
+
+        return self.length * row_bytes
+
+
+#======================================================================================
+# This function returns the text which goes in the data file for one row of data: the
+# time to the millisecond, then each channel's reading, separated by commas. A channel
+# which wasn't read in the row gets an empty cell; its value is NaN, the only value
+# which isn't equal to itself. The note column and the end of the line are left for
+# the caller to add.
+
+def csv_row_text (a_time, values):
+
+    return '{:.3f}'.format (a_time) + ''.join ([',' + ('' if value != value
+                                                       else str (value))
+                                                for value in values])
+
+
+#--------------------------------------------------------------------------------------
+# This function works out which readings of one channel a plot should draw, and where
+# its line should be broken. Given the channel's values and, if known, whether it was
+# due in each row, it returns the indices of the rows which hold readings, and a list
+# of (first, last) pairs of places in that list of indices, each a run of readings to
+# be joined up. A run ends wherever a row the channel was due in has no reading, so a
+# dropout leaves a gap, while rows a slow channel simply wasn't due in are passed over.
+# Without due flags, every row counts as due.
+
+def reading_segments (values, due = None):
+
+    values = numpy.asarray (values)
+    was_read = ~numpy.isnan (values)
+    if due is None:
+        missed = ~was_read
+    else:
+        missed = numpy.asarray (due) & ~was_read
+
+    read_rows = numpy.flatnonzero (was_read)
+    if len (read_rows) == 0:
+        return read_rows, []
+
+    # A new run starts at a reading which has had a missed row since the last one
+    misses_so_far = numpy.cumsum (missed)[read_rows]
+    starts = (numpy.flatnonzero (numpy.diff (misses_so_far) > 0) + 1).tolist ()
+    bounds = [0] + starts + [len (read_rows)]
+
+    return read_rows, [(bounds[index], bounds[index + 1] - 1)
+                       for index in range (len (bounds) - 1)]
+
+
+#======================================================================================
+# This test code runs only if this file is called as a program on the command line. It
+# checks that a slow channel's readings are joined up across the rows it wasn't due
+# in, and that a dropout in a row it was due in breaks its line in two.
+
+if __name__ == '__main__':
+
+    gap = NO_READING
+    values = [1.0, gap, 2.0, gap, 3.0, gap, gap, gap, 4.0, gap, 5.0]
+    due = [True, False, True, False, True, False, True, False, True, False, True]
+
+    read_rows, segments = reading_segments (values, due)
+    print ('Slow channel with a dropout: rows ' + str (read_rows.tolist ())
+           + ', segments ' + str (segments))
+    if segments != [(0, 2), (3, 4)]:
+        print ('  Wrong: the dropout in row 6 should split the readings in two')
+
+    read_rows, segments = reading_segments ([1.0, 2.0, gap, 3.0])
+    print ('Every-row channel with a dropout: segments ' + str (segments))
+    if segments != [(0, 1), (2, 2)]:
+        print ('  Wrong: the dropout in row 2 should split the readings in two')
+
+    read_rows, segments = reading_segments ([1.0, gap, 2.0, gap, 3.0],
+                                            [True, False, True, False, True])
+    print ('Slow channel without dropouts: segments ' + str (segments))
+    if segments != [(0, 2)]:
+        print ('  Wrong: rows a channel was not due in should not break its line')
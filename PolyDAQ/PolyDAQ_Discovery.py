@@ -0,0 +1,138 @@
+#**************************************************************************************
+# File: PolyDAQ_Discovery.py
+#   This module finds out which serial ports have PolyDAQ boards on them. Every
+#   candidate port is asked for its version at the same time, each in a thread of its
+#   own, so finding the boards takes about as long as one port's timeout no matter
+#   how many serial devices are plugged in.
+#
+#**************************************************************************************
+
+import glob
+import platform
+import threading
+
+import serial
+
+import new_config as config
+import PolyDAQ_Protocol
+
+
+#======================================================================================
+
+class port_probe_thread (threading.Thread):
+    ''' Class which runs a thread that asks one serial port whether there's a PolyDAQ
+    on it.
+
+    The port is opened, sent the "v" command, and given the timeout to send back a
+    line; then it's closed again. Whatever came back is left in response, which is an
+    empty string if the port couldn't be opened or nothing answered.
+    '''
+
+    def __init__ (self, port_name, baud_rate, timeout):
+
+        threading.Thread.__init__ (self, name = "PortProbeThread")
+        self.daemon = True
+
+        self.port_name = port_name
+        self.baud_rate = baud_rate
+        self.timeout = timeout
+        self.response = ''
+
+
+    #----------------------------------------------------------------------------------
+
+    def run (self):
+        ''' This is the run method for the thread. It asks the port for its version,
+            once.
+            '''
+
+        try:
+            a_port = serial.Serial (self.port_name, self.baud_rate, serial.EIGHTBITS,
+                        serial.PARITY_NONE, serial.STOPBITS_ONE, self.timeout)
+        except (serial.SerialException, OSError, IOError, ValueError):
+            return
+
+        try:
+            a_port.flushInput ()
+            a_port.write (PolyDAQ_Protocol.serial_bytes ('v'))
+            self.response = PolyDAQ_Protocol.serial_text (a_port.readline ())
+        except (serial.SerialException, OSError, IOError):
+            pass
+        finally:
+            a_port.close ()
+
+
+#--------------------------------------------------------------------------------------
+# This function returns a list of the names of the serial ports on this computer which
+# might have a PolyDAQ on them. Where PySerial can list the ports itself, it's asked;
+# otherwise the names are guessed from the usual patterns for each system, so that
+# nothing has to be opened just to see whether it's there.
+
+def candidate_ports ():
+
+    try:
+        import serial.tools.list_ports
+        names = sorted ([a_port[0] for a_port in serial.tools.list_ports.comports ()])
+    except (ImportError, AttributeError, OSError):
+        names = None
+
+    system_name = platform.system ()
+    if names is None:
+        if system_name == "Windows":
+            names = ['COM' + str (number) for number in range (1, 257)]
+        elif system_name == "Darwin":
+            names = glob.glob ('/dev/tty.*') + glob.glob ('/dev/cu.*')
+        else:
+            names = glob.glob ('/dev/ttyUSB*') + glob.glob ('/dev/ttyACM*')
+
+    # The Mac lists every port twice; the call-out (cu) names are the ones to use
+    if system_name == "Darwin":
+        names = [a_name for a_name in names if not a_name.startswith ('/dev/tty.')]
+
+    return names
+
+
+#--------------------------------------------------------------------------------------
+# This function asks every port in a list, all at once, whether it's a PolyDAQ, and
+# returns a list of (port name, version string) pairs for those which are, in the
+# order the ports were given. If no list is given, candidate_ports() is used. A port
+# counts as a PolyDAQ if its answer to "v" has config.polydaq_greeting in it.
+
+def discover_polydaqs (port_names = None, baud_rate = None, timeout = None):
+
+    if port_names is None:
+        port_names = candidate_ports ()
+    if baud_rate is None:
+        baud_rate = config.baud_rate
+    if timeout is None:
+        timeout = config.discovery_timeout
+
+    probes = [port_probe_thread (a_name, baud_rate, timeout) for a_name in port_names]
+    for a_probe in probes:
+        a_probe.start ()
+
+    # Opening a port can take a while on some systems, so allow a bit more than the
+    # read timeout; a probe which is still stuck after that is left behind
+    for a_probe in probes:
+        a_probe.join (timeout + 1.0)
+
+    return [(a_probe.port_name, a_probe.response.strip ()) for a_probe in probes
+            if config.polydaq_greeting in a_probe.response]
+
+
+#======================================================================================
+# This test code runs only if this file is called as a program on the command line. It
+# lists the PolyDAQ boards it can find, including simulated ones.
+
+if __name__ == '__main__':
+
+    import time
+
+    start_time = time.time ()
+    found = discover_polydaqs (candidate_ports ()
+                               + glob.glob (config.sim_port_prefix + '*'))
+    print ('Found ' + str (len (found)) + ' PolyDAQ(s) in '
+           + '{:.2f}'.format (time.time () - start_time) + ' s')
+    for port_name, version in found:
+        print ('  ' + port_name + ': ' + version)
+
@@ -0,0 +1,529 @@
+#**************************************************************************************
+# File: PolyDAQ_Multi_Board.py
+#   This module lets several PolyDAQ boards, each on its own serial port, be recorded
+#   together as one session. Each board gets its own data acquisition thread, and the
+#   rows from all the boards are lined up in time and merged into one stream of data
+#   with a column for every channel on every board.
+#
+#**************************************************************************************
+
+import threading
+
+import numpy
+
+import PolyDAQ_A2D_thread
+import PolyDAQ_Client
+import PolyDAQ_Scheduler
+import PolyDAQ_Data_Store
+import PolyDAQ_Calibration
+
+
+# The value put in a column when its board didn't supply a reading for a row; it's
+# the same gap the acquisition thread leaves for a bad or missing reading, so the
+# plots and files treat both alike
+MISSING_VALUE = PolyDAQ_Data_Store.NO_READING
+
+
+#======================================================================================
+
+class multi_board_session (object):
+    ''' Class which takes data from several PolyDAQ boards at once.
+
+    The GUI uses a session just as it would a data_acq_thread. Each channel belongs
+    to one board, and each board has a data acquisition thread of its own which takes
+    that board's channels on the usual schedule. The threads all start their
+    schedules at nearly the same moment, but not quite, and commands take a little
+    while to get to each board, which may be different for a USB adapter than for a
+    Bluetooth link. So each row's time is corrected by when its thread's schedule
+    started and by how much more latency its board has than the quickest one, which
+    is measured when the port is opened, and is then rounded to the nearest sample
+    time. Rows from different boards with the same sample time are merged into one
+    row.
+
+    A merged row is handed over once every board has gone past its sample time. If
+    a board missed that sample, its columns get the missing value.
+    '''
+
+    def __init__ (self, run_interval, num_boards):
+
+        self.run_interval = run_interval
+        self.daemon = True
+
+        # One data acquisition thread for each board
+        self.workers = [PolyDAQ_A2D_thread.data_acq_thread (run_interval)
+                        for board in range (num_boards)]
+
+        # The list of measurands, which board each one is on, and, for each board,
+        # which columns of a merged row its measurands go in
+        self.measurands = []
+        self.boards = []
+        self.columns = [[] for board in range (num_boards)]
+
+        # Each measurand's own interval, if it has one
+        self.channel_intervals = []
+
+        # In triggered capture mode, this decides which merged rows are kept
+        self.trigger = None
+
+        # The boards' threads hand over raw readings, which are merged, recorded if
+        # the raw readings are being saved, and then calibrated here
+        self.calibrations = PolyDAQ_Calibration.default_registry ()
+        self.calibrators = {}
+        self.raw_recorder = None
+
+        # The merged data from the run. The rows which are still waiting for one or
+        # more boards are kept in a dictionary by sample number
+        self.store = PolyDAQ_Data_Store.sample_store (0)
+        self.pending = {}
+        self.unfilled_row = numpy.empty (0)
+        self.latest = [None] * num_boards
+        self.offsets = [0.0] * num_boards
+        self.running = False
+
+
+    #----------------------------------------------------------------------------------
+
+    def start (self):
+        ''' This method starts the data acquisition thread for every board.
+            '''
+
+        for worker in self.workers:
+            worker.daemon = True
+            worker.start ()
+
+
+    #----------------------------------------------------------------------------------
+
+    def active_boards (self):
+        ''' This method returns a list of the numbers of the boards which have any
+            channels to measure.
+            '''
+
+        return [board for board in range (len (self.workers)) if self.columns[board]]
+
+
+    #----------------------------------------------------------------------------------
+
+    @property
+    def time_array (self):
+        ''' The times of the merged rows so far in this run.
+            '''
+
+        return self.store.time_view ()
+
+
+    @property
+    def data_array (self):
+        ''' A list holding, for each channel on every board, a view of the merged
+            readings so far in this run.
+            '''
+
+        return self.store.channel_views ()
+
+
+    @property
+    def due_array (self):
+        ''' A list holding, for each channel on every board, a view of whether it was
+            due in each merged row so far in this run.
+            '''
+
+        return self.store.due_views ()
+
+
+    #----------------------------------------------------------------------------------
+
+    def set_serial_ports (self, port_names, baud_rate):
+        ''' This method opens a serial port for each board and measures each board's
+            latency. It returns a message and a flag which is True only if every
+            board answered.
+            '''
+
+        messages = []
+        all_ready = True
+
+        for board, port_name in enumerate (port_names):
+            [result_string, ready] = self.workers[board].set_serial_port (port_name,
+                                                                          baud_rate)
+            if ready:
+                latency = self.workers[board].measure_latency ()
+                result_string = result_string.strip () + ' (latency ' \
+                                + '{:.1f}'.format (latency * 1000.0) + ' ms)'
+
+            messages.append ('Board ' + str (board) + ' on ' + port_name + ': '
+                             + result_string.strip ())
+            all_ready = all_ready and ready
+
+        return ['\n'.join (messages), all_ready]
+
+
+    #----------------------------------------------------------------------------------
+
+    def set_measurands (self, measurands, boards):
+        ''' This method sets the list of measurands and, for each one, the number of
+            the board it is to be read from. Each board's thread is given its own
+            measurands, in the same order as in the list.
+            '''
+
+        self.measurands = list (measurands)
+        self.boards = list (boards)
+        self.channel_intervals = [None] * len (measurands)
+        self.calibrations = PolyDAQ_Calibration.default_registry ()
+        self.calibrators = dict (zip (self.measurands,
+                                      self.calibrations.calibrators_for (measurands)))
+
+        for board, worker in enumerate (self.workers):
+            self.columns[board] = [index for index in range (len (measurands))
+                                   if boards[index] == board]
+            worker.set_measurands ([measurands[index] for index in self.columns[board]])
+
+
+    #----------------------------------------------------------------------------------
+
+    def set_channel_intervals (self, intervals):
+        ''' This method sets, for each measurand, the time between its readings if
+            it's to be read less often than every row, or None. Each board's thread
+            is given the intervals of its own measurands.
+            '''
+
+        for board, worker in enumerate (self.workers):
+            worker.set_channel_intervals ([intervals[index]
+                                           for index in self.columns[board]])
+
+        self.channel_intervals = list (intervals)
+
+
+    #----------------------------------------------------------------------------------
+
+    def set_trigger (self, trigger):
+        ''' This method turns on triggered capture of the merged rows with a
+            capture_trigger object, or turns it off if given None.
+            '''
+
+        self.trigger = trigger
+
+
+    #----------------------------------------------------------------------------------
+
+    def trigger_state (self):
+        ''' This method returns the state of the triggered capture, or None if
+            capture isn't triggered.
+            '''
+
+        if self.trigger is None:
+            return None
+
+        return self.trigger.state
+
+
+    #----------------------------------------------------------------------------------
+
+    def set_interval (self, new_time_interval):
+        ''' This method sets the time interval between data points on every board.
+            '''
+
+        self.run_interval = new_time_interval
+        for worker in self.workers:
+            worker.set_interval (new_time_interval)
+
+
+    #----------------------------------------------------------------------------------
+
+    def start_taking_data (self):
+        ''' This method empties the merged store and starts every board which has
+            channels to measure, noting when each one's run began.
+            '''
+
+        self.store = PolyDAQ_Data_Store.sample_store (len (self.measurands),
+                                                      due_flags = True)
+        self.pending = {}
+        self.latest = [None] * len (self.workers)
+
+        # A board whose channels aren't due in a row sends no row at all, so in a
+        # merged row which a board didn't fill, its slow channels are taken not to
+        # have been due; its other channels are missing
+        self.unfilled_row = numpy.empty (len (self.measurands))
+        self.unfilled_row.fill (MISSING_VALUE)
+        for index, interval in enumerate (self.channel_intervals):
+            if interval and interval > self.run_interval:
+                self.unfilled_row[index] = PolyDAQ_Data_Store.NOT_DUE
+
+        if self.trigger is not None:
+            self.trigger.calibrator = self.calibrators[self.measurands
+                                                       [self.trigger.channel]]
+            self.trigger.arm ()
+
+        # Only the differences between the boards' latencies matter; correcting by
+        # the smallest one too would just shift every row a little later
+        active = self.active_boards ()
+        if active:
+            least_latency = min ([self.workers[board].latency for board in active])
+
+        session_start = PolyDAQ_Scheduler.monotonic ()
+        for board in active:
+            board_start = PolyDAQ_Scheduler.monotonic ()
+            self.workers[board].start_taking_data ()
+            self.offsets[board] = board_start - session_start \
+                                  + self.workers[board].latency - least_latency
+
+        self.running = True
+
+
+    #----------------------------------------------------------------------------------
+
+    def stop_taking_data (self):
+        ''' This method stops every board. Rows still waiting for a board are handed
+            over, with missing values, the next time read_new_rows() is called.
+            '''
+
+        for board in self.active_boards ():
+            self.workers[board].stop_taking_data ()
+
+        self.running = False
+
+
+    #----------------------------------------------------------------------------------
+
+    def read_new_rows (self):
+        ''' This method takes the new rows from each board's thread, lines them up by
+            sample time, and returns the merged rows which are complete as a 2D array
+            with the time in the first column and every channel after it. The rows
+            are merged as raw readings and calibrated all at once at the end.
+            '''
+
+        active = self.active_boards ()
+
+        for board in active:
+            new_rows = self.workers[board].read_new_raw_rows ()
+            if len (new_rows) == 0:
+                continue
+
+            # Work out which sample each row belongs to from its corrected time
+            sample_numbers = numpy.round ((new_rows[:, 0] + self.offsets[board])
+                                          / self.run_interval).astype (int)
+
+            for sample_number, values in zip (sample_numbers, new_rows[:, 1:]):
+                merged_row = self.pending.get (sample_number)
+                if merged_row is None:
+                    merged_row = self.unfilled_row.copy ()
+                    self.pending[sample_number] = merged_row
+
+                merged_row[self.columns[board]] = values
+
+            if self.latest[board] is None or sample_numbers[-1] > self.latest[board]:
+                self.latest[board] = sample_numbers[-1]
+
+        # Rows up to the latest sample from the slowest board are complete. Once the
+        # run has stopped, everything which is left is as complete as it will get
+        if self.running:
+            if not active or None in [self.latest[board] for board in active]:
+                finished = []
+            else:
+                last_complete = min ([self.latest[board] for board in active])
+                finished = sorted ([sample_number for sample_number in self.pending
+                                    if sample_number <= last_complete])
+        else:
+            finished = sorted (self.pending.keys ())
+
+        merged_rows = numpy.empty ((len (finished), 1 + len (self.measurands)))
+        for row_index, sample_number in enumerate (finished):
+            merged_rows[row_index, 0] = sample_number * self.run_interval
+            merged_rows[row_index, 1:] = self.pending.pop (sample_number)
+
+        # In triggered capture mode only the merged rows around the trigger are kept.
+        # The boards' threads don't know about the trigger and keep all their rows
+        if self.trigger is not None:
+            kept_rows = []
+            for merged_row in merged_rows:
+                kept_rows += [[row_time] + list (values) for row_time, values
+                              in self.trigger.process (merged_row[0], merged_row[1:])]
+            merged_rows = numpy.array (kept_rows).reshape ((len (kept_rows),
+                                                            1 + len (self.measurands)))
+
+        if len (merged_rows) > 0:
+            if self.raw_recorder is not None:
+                self.raw_recorder.write_rows (merged_rows)
+            due = merged_rows[:, 1:] != PolyDAQ_Data_Store.NOT_DUE
+            merged_rows[:, 1:] = self.calibrations.calibrate_block (self.measurands,
+                                                                    merged_rows[:, 1:])
+            self.store.append_rows (merged_rows[:, 0], merged_rows[:, 1:].T, due.T)
+
+        return merged_rows
+
+
+    #----------------------------------------------------------------------------------
+
+    def set_raw_recorder (self, recorder):
+        ''' This method gives the session a raw_count_writer to which the merged raw
+            readings are written as rows are read, or None to stop recording them.
+            '''
+
+        self.raw_recorder = recorder
+
+
+    #----------------------------------------------------------------------------------
+
+    def timing_text (self):
+        ''' This method returns each board's timing summary, one line per board.
+            '''
+
+        text = '\n'.join (['Board ' + str (board) + ' '
+                           + self.workers[board].timing_text ()
+                           for board in self.active_boards ()])
+        if self.trigger is not None:
+            text += '\n' + self.trigger.status_text ()
+
+        return text
+
+
+    #----------------------------------------------------------------------------------
+
+    def command_latency_report (self):
+        ''' This method returns a list holding each board's report of how long its
+            commands have been taking.
+            '''
+
+        return [worker.command_latency_report () for worker in self.workers]
+
+
+    #----------------------------------------------------------------------------------
+
+    def channel_error_counts (self):
+        ''' This method returns the counts of reading errors for every measurand, in
+            the same order as the measurands, gathered from the boards' threads.
+            '''
+
+        counts = [None] * len (self.measurands)
+        for board, worker in enumerate (self.workers):
+            for index, a_count in zip (self.columns[board],
+                                       worker.channel_error_counts ()):
+                counts[index] = a_count
+
+        return counts
+
+
+    #----------------------------------------------------------------------------------
+
+    def measure_row_time (self, num_rows = 5):
+        ''' This method measures how long each board takes to read a row of its own
+            channels. The boards work at the same time, so the slowest one sets the
+            pace; its time is returned, or None if no board could be measured.
+            '''
+
+        row_times = [self.workers[board].measure_row_time (num_rows)
+                     for board in self.active_boards ()]
+        row_times = [row_time for row_time in row_times if row_time is not None]
+
+        if not row_times:
+            return None
+
+        return max (row_times)
+
+
+    #----------------------------------------------------------------------------------
+
+    def queue_on_every_board (self, method_name, arguments, callback = None,
+                              combine = None):
+        ''' This method queues the same command on every board's thread, using the
+            thread method with the given name, and returns one request which is done
+            when they all are. Its result is what each board said, one line per board,
+            or if a combine function is given, what it returns when it's given the
+            list of the boards' requests.
+            '''
+
+        combined = PolyDAQ_Client.polydaq_request (method_name, 'line', None, callback)
+        board_requests = []
+        finish_lock = threading.Lock ()
+
+        # Called as each board's request finishes, from that board's thread, and once
+        # more after they've all been queued in case they all finished right away
+        def board_done (request):
+            finish_lock.acquire ()
+            try:
+                if (len (board_requests) < len (self.workers) or combined.done
+                        or not all ([a_request.done for a_request in board_requests])):
+                    return
+                if combine is not None:
+                    combined.finish (combine (board_requests))
+                    return
+                combined.finish ('\n'.join (['Board ' + str (board) + ': '
+                    + (a_request.error if a_request.error is not None
+                       else str (a_request.result).strip ())
+                    for board, a_request in enumerate (board_requests)]))
+            finally:
+                finish_lock.release ()
+
+        for worker in self.workers:
+            board_requests.append (getattr (worker, method_name) (*arguments
+                                                                   + (board_done,)))
+        board_done (None)
+
+        return combined
+
+
+    #----------------------------------------------------------------------------------
+
+    def queue_row_time (self, num_rows = 5, callback = None):
+        ''' This method has every board measure its row time, as measure_row_time()
+            does, without waiting; the request's result is the slowest board's time,
+            or None if no board could be measured.
+            '''
+
+        def slowest (board_requests):
+            row_times = [a_request.result for a_request in board_requests
+                         if a_request.error is None and a_request.result is not None]
+            if not row_times:
+                return None
+            return max (row_times)
+
+        return self.queue_on_every_board ('queue_row_time', (num_rows,), callback,
+                                          slowest)
+
+
+    #----------------------------------------------------------------------------------
+
+    def queue_balance (self, command_string, callback = None):
+        ''' This method queues a balance of one bridge on every board.
+            '''
+
+        return self.queue_on_every_board ('queue_balance', (command_string,), callback)
+
+
+    #----------------------------------------------------------------------------------
+
+    def queue_version (self, callback = None):
+        ''' This method asks every board which version it is.
+            '''
+
+        return self.queue_on_every_board ('queue_version', (), callback)
+
+
+    #----------------------------------------------------------------------------------
+
+    def queue_reset (self, callback = None):
+        ''' This method queues a reset of every board's AVR.
+            '''
+
+        return self.queue_on_every_board ('queue_reset', (), callback)
+
+
+    #----------------------------------------------------------------------------------
+
+    def balance_bridge (self, command_string):
+        ''' This method asks every board to balance a bridge and returns what they
+            said, one line per board.
+            '''
+
+        return '\n'.join (['Board ' + str (board) + ': '
+                           + worker.balance_bridge (command_string).strip ()
+                           for board, worker in enumerate (self.workers)])
+
+
+    #----------------------------------------------------------------------------------
+
+    def reset_avr (self):
+        ''' This method asks every board to reset its AVR.
+            '''
+
+        for worker in self.workers:
+            worker.reset_avr ()
+
@@ -0,0 +1,159 @@
+#**************************************************************************************
+# File: PolyDAQ_Pipeline.py
+#   This module implements a pipelined way of talking to the PolyDAQ: several tagged
+#   channel commands are kept in flight at once, and each response is matched to its
+#   command by sequence number, so the USB latency of one command overlaps the others
+#   instead of being paid once per channel.
+#
+#**************************************************************************************
+
+import time
+import collections
+
+import PolyDAQ_Protocol
+
+
+#======================================================================================
+
+class pipelined_transport (object):
+    ''' Class which sends channel commands to the PolyDAQ with a number of them in
+    flight at once.
+
+    The original way of reading a channel flushes the input buffer, sends one
+    command, and waits for the one line that comes back; the next channel can't be
+    asked for until then, so every channel costs a whole serial round trip. This class
+    tags each command with a sequence number and sends up to "depth" of them before
+    waiting. Responses are matched to commands by their tags; lines with an unknown
+    tag (left over from an earlier scan) or with no tag at all are thrown away and
+    counted as resyncs, so the input buffer never needs to be flushed.
+    '''
+
+    def __init__ (self, serial_port, depth = 4, response_timeout = 0.20,
+                  poll_timeout = 0.002):
+
+        self.serial_port = serial_port
+        self.depth = max (1, depth)
+
+        # How long to wait for the response to any one command before giving up on
+        # it, and how long each read of the port may block while waiting
+        self.response_timeout = response_timeout
+        self.poll_timeout = poll_timeout
+
+        # Sequence number to be used for the next command sent
+        self.next_sequence = 0
+
+        # Characters received which don't yet make up a whole line
+        self.rx_buffer = ''
+
+        # Counts of commands which never got an answer and of stray lines discarded
+        self.timeouts = 0
+        self.resyncs = 0
+
+
+    #----------------------------------------------------------------------------------
+
+    def transact (self, commands):
+        ''' This method sends every command in a list of channel commands and returns
+            a list of the response strings, in the same order as the commands. If no
+            response came back for a command in time, its place in the list holds
+            None.
+            '''
+
+        results = [None] * len (commands)
+
+        # In-flight commands, oldest first: sequence number -> (index, time sent)
+        in_flight = collections.OrderedDict ()
+        next_index = 0
+
+        self.serial_port.timeout = self.poll_timeout
+
+        try:
+            while next_index < len (commands) or in_flight:
+
+                # Keep the pipeline full
+                while len (in_flight) < self.depth and next_index < len (commands):
+                    sequence = self.next_sequence
+                    self.next_sequence = (sequence + 1) % PolyDAQ_Protocol.SEQUENCE_LIMIT
+
+                    # Any answer still owed for this number is from long ago; forget it
+                    in_flight.pop (sequence, None)
+
+                    self.serial_port.write (PolyDAQ_Protocol.tagged_command \
+                                            (sequence, commands[next_index]))
+                    in_flight[sequence] = (next_index, time.time ())
+                    next_index += 1
+
+                # Read whatever has arrived, waiting a little if nothing has
+                waiting = self.serial_port.inWaiting ()
+                self.rx_buffer += self.serial_port.read (max (1, waiting))
+
+                for a_line in self.complete_lines ():
+                    try:
+                        sequence, text = PolyDAQ_Protocol.parse_tagged_response (a_line)
+                    except ValueError:
+                        self.resyncs += 1
+                        continue
+
+                    if sequence in in_flight:
+                        index, sent_time = in_flight.pop (sequence)
+                        results[index] = text
+                    else:
+                        self.resyncs += 1
+
+                # Give up on the oldest command if its answer is overdue; its slot in
+                # the results stays None
+                now = time.time ()
+                while in_flight:
+                    sequence, (index, sent_time) = next (iter (in_flight.items ()))
+                    if now - sent_time < self.response_timeout:
+                        break
+                    del in_flight[sequence]
+                    self.timeouts += 1
+
+        finally:
+            self.serial_port.timeout = 0
+
+        return results
+
+
+    #----------------------------------------------------------------------------------
+
+    def complete_lines (self):
+        ''' This method removes and returns the whole lines in the receive buffer. Any
+            junk in front of the first tag character is thrown out first, which gets
+            the stream back in step after a garbled or half-received line.
+            '''
+
+        lines = []
+
+        while True:
+            tag_index = self.rx_buffer.find (PolyDAQ_Protocol.TAG_CHARACTER)
+            if tag_index < 0:
+                # With no tag character anywhere, none of this can be a response
+                if self.rx_buffer.strip ():
+                    self.resyncs += 1
+                self.rx_buffer = ''
+                break
+            if tag_index > 0:
+                if self.rx_buffer[:tag_index].strip ():
+                    self.resyncs += 1
+                self.rx_buffer = self.rx_buffer[tag_index:]
+
+            end_index = self.rx_buffer.find ('\n')
+            if end_index < 0:
+                break
+
+            # If a half-received line was followed by a whole one, the line starts
+            # at the last tag character rather than the first
+            a_line = self.rx_buffer[:end_index]
+            self.rx_buffer = self.rx_buffer[end_index + 1:]
+
+            last_tag_index = a_line.rfind (PolyDAQ_Protocol.TAG_CHARACTER)
+            if last_tag_index > 0:
+                self.resyncs += 1
+                a_line = a_line[last_tag_index:]
+
+            lines.append (a_line)
+
+        return lines
+
@@ -114,7 +114,8 @@ class PlotManager(PyQt4.QtGui.QWidget) :   #WHAT DO I PUT IN PARENTHESES?
 # ----------------------------------------------------------------------------------------------------------           
             
 
-    def updateDisplays(self, isDAQrunning, timePerPoint, timeArray, dataArray):
+    def updateDisplays(self, isDAQrunning, timePerPoint, timeArray, dataArray,
+                       dueArray = None):
 
 
         self.timePerPoint = timePerPoint
@@ -192,8 +193,9 @@ class PlotManager(PyQt4.QtGui.QWidget) :   #WHAT DO I PUT IN PARENTHESES?
                         self.a_scope_display[a_plot['name']].updateCurve (
                                 curve_num,           
                                 self.timePerPoint*self.timeConversionFactor,
-                                [x*self.timeConversionFactor for x in timeArray],
-                                dataArray[ch_cnt])
+                                timeArray * self.timeConversionFactor,
+                                dataArray[ch_cnt],
+                                None if dueArray is None else dueArray[ch_cnt])
                         ch_cnt += 1
                     curve_num +=1    
 
@@ -234,7 +236,8 @@ class PlotManager(PyQt4.QtGui.QWidget) :   #WHAT DO I PUT IN PARENTHESES?
                              
        
 
-    def reattachAllDataToAllPlots(self, time_array, data_array, DAQ_wasJustStopped):
+    def reattachAllDataToAllPlots(self, time_array, data_array, DAQ_wasJustStopped,
+                                  due_array = None):
         
 
 
@@ -274,8 +277,9 @@ class PlotManager(PyQt4.QtGui.QWidget) :   #WHAT DO I PUT IN PARENTHESES?
             for a_channel in a_plot['channels']:
                 
                 if self.channel_matrix[plot_num][curve_num] == 'ON':
-                    self.a_scope_display[a_plot['name']].reattachAllData (curve_num, [x*self.timeConversionFactor for x in time_array],
-                                            data_array[chan_count])
+                    self.a_scope_display[a_plot['name']].reattachAllData (curve_num, time_array * self.timeConversionFactor,
+                                            data_array[chan_count],
+                                            None if due_array is None else due_array[chan_count])
                     chan_count +=1
                 curve_num +=1
             plot_num +=1
@@ -34,6 +34,8 @@ import time
 
 import functools                # For functions to be passed as arguments
 
+import PolyDAQ_Data_Store
+
 from PyQt4.QtCore import * 
 from PyQt4.QtGui import *
 from PyQt4.Qwt5 import *
@@ -44,6 +46,59 @@ from numpy import *
 
 
 
+#======================================================================================
+
+class gappedCurve (QwtPlotCurve):
+    ''' This class is a plot curve whose line can be broken into pieces. Qwt draws a
+    line straight through every point it's given, and won't break it at a NaN, so the
+    curve is given only the readings, along with a list of the runs of them which are
+    to be joined up, and each run is drawn on its own. Pens, symbols, and visibility
+    work just as they do for any other curve.
+    '''
+
+    def __init__ (self, title):
+
+        QwtPlotCurve.__init__ (self, title)
+
+        # Each run is a (first, last) pair of indices into the curve's data; None
+        # means the whole curve is one run
+        self.segments = None
+
+
+    #----------------------------------------------------------------------------------
+
+    def setSegments (self, time_data, oneChannelsData, oneChannelsDue = None):
+        ''' This method gives the curve a channel's times and values, and if they're
+        known, whether the channel was due in each row. Rows without a reading are
+        left out; the line is broken wherever the channel missed a reading it was due
+        for, and joined across rows it simply wasn't due in.
+        '''
+
+        time_data = asarray (time_data)
+        oneChannelsData = asarray (oneChannelsData)
+        if oneChannelsDue is not None:
+            oneChannelsDue = asarray (oneChannelsDue)[:len (oneChannelsData)]
+
+        readRows, self.segments = PolyDAQ_Data_Store.reading_segments \
+                                                (oneChannelsData, oneChannelsDue)
+        self.setData (time_data[readRows], oneChannelsData[readRows])
+
+
+    #----------------------------------------------------------------------------------
+
+    def draw (self, painter, xMap, yMap, *area):
+        ''' Qwt calls this method to draw the curve in the plot's canvas rectangle,
+        and also to draw just the points from one index to another. Drawing the whole
+        curve is done one run at a time.
+        '''
+
+        if len (area) != 1 or self.segments is None:
+            return QwtPlotCurve.draw (self, painter, xMap, yMap, *area)
+
+        for first, last in self.segments:
+            QwtPlotCurve.draw (self, painter, xMap, yMap, first, last)
+
+
 #======================================================================================
 
 class Plot (QwtPlot):
@@ -139,7 +194,7 @@ class Plot (QwtPlot):
 
         # initialize curves
         for index, item in enumerate (self.ch_names):
-            self.curves += [QwtPlotCurve (self.ch_names[index])]
+            self.curves += [gappedCurve (self.ch_names[index])]
 
             self.curves[index].setPen (QPen (self.ch_pen_colors[index],
                                        self.ch_line_widths[index],
@@ -732,11 +787,14 @@ class Plot (QwtPlot):
 
     #----------------------------------------------------------------------------------
 
-    def updateCurve (self, curveNumber, time_per_point, time_data, oneChannelsData):
+    def updateCurve (self, curveNumber, time_per_point, time_data, oneChannelsData,
+                     oneChannelsDue = None):
         ''' If there are data to be plotted, set up the plot curves to display it.
         Each curve's data will have time_data as the X data and one of the items in
         the list of measurements as the Y data. Only the last (points_per_plot) items
         will actually be plotted, so the graph scrolls along as new data are taken.
+        If it's known whether the channel was due in each row, the curve is broken
+        only at readings it missed, not at rows it wasn't due in.
         '''
 
         # don't F with the plots if plot units are being changed! 
@@ -770,27 +828,31 @@ class Plot (QwtPlot):
         # of the plot.
 
         # Just to make sure there ARE data to plot. Probably unneccesary (??!)
-        if (time_data != []):
-            self.curves[curveNumber].setData \
+        if (len (time_data) > 0):
+            self.curves[curveNumber].setSegments \
                 (time_data[timeArrayIndexMin: timeArrayIndexMax], \
-                    oneChannelsData[timeArrayIndexMin: timeArrayIndexMax])
+                    oneChannelsData[timeArrayIndexMin: timeArrayIndexMax], \
+                    None if oneChannelsDue is None \
+                    else oneChannelsDue[timeArrayIndexMin: timeArrayIndexMax])
 
 #        self.replot ()
 
 
     #----------------------------------------------------------------------------------
 
-    def reattachAllData (self, curveNumber, time_data, oneChannelsData):
+    def reattachAllData (self, curveNumber, time_data, oneChannelsData,
+                         oneChannelsDue = None):
         ''' This method reattaches the entire array of data to the plots.  Otherwise
         the only viewable data when data collection is stopped will be limited to the 
         time range of the most recent time window.  Thus, this method allows the user
         to navigate the entire set of data when collection is over.
         '''
 
-        if (time_data != []):  # just in case there are no data... not likely.
-            self.curves[curveNumber].setData (time_data[0: len(time_data)], \
-                         oneChannelsData[0: len(time_data)])
-        
+        if (len (time_data) > 0):  # just in case there are no data... not likely.
+            self.curves[curveNumber].setSegments (time_data[0: len(time_data)],
+                        oneChannelsData[0: len(time_data)],
+                        None if oneChannelsDue is None
+                        else oneChannelsDue[0: len(time_data)])
 
 
     #----------------------------------------------------------------------------------
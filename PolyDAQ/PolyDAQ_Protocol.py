@@ -0,0 +1,406 @@
+#**************************************************************************************
+# File: PolyDAQ_Protocol.py
+#   This module holds the parts of the PolyDAQ serial protocol which are more than a
+#   one character command answered by one line of text. The data acquisition thread
+#   and the simulated board both use these functions, so the two sides of the
+#   conversation are always built from the same rules.
+#
+#**************************************************************************************
+
+import struct
+
+
+#--------------------------------------------------------------------------------------
+# Under Python 2 the text of a command is already the bytes that go down the wire;
+# under Python 3 it has to be converted. Each character stands for one byte.
+
+def serial_bytes (text):
+    ''' This function returns the bytes to be written to a port for a command.
+        '''
+
+    if isinstance (text, str) and str is not bytes:
+        return text.encode ('latin-1')
+
+    return bytes (text)
+
+
+def serial_text (data):
+    ''' This function returns the text of the bytes read from a port.
+        '''
+
+    if isinstance (data, str):
+        return data
+
+    data = bytes (data)
+    if str is bytes:
+        return data
+
+    return data.decode ('latin-1')
+
+
+#--------------------------------------------------------------------------------------
+# Batched scan. Rather than sending one channel command and waiting for one reading,
+# the host sends every channel command in one go, for example "S98AB\n", and the
+# board answers with one framed line holding all the readings in the same order:
+# "S4:2048,2051,1023,3977\r\n". The count after the S lets us check that nothing got
+# lost on the way.
+
+SCAN_COMMAND = 'S'
+
+
+def batch_scan_command (measurands):
+    ''' This function makes the batched scan command which asks the PolyDAQ to read
+        every channel in the list of measurands and send all the readings back in one
+        response.
+        '''
+
+    return SCAN_COMMAND + ''.join (measurands) + '\n'
+
+
+def batch_scan_response (readings, board_times = None):
+    ''' This function makes the framed response to a batched scan command from a list
+        of A/D readings and, if timestamps are on, the board clock time at which each
+        was made. It's used by the simulated board.
+        '''
+
+    if board_times is None:
+        items = [str (int (a_reading)) for a_reading in readings]
+    else:
+        items = [stamped_reading (a_reading, a_time)
+                 for a_reading, a_time in zip (readings, board_times)]
+
+    return SCAN_COMMAND + str (len (readings)) + ':' + ','.join (items) + '\r\n'
+
+
+def parse_batch_response (response_string, num_channels, with_times = False):
+    ''' This function picks apart the response to a batched scan command and returns
+        a list of integer A/D readings, one for each channel. If with_times is True,
+        a tuple is returned instead: the readings and a list of the board clock time
+        of each, or None for any which wasn't timestamped. If the response doesn't
+        have the right frame or the right number of readings, a ValueError is raised
+        so the caller can treat the whole row as bad.
+        '''
+
+    response_string = response_string.strip ()
+
+    if not response_string.startswith (SCAN_COMMAND) or ':' not in response_string:
+        raise ValueError ('Badly framed scan response: ' + repr (response_string))
+
+    count_string, readings_string = response_string[1:].split (':', 1)
+    items = [split_timestamp (an_item) for an_item in readings_string.split (',')]
+    readings = [a_reading for a_reading, a_time in items]
+
+    if int (count_string) != num_channels or len (readings) != num_channels:
+        raise ValueError ('Expected ' + str (num_channels) + ' readings, got '
+                          + repr (response_string))
+
+    if with_times:
+        return (readings, [a_time for a_reading, a_time in items])
+
+    return readings
+
+
+#--------------------------------------------------------------------------------------
+# Board timestamps. A PolyDAQ which has been sent "T1\n" follows each reading it
+# sends with the time at which the reading was made, from its own microsecond clock:
+# "2048@81234567". That goes for plain, batched and tagged responses alike, and "T0\n"
+# turns it off again. The ping command "P" asks for the board clock alone, and is
+# answered with "P81234567\r\n". The clock is a 32 bit count, so it starts over
+# every 71.6 minutes.
+
+TIMESTAMP_COMMAND = 'T'
+TIMESTAMP_CHARACTER = '@'
+PING_COMMAND = 'P'
+
+# The number of microseconds after which the board clock starts over from zero
+BOARD_CLOCK_WRAP = 1 << 32
+
+
+def timestamp_command (enable):
+    ''' This function makes the command which turns board timestamps on or off.
+        '''
+
+    if enable:
+        return TIMESTAMP_COMMAND + '1\n'
+
+    return TIMESTAMP_COMMAND + '0\n'
+
+
+def stamped_reading (reading, board_time):
+    ''' This function puts a board clock time after a reading. It's used by the 
+        simulated board.
+        '''
+
+    return str (int (reading)) + TIMESTAMP_CHARACTER \
+           + str (int (board_time) % BOARD_CLOCK_WRAP)
+
+
+def split_timestamp (text):
+    ''' This function splits a reading which may have a timestamp after it into a
+        tuple of the integer reading and the board clock time, which is None if there
+        was no timestamp. A ValueError is raised if either isn't a proper integer.
+        '''
+
+    text = text.strip ()
+
+    if TIMESTAMP_CHARACTER in text:
+        reading_string, time_string = text.split (TIMESTAMP_CHARACTER, 1)
+        return (int (reading_string), int (time_string))
+
+    return (int (text), None)
+
+
+def ping_response (board_time):
+    ''' This function makes the board's answer to a ping. It's used by the simulated
+        board.
+        '''
+
+    return PING_COMMAND + str (int (board_time) % BOARD_CLOCK_WRAP) + '\r\n'
+
+
+def parse_ping_response (response_string):
+    ''' This function returns the board clock time from the answer to a ping. A
+        ValueError is raised if the line isn't a proper answer.
+        '''
+
+    response_string = response_string.strip ()
+
+    if not response_string.startswith (PING_COMMAND):
+        raise ValueError ('Badly framed ping response: ' + repr (response_string))
+
+    return int (response_string[1:])
+
+
+#--------------------------------------------------------------------------------------
+# Tagged commands, used when several commands are in flight at once. The channel 
+# command is sent behind a # and a two digit hexadecimal sequence number, as in 
+# "#1F9", and the board answers with the same tag in front of the reading, as in
+# "#1F:2048\r\n". The host can then match each response to the command which asked
+# for it no matter what else is in the receive buffer.
+
+TAG_CHARACTER = '#'
+
+# Sequence numbers count from 0 to this number minus one, then start over
+SEQUENCE_LIMIT = 256
+
+
+def tagged_command (sequence, command):
+    ''' This function puts a sequence number tag in front of a channel command.
+        '''
+
+    return TAG_CHARACTER + '{:02X}'.format (sequence % SEQUENCE_LIMIT) + command
+
+
+def tagged_response (sequence, text):
+    ''' This function makes the board's response to a tagged command. It's used by
+        the simulated board.
+        '''
+
+    return TAG_CHARACTER + '{:02X}'.format (sequence) + ':' + text + '\r\n'
+
+
+def parse_tagged_response (response_string):
+    ''' This function splits one line of response to a tagged command into its
+        sequence number and the text which follows the tag, returned as a tuple. A
+        ValueError is raised if the line doesn't have a proper tag.
+        '''
+
+    response_string = response_string.strip ()
+
+    if len (response_string) < 4 or response_string[0] != TAG_CHARACTER \
+            or response_string[3] != ':':
+        raise ValueError ('Badly tagged response: ' + repr (response_string))
+
+    return (int (response_string[1:3], 16), response_string[4:])
+
+
+#--------------------------------------------------------------------------------------
+# Streaming. The host tells the board once which channels to send and how often, for
+# example "G1000:98AB\n" for every 1000 microseconds, and the board then pushes one
+# binary frame per scan until it's sent "H". Each frame is laid out as follows, with
+# all numbers little-endian:
+#
+#   0xA5 0x5A   sync bytes
+#   uint8       sequence number, counting 0 to 255 and around again
+#   uint8       number of channels n
+#   uint32      board time of the scan in microseconds
+#   n * uint16  A/D readings, in the order the channels were asked for
+#   uint16      CRC-16/CCITT of everything from the sequence number to the readings
+
+STREAM_START_COMMAND = 'G'
+STREAM_STOP_COMMAND = 'H'
+
+STREAM_SYNC = bytearray ([0xA5, 0x5A])
+STREAM_HEADER_SIZE = 8
+STREAM_MAX_CHANNELS = 32
+
+
+def stream_start_command (interval, measurands):
+    ''' This function makes the command which starts the board streaming frames of
+        the given channels every interval seconds.
+        '''
+
+    return STREAM_START_COMMAND + str (int (round (interval * 1e6))) + ':' \
+        + ''.join (measurands) + '\n'
+
+
+def stream_frame_size (num_channels):
+    ''' This function returns the size in bytes of a frame holding num_channels
+        readings.
+        '''
+
+    return STREAM_HEADER_SIZE + 2 * num_channels + 2
+
+
+# Table for the CRC-16/CCITT (polynomial 0x1021, starting value 0xFFFF) so the CRC
+# of a frame costs one lookup per byte
+_crc_table = []
+for _byte in range (256):
+    _crc = _byte << 8
+    for _bit in range (8):
+        if _crc & 0x8000:
+            _crc = ((_crc << 1) ^ 0x1021) & 0xFFFF
+        else:
+            _crc = (_crc << 1) & 0xFFFF
+    _crc_table.append (_crc)
+
+
+def crc16_ccitt (data):
+    ''' This function computes the CRC-16/CCITT of a bytearray.
+        '''
+
+    crc = 0xFFFF
+    for a_byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ _crc_table[(crc >> 8) ^ a_byte]
+
+    return crc
+
+
+def encode_stream_frame (sequence, timestamp_us, readings):
+    ''' This function packs one scan's worth of readings into a stream frame. It's
+        used by the simulated board.
+        '''
+
+    body = bytearray (struct.pack ('<BBI' + 'H' * len (readings), sequence & 0xFF,
+                                   len (readings), timestamp_us & 0xFFFFFFFF,
+                                   *readings))
+
+    return bytes (STREAM_SYNC + body + bytearray (struct.pack ('<H',
+                                                  crc16_ccitt (body))))
+
+
+#======================================================================================
+
+class stream_frame_decoder (object):
+    ''' Class which reassembles stream frames from the bytes arriving on the serial
+    port.
+
+    Bytes are fed in as they arrive, in pieces of any size; whole frames which pass
+    their length and CRC checks come out. When something doesn't check out, the
+    decoder skips one byte and hunts for the next sync pattern, so a burst of garbage
+    costs the frames it touched and nothing more. Counts are kept of frames with bad
+    CRCs, of bytes skipped while resyncing, and of frames missing from the sequence.
+    '''
+
+    def __init__ (self, num_channels = None):
+
+        # If the number of channels is known, frames with any other count are bad
+        self.num_channels = num_channels
+
+        self.buffer = bytearray ()
+
+        self.frames = 0
+        self.crc_errors = 0
+        self.resyncs = 0
+        self.lost_frames = 0
+
+        # The board's 32-bit microsecond clock wraps around every 71 minutes or so;
+        # keep track so that the times handed out keep counting up
+        self.last_sequence = None
+        self.last_timestamp = None
+        self.timestamp_base = 0
+
+
+    #----------------------------------------------------------------------------------
+
+    def feed (self, data):
+        ''' This method adds newly received bytes to the buffer and returns a list of
+            the frames which are now complete, each as a tuple holding the sequence 
+            number, the board time in microseconds, and a list of A/D readings.
+            '''
+
+        self.buffer += bytearray (data)
+        frames = []
+
+        while True:
+            start = self.buffer.find (STREAM_SYNC)
+
+            # No sync pattern; keep only a last byte which might be half of one
+            if start < 0:
+                if len (self.buffer) > 1:
+                    self.resyncs += 1
+                    del self.buffer[:-1]
+                break
+
+            if start > 0:
+                self.resyncs += 1
+                del self.buffer[:start]
+
+            if len (self.buffer) < STREAM_HEADER_SIZE:
+                break
+
+            # A channel count that can't be right means this wasn't really a sync
+            num_channels = self.buffer[3]
+            if num_channels == 0 or num_channels > STREAM_MAX_CHANNELS \
+                    or (self.num_channels is not None
+                        and num_channels != self.num_channels):
+                self.resyncs += 1
+                del self.buffer[:1]
+                continue
+
+            size = stream_frame_size (num_channels)
+            if len (self.buffer) < size:
+                break
+
+            body = self.buffer[2:size - 2]
+            (frame_crc,) = struct.unpack ('<H', bytes (self.buffer[size - 2:size]))
+            if crc16_ccitt (body) != frame_crc:
+                self.crc_errors += 1
+                del self.buffer[:1]
+                continue
+
+            fields = struct.unpack ('<BBI' + 'H' * num_channels, bytes (body))
+            del self.buffer[:size]
+
+            frames.append ((fields[0], self.unwrap_timestamp (fields[2]),
+                            list (fields[3:])))
+            self.count_frame (fields[0])
+
+        return frames
+
+
+    #----------------------------------------------------------------------------------
+
+    def count_frame (self, sequence):
+        ''' This method counts a good frame and any frames missing between it and the
+            one before it.
+            '''
+
+        if self.last_sequence is not None:
+            self.lost_frames += (sequence - self.last_sequence - 1) % 256
+        self.last_sequence = sequence
+        self.frames += 1
+
+
+    #----------------------------------------------------------------------------------
+
+    def unwrap_timestamp (self, timestamp_us):
+        ''' This method turns the board's 32-bit time into one which doesn't wrap.
+            '''
+
+        if self.last_timestamp is not None and timestamp_us < self.last_timestamp:
+            self.timestamp_base += 1 << 32
+        self.last_timestamp = timestamp_us
+
+        return self.timestamp_base + timestamp_us
+
@@ -0,0 +1,101 @@
+#**************************************************************************************
+# File: PolyDAQ_Rate_Probe.py
+#   This module keeps track of how fast a set of channels can really be read, so the
+#   GUI can warn against sample times the board and serial link can't keep up with.
+#   Row times are measured by the data acquisition thread and saved here in a small
+#   JSON file, so each board and set of channels only has to be measured once.
+#
+#**************************************************************************************
+
+import json
+
+import new_config as config
+
+
+#======================================================================================
+
+class row_time_cache (object):
+    ''' Class which remembers how long it took to read a row of data.
+
+    A row time depends on the board, on how rows are read (the scan mode), on how
+    many readings the board averages for each one, and on which channels are read. So
+    those are what it's looked up by. The board is identified by whatever it said
+    when the port was opened, which includes its firmware version.
+
+    The file is read when the cache is made and written whenever a new time is added.
+    If it can't be read or written, the cache still works for as long as the program
+    runs.
+    '''
+
+    def __init__ (self, file_name = None):
+
+        if file_name is None:
+            file_name = config.rate_cache_file
+        self.file_name = file_name
+
+        try:
+            cache_file = open (self.file_name, 'r')
+            try:
+                self.row_times = json.load (cache_file)
+            finally:
+                cache_file.close ()
+        except (IOError, OSError, ValueError):
+            self.row_times = {}
+
+
+    #----------------------------------------------------------------------------------
+
+    def key (self, board_name, measurands):
+        ''' This method makes the string by which a row time is looked up. The order
+            in which the channels are read doesn't matter, so they're sorted.
+            '''
+
+        return board_name.strip () + '|' + config.scan_mode + '|O' \
+               + str (config.oversampling) + '|' + ''.join (sorted (measurands))
+
+
+    #----------------------------------------------------------------------------------
+
+    def get (self, board_name, measurands):
+        ''' This method returns the row time saved for a board and set of channels,
+            or None if it hasn't been measured.
+            '''
+
+        return self.row_times.get (self.key (board_name, measurands))
+
+
+    #----------------------------------------------------------------------------------
+
+    def put (self, board_name, measurands, row_time):
+        ''' This method saves the row time for a board and set of channels.
+            '''
+
+        self.row_times[self.key (board_name, measurands)] = row_time
+
+        try:
+            cache_file = open (self.file_name, 'w')
+            try:
+                json.dump (self.row_times, cache_file, indent = 1, sort_keys = True)
+            finally:
+                cache_file.close ()
+        except (IOError, OSError):
+            pass
+
+
+#--------------------------------------------------------------------------------------
+# This function returns the shortest sample time which can be kept up with, given how
+# long a row takes to read; some time is left to spare for the odd slow row.
+
+def fastest_interval (row_time):
+
+    return row_time * config.rate_probe_margin
+
+
+#--------------------------------------------------------------------------------------
+# This function returns a list holding, for each sample time in a list of them, True
+# if a row can be read in that time and False if it can't.
+
+def sustainable_rates (rates, row_time):
+
+    return [a_rate >= fastest_interval (row_time) for a_rate in rates]
+
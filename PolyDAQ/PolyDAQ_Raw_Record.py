@@ -0,0 +1,137 @@
+#**************************************************************************************
+# File: PolyDAQ_Raw_Record.py
+#   This module writes and reads files of the raw A/D readings from a run. A data
+#   file holds readings in real units, worked out with whatever calibration the
+#   station had on the day; if a calibration constant turns out to have been wrong,
+#   the raw file kept beside it lets the run be worked out again with the right one
+#   (see PolyDAQ_Recalibrate.py) rather than having to be done over.
+#
+#   A raw file starts with two lines of text: a line saying what kind of file it is,
+#   then a line of JSON saying which station the data came from, which calibration
+#   set was in use, and which channels there are. The rest is binary, one record for
+#   each row: the time as a 64-bit float, then each channel's reading as a 16-bit
+#   integer, all little-endian. A 12 bit reading fits in 16 bits with room to spare,
+#   so the file is a fraction of the size of the text data file.
+#
+#**************************************************************************************
+
+import json
+import time
+
+import numpy
+
+import PolyDAQ_Data_Store
+
+
+# The first line of every raw file
+RAW_FILE_TAG = 'PolyDAQ raw counts 1'
+
+# The number written in place of a reading which wasn't taken, which is stored as NaN
+# in the data, and the one written for a slow channel in a row it wasn't due in; no
+# 12 bit reading can be negative
+RAW_GAP = -32768
+RAW_NOT_DUE = -32767
+
+
+#--------------------------------------------------------------------------------------
+# This function returns the NumPy type of one record in a raw file with the given
+# number of channels.
+
+def record_dtype (num_channels):
+
+    return numpy.dtype ([('time', '<f8'), ('counts', '<i2', (num_channels,))])
+
+
+#======================================================================================
+
+class raw_count_writer (object):
+    ''' Class which writes the raw A/D readings from a run to a file.
+
+    The header is written when the file is opened. After that, write_rows() is given
+    the rows of raw readings as they come from the data acquisition thread: a 2D
+    array with the time in column 0 and each channel's reading after it, NaN where a
+    reading is missing and minus infinity where it wasn't due. They are written
+    straight to the file as they come.
+    '''
+
+    def __init__ (self, file_name, measurands, calibration_set, station,
+                  channel_names = None):
+
+        self.file_name = file_name
+        self.measurands = list (measurands)
+        self.dtype = record_dtype (len (self.measurands))
+        self.rows_written = 0
+
+        if channel_names is None:
+            channel_names = self.measurands
+
+        header = {'station'         : station,
+                  'calibration_set' : calibration_set,
+                  'measurands'      : self.measurands,
+                  'channel_names'   : list (channel_names),
+                  'started'         : time.strftime ('%Y-%m-%d %H:%M:%S')}
+
+        self.raw_file = open (file_name, 'wb')
+        self.raw_file.write ((RAW_FILE_TAG + '\n' + json.dumps (header, sort_keys = True)
+                              + '\n').encode ('utf-8'))
+
+
+    #----------------------------------------------------------------------------------
+
+    def write_rows (self, rows):
+        ''' This method writes a block of rows of raw readings to the file.
+            '''
+
+        if len (rows) == 0:
+            return
+
+        counts = rows[:, 1:]
+        records = numpy.empty (len (rows), dtype = self.dtype)
+        records['time'] = rows[:, 0]
+        records['counts'] = numpy.where (numpy.isnan (counts), RAW_GAP,
+                            numpy.where (counts == PolyDAQ_Data_Store.NOT_DUE,
+                                         RAW_NOT_DUE, numpy.nan_to_num (counts)))
+
+        self.raw_file.write (records.tobytes ())
+        self.rows_written += len (rows)
+
+
+    #----------------------------------------------------------------------------------
+
+    def close (self):
+        ''' This method closes the file.
+            '''
+
+        self.raw_file.close ()
+
+
+#--------------------------------------------------------------------------------------
+# This function reads a raw file. It returns the header as a dictionary, an array of
+# the row times, and a 2D array of the readings with one column for each channel,
+# NaN wherever a reading is missing and minus infinity wherever one wasn't due, as
+# the data acquisition thread hands them over. A ValueError is raised if the file
+# isn't a raw file. If the last record was only partly written, as when the program
+# was stopped in the middle of writing it, it's left off.
+
+def read_raw_counts (file_name):
+
+    raw_file = open (file_name, 'rb')
+    try:
+        tag = raw_file.readline ().decode ('utf-8').strip ()
+        if tag != RAW_FILE_TAG:
+            raise ValueError (file_name + ' is not a PolyDAQ raw counts file')
+        header = json.loads (raw_file.readline ().decode ('utf-8'))
+        body = raw_file.read ()
+    finally:
+        raw_file.close ()
+
+    dtype = record_dtype (len (header['measurands']))
+    records = numpy.frombuffer (body, dtype = dtype,
+                                count = len (body) // dtype.itemsize)
+
+    readings = records['counts'].astype (numpy.float64)
+    readings[records['counts'] == RAW_GAP] = PolyDAQ_Data_Store.NO_READING
+    readings[records['counts'] == RAW_NOT_DUE] = PolyDAQ_Data_Store.NOT_DUE
+
+    return (header, records['time'].copy (), readings)
+
@@ -0,0 +1,190 @@
+#**************************************************************************************
+# File: PolyDAQ_Recalibrate.py
+#   This program works out the data from old runs again, from the raw A/D readings
+#   saved beside each data file, with a different set of calibrations. When a
+#   station's constants are found to have been wrong, correct them in a copy of the
+#   configuration file and run, for example,
+#
+#       python PolyDAQ_Recalibrate.py --calibrations fixed_config.py Data_Files
+#
+#   to write a recalibrated data file beside every raw file in the folder. Each raw
+#   file is converted with NumPy in one go, so hundreds of runs take a few seconds.
+#
+#**************************************************************************************
+
+import os
+import glob
+import time
+
+import new_config as config
+import PolyDAQ_Calibration
+import PolyDAQ_Data_Store
+import PolyDAQ_Raw_Record
+
+
+#--------------------------------------------------------------------------------------
+# This function reads the calibrations from a configuration file, or from the one the
+# program is using if no file name is given. It returns the name of the calibration
+# set and the station's and common calibration dictionaries.
+
+def load_calibration_set (file_name = None):
+
+    if file_name is None:
+        return (config.calibration_set, config.calibrations,
+                config.common_calibrations)
+
+    settings = {'__file__' : file_name}
+    config_file = open (file_name, 'r')
+    try:
+        exec (compile (config_file.read (), file_name, 'exec'), settings)
+    finally:
+        config_file.close ()
+
+    for a_name in ['calibration_set', 'calibrations', 'common_calibrations']:
+        if a_name not in settings:
+            raise ValueError (file_name + ' has no ' + a_name)
+
+    return (settings['calibration_set'], settings['calibrations'],
+            settings['common_calibrations'])
+
+
+#--------------------------------------------------------------------------------------
+# This function returns a list of the raw files named in a list of file and folder
+# names; every raw file in a folder is taken.
+
+def raw_file_names (names):
+
+    file_names = []
+    for a_name in names:
+        if os.path.isdir (a_name):
+            file_names += sorted (glob.glob (os.path.join (a_name,
+                                             '*.' + config.raw_file_extension)))
+        else:
+            file_names.append (a_name)
+
+    return file_names
+
+
+#======================================================================================
+
+class recalibrator (object):
+    ''' Class which recalibrates raw files with one calibration set.
+
+    Each station's calibrations are looked up the first time a file from that station
+    comes along and kept for the rest, along with their lookup tables, so the cost of
+    building them is paid once however many files there are. A station can be given
+    to use for every file, in place of the one each file says it came from.
+    '''
+
+    def __init__ (self, set_name, calibrations, common_calibrations, station = None):
+
+        self.set_name = set_name
+        self.calibrations = calibrations
+        self.common_calibrations = common_calibrations
+        self.station = station
+        self.registries = {}
+
+
+    #----------------------------------------------------------------------------------
+
+    def registry (self, station):
+        ''' This method returns the calibration registry for a station.
+            '''
+
+        if station not in self.registries:
+            self.registries[station] = PolyDAQ_Calibration.calibration_registry \
+                (station, self.calibrations, self.common_calibrations, True,
+                 self.set_name)
+
+        return self.registries[station]
+
+
+    #----------------------------------------------------------------------------------
+
+    def recalibrate (self, raw_file_name, output_file_name):
+        ''' This method reads a raw file, calibrates its readings, and writes them to
+            a data file laid out as the GUI lays them out. It returns the number of
+            rows written.
+            '''
+
+        header, times, readings = PolyDAQ_Raw_Record.read_raw_counts (raw_file_name)
+
+        station = self.station
+        if station is None:
+            station = header['station']
+        registry = self.registry (station)
+        values = registry.calibrate_block (header['measurands'], readings)
+
+        data_file = open (output_file_name, 'w')
+        try:
+            data_file.write ('PolyDAQ data collection began:,' + header['started']
+                             + '\n')
+            data_file.write ('Data Acquired at Station ' + str (station) + '.\n')
+            data_file.write ('Calibration set:,' + registry.set_id () + '\n')
+            data_file.write ('Recalibrated from:,' + header['calibration_set'] + '\n')
+            data_file.write ('\nData...\n')
+            data_file.write ('Time (s),' + ','.join (header['channel_names']) + '\n')
+            data_file.writelines ([PolyDAQ_Data_Store.csv_row_text (a_time, a_row)
+                                   + '\n' for a_time, a_row
+                                   in zip (times.tolist (), values.tolist ())])
+        finally:
+            data_file.close ()
+
+        return len (times)
+
+
+#======================================================================================
+# This code runs only if this file is called as a program on the command line. It
+# recalibrates every raw file it's given.
+
+if __name__ == '__main__':
+
+    import argparse
+
+    parser = argparse.ArgumentParser (description = 'Recalibrate PolyDAQ raw files')
+    parser.add_argument ('names', nargs = '+',
+                         help = 'raw files, or folders in which every raw file is '
+                                'recalibrated')
+    parser.add_argument ('--calibrations', default = None,
+                         help = 'configuration file holding the calibrations to use; '
+                                'the default is new_config.py')
+    parser.add_argument ('--station', type = int, default = None,
+                         help = "use this station's calibrations rather than those "
+                                'of the station each file came from')
+    parser.add_argument ('--output-dir', default = None,
+                         help = 'folder for the recalibrated files; the default is '
+                                'beside each raw file')
+    parser.add_argument ('--suffix',
+                         default = '_recalibrated.' + config.data_file_extension,
+                         help = 'added to the name of each raw file, less its '
+                                'extension, to make the name of its data file')
+    args = parser.parse_args ()
+
+    set_name, calibrations, common_calibrations = load_calibration_set \
+                                                  (args.calibrations)
+    converter = recalibrator (set_name, calibrations, common_calibrations,
+                              args.station)
+
+    start_time = time.time ()
+    total_rows = 0
+    total_files = 0
+    file_names = raw_file_names (args.names)
+    for raw_file_name in file_names:
+        output_name = os.path.splitext (raw_file_name)[0] + args.suffix
+        if args.output_dir is not None:
+            output_name = os.path.join (args.output_dir, os.path.basename (output_name))
+
+        try:
+            rows = converter.recalibrate (raw_file_name, output_name)
+        except (IOError, OSError, ValueError, KeyError) as an_error:
+            print ('Skipped ' + raw_file_name + ': ' + str (an_error))
+            continue
+
+        total_rows += rows
+        total_files += 1
+        print (raw_file_name + ': ' + str (rows) + ' rows -> ' + output_name)
+
+    print ('Recalibrated ' + str (total_files) + ' file(s), '
+           + str (total_rows) + ' rows, in '
+           + '{:.2f}'.format (time.time () - start_time) + ' s')
+
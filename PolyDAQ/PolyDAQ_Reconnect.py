@@ -0,0 +1,165 @@
+#**************************************************************************************
+# File: PolyDAQ_Reconnect.py
+#   This module implements a thread which looks after a data acquisition thread's
+#   serial port during a run. If the port goes away, as it does when a USB cable is
+#   wiggled or a USB to serial adapter resets, the supervisor keeps looking for it to
+#   come back, under its old name or a new one, and hands it back to the acquisition
+#   thread so the run carries on where it left off.
+#
+#**************************************************************************************
+
+import glob
+import time
+import threading
+
+import new_config as config
+
+
+#======================================================================================
+
+class port_supervisor_thread (threading.Thread):
+    ''' Class which runs a thread that reconnects to a PolyDAQ whose port was lost.
+
+    The acquisition thread calls port_lost() when reading or writing its port fails,
+    and stops taking data. Every config.reconnect_poll_time seconds this thread looks
+    for the board: first under the name of the port which was lost, then under any
+    name matching config.reconnect_port_patterns which wasn't there when the port was
+    lost, since a USB adapter which is plugged back in often comes back as, for
+    example, /dev/ttyUSB1 rather than /dev/ttyUSB0. Each port found is handed to the
+    acquisition thread's reconnect() method, which opens it and checks that the board
+    on it is the same kind as before. When one works, the gap is over.
+
+    Each gap is remembered as the run times at which it started and ended, so it can
+    be reported with the run's timing summary.
+    '''
+
+    def __init__ (self, acq_thread, poll_time = None):
+
+        threading.Thread.__init__ (self, name = "PortSupervisorThread")
+        self.daemon = True
+
+        if poll_time is None:
+            poll_time = config.reconnect_poll_time
+        self.acq_thread = acq_thread
+        self.poll_time = poll_time
+
+        # The wake-up call for when a port is lost, and what's known about that port
+        self.lost_event = threading.Event ()
+        self.lost_port_name = None
+        self.ports_before = set ()
+
+        # The gaps in this run as [start time, end time] lists, the end time being
+        # None while the port is still lost, and the port last reconnected to
+        self.gaps = []
+        self.reconnected_port_name = None
+
+
+    #----------------------------------------------------------------------------------
+
+    def reset (self):
+        ''' This method forgets the gaps from the last run.
+            '''
+
+        self.gaps = []
+        self.reconnected_port_name = None
+
+
+    #----------------------------------------------------------------------------------
+
+    def port_lost (self, port_name, run_time):
+        ''' This method is called when the port port_name has stopped working, at a
+            time run_time seconds into the run, and starts the search for it.
+            '''
+
+        self.lost_port_name = port_name
+        self.ports_before = set (self.matching_ports ())
+        self.gaps.append ([run_time, None])
+        self.lost_event.set ()
+
+
+    #----------------------------------------------------------------------------------
+
+    def port_back (self, port_name, run_time):
+        ''' This method is called when the board has been found on port_name and the
+            run has picked up again, run_time seconds into the run.
+            '''
+
+        self.gaps[-1][1] = run_time
+        self.reconnected_port_name = port_name
+
+
+    #----------------------------------------------------------------------------------
+
+    def matching_ports (self):
+        ''' This method returns a list of the ports which are there right now and
+            whose names match one of the reconnect patterns.
+            '''
+
+        names = []
+        for a_pattern in config.reconnect_port_patterns:
+            names += glob.glob (a_pattern)
+
+        return names
+
+
+    #----------------------------------------------------------------------------------
+
+    def candidate_ports (self):
+        ''' This method returns a list of the ports on which the lost board might have
+            come back, the most likely first.
+            '''
+
+        names = [self.lost_port_name]
+        for a_name in sorted (self.matching_ports ()):
+            if a_name not in self.ports_before and a_name not in names:
+                names.append (a_name)
+
+        return names
+
+
+    #----------------------------------------------------------------------------------
+
+    def run (self):
+        ''' This is the run method for the thread. It sleeps until a port is lost,
+            then tries to get it back until it does or the run is stopped.
+            '''
+
+        while True:
+            self.lost_event.wait ()
+            self.lost_event.clear ()
+
+            for a_name in self.candidate_ports ():
+                if not self.acq_thread.running or self.acq_thread.reconnect (a_name):
+                    break
+
+            # If the board isn't back yet, have another look in a little while
+            if self.acq_thread.running and self.acq_thread.port_is_lost:
+                time.sleep (self.poll_time)
+                self.lost_event.set ()
+
+
+    #----------------------------------------------------------------------------------
+
+    def gap_text (self):
+        ''' This method returns a line saying how many times the port was lost in the
+            run and for how long in all, or an empty string if it never was.
+            '''
+
+        if not self.gaps:
+            return ''
+
+        total_time = 0.0
+        for start_time, end_time in self.gaps:
+            if end_time is not None:
+                total_time += end_time - start_time
+
+        text = 'Port lost ' + str (len (self.gaps)) + ' time' \
+               + ('' if len (self.gaps) == 1 else 's') + '; ' \
+               + '{:.1f}'.format (total_time) + ' s of data missing'
+        if self.gaps[-1][1] is None:
+            text += ', still not back'
+        elif self.reconnected_port_name is not None:
+            text += '; reconnected on ' + self.reconnected_port_name
+
+        return text
+
@@ -0,0 +1,118 @@
+#**************************************************************************************
+# File: PolyDAQ_Ring_Buffer.py
+#   This module holds a ring buffer which passes rows of data from the data
+#   acquisition thread to the GUI without either side ever waiting for the other.
+#
+#**************************************************************************************
+
+import numpy
+
+
+#======================================================================================
+
+class row_ring_buffer (object):
+    ''' Class which implements a single-producer, single-consumer ring buffer of rows.
+
+    Each row holds a time followed by a value for each channel, all as 64-bit floats,
+    in a block of memory allocated once. Two counters keep track of things: the head
+    counts rows ever written and is only changed by the producer, and the tail counts
+    rows ever read and is only changed by the consumer. The producer fills in a whole
+    row before it moves the head past it, so the consumer never sees half a row, and
+    neither side needs a lock.
+
+    If the consumer falls so far behind that the buffer fills up, the producer drops
+    the new row rather than wait, and counts it as an overrun.
+
+    The counters are 32-bit unsigned numbers which wrap around; the capacity must be
+    a power of two so that the wrapping doesn't upset the arithmetic. They are kept in
+    a little array of their own so that the buffer can be built on memory which is
+    shared with another process.
+    '''
+
+    def __init__ (self, width, capacity = 65536, row_memory = None,
+                  index_memory = None):
+
+        if capacity <= 0 or capacity & (capacity - 1):
+            raise ValueError ('Ring buffer capacity must be a power of two')
+
+        self.width = width
+        self.capacity = capacity
+        self.mask = capacity - 1
+
+        # The rows and the head and tail counters may be given memory to live in; if
+        # they aren't, they get memory of their own
+        if row_memory is None:
+            self.rows = numpy.zeros ((capacity, width), dtype = numpy.float64)
+        else:
+            self.rows = numpy.frombuffer (row_memory, dtype = numpy.float64,
+                                          count = capacity * width)
+            self.rows = self.rows.reshape ((capacity, width))
+
+        if index_memory is None:
+            self.indices = numpy.zeros (2, dtype = numpy.uint32)
+        else:
+            self.indices = numpy.frombuffer (index_memory, dtype = numpy.uint32,
+                                             count = 2)
+
+        # Rows the producer had to drop because the buffer was full
+        self.overruns = 0
+
+
+    #----------------------------------------------------------------------------------
+
+    def __len__ (self):
+        ''' The number of rows written but not yet read.
+            '''
+
+        return int ((int (self.indices[0]) - int (self.indices[1])) & 0xFFFFFFFF)
+
+
+    #----------------------------------------------------------------------------------
+
+    def push (self, a_time, values):
+        ''' This method is called by the producer to add one row. It returns True if
+            the row was added or False if the buffer was full and the row dropped.
+            '''
+
+        head = int (self.indices[0])
+        if ((head - int (self.indices[1])) & 0xFFFFFFFF) >= self.capacity:
+            self.overruns += 1
+            return False
+
+        a_row = self.rows[head & self.mask]
+        a_row[0] = a_time
+        a_row[1:] = values
+
+        # Publish the row only now that it's all there
+        self.indices[0] = (head + 1) & 0xFFFFFFFF
+
+        return True
+
+
+    #----------------------------------------------------------------------------------
+
+    def drain (self, max_rows = None):
+        ''' This method is called by the consumer to take every row written since the
+            last time, or at most max_rows of them. The rows come back as a copy: a
+            2D array with one row per line of data, the time in column 0 and the
+            channels after it.
+            '''
+
+        tail = int (self.indices[1])
+        count = (int (self.indices[0]) - tail) & 0xFFFFFFFF
+        if max_rows is not None:
+            count = min (count, max_rows)
+
+        start = tail & self.mask
+        end = start + count
+        if end <= self.capacity:
+            new_rows = self.rows[start:end].copy ()
+        else:
+            new_rows = numpy.concatenate ((self.rows[start:],
+                                           self.rows[:end - self.capacity]))
+
+        # Hand the space back to the producer only once the rows have been copied
+        self.indices[1] = (tail + count) & 0xFFFFFFFF
+
+        return new_rows
+
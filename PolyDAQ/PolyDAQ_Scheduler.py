@@ -0,0 +1,354 @@
+#**************************************************************************************
+# File: PolyDAQ_Scheduler.py
+#   This module holds the scheduler which decides exactly when each row of data is to
+#   be taken. It works from a monotonic clock, so changes to the computer's wall clock
+#   can't upset the sample timing, and it keeps count of how well it kept time. There
+#   is also a class which keeps track of how long commands to the board take.
+#
+#**************************************************************************************
+
+import time
+import threading
+import collections
+
+
+#--------------------------------------------------------------------------------------
+# A clock which only ever counts forward. Python 3 has one built in; under Python 2 on
+# Linux we ask the C library for CLOCK_MONOTONIC, and anywhere else we make do with
+# the ordinary clock.
+
+try:
+    monotonic = time.monotonic
+
+except AttributeError:
+    try:
+        import ctypes
+        import ctypes.util
+
+        class _timespec (ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        _librt = ctypes.CDLL (ctypes.util.find_library ('rt') or 'libc.so.6')
+        _clock_gettime = _librt.clock_gettime
+        _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER (_timespec)]
+        _CLOCK_MONOTONIC = 1
+
+        def monotonic ():
+            ''' This function returns the time in seconds from Linux's monotonic
+                clock, which doesn't jump when the wall clock is set.
+                '''
+
+            a_time = _timespec ()
+            _clock_gettime (_CLOCK_MONOTONIC, ctypes.byref (a_time))
+            return a_time.tv_sec + a_time.tv_nsec * 1e-9
+
+    except (OSError, AttributeError):
+        monotonic = time.time
+
+
+# The things the scheduler can do when one or more whole sample times have gone by
+# before it got around to waiting for the next one
+OVERRUN_POLICIES = ['skip', 'catch_up', 'rephase']
+
+
+#======================================================================================
+
+class sample_scheduler (object):
+    ''' Class which works out when each sample is due and waits until exactly then.
+
+    Samples are due at the start time plus whole multiples of the interval. Waiting
+    is done by sleeping until just before a sample is due and then watching the clock
+    for the last little bit, so a sample is neither early nor late by a sleep's worth
+    of slop. If the data acquisition thread gets held up for longer than an interval,
+    the overrun policy says what to do about the samples which were missed:
+
+        'skip'      Forget the missed samples and take the most recent one right
+                    away; later samples stay on the original schedule.
+        'catch_up'  Take all the missed samples, one right after another, until the
+                    schedule has been caught up with.
+        'rephase'   Forget the missed samples and start a new schedule from now.
+
+    Counts are kept of samples taken, samples missed, and samples taken late, along
+    with how late they were, so the timing quality of a run can be reported.
+    '''
+
+    def __init__ (self, interval, overrun_policy = 'skip', spin_time = 0.0005):
+
+        if overrun_policy not in OVERRUN_POLICIES:
+            raise ValueError ('Unknown overrun policy ' + repr (overrun_policy))
+
+        self.interval = interval
+        self.overrun_policy = overrun_policy
+
+        # How long before a sample is due to stop sleeping and start watching the
+        # clock instead. Sleeping any closer than this risks oversleeping
+        self.spin_time = spin_time
+
+        # This event is used to wake up a sleeping wait when the schedule changes
+        self.wake_event = threading.Event ()
+
+        # Set up the counts, but don't run the schedule until asked to
+        self.start ()
+        self.stopped = True
+
+
+    #----------------------------------------------------------------------------------
+
+    def start (self):
+        ''' This method starts a new schedule, with the first sample due right now,
+            and clears the timing counts.
+            '''
+
+        self.start_time = monotonic ()
+        self.next_deadline = self.start_time
+
+        self.samples = 0
+        self.missed = 0
+        self.late = 0
+        self.total_lateness = 0.0
+        self.max_lateness = 0.0
+
+        self.stopped = False
+        self.wake_event.set ()
+
+
+    #----------------------------------------------------------------------------------
+
+    def stop (self):
+        ''' This method stops the schedule; a wait which is in progress gives up.
+            '''
+
+        self.stopped = True
+        self.wake_event.set ()
+
+
+    #----------------------------------------------------------------------------------
+
+    def set_interval (self, new_interval):
+        ''' This method changes the time between samples, starting with the next one.
+            '''
+
+        self.interval = new_interval
+        self.wake_event.set ()
+
+
+    #----------------------------------------------------------------------------------
+
+    def late_tolerance (self):
+        ''' This method returns how far past its deadline a sample may be taken before
+            it counts as late: a tenth of the interval, but at least half a
+            millisecond.
+            '''
+
+        return max (0.0005, 0.1 * self.interval)
+
+
+    #----------------------------------------------------------------------------------
+
+    def elapsed (self):
+        ''' This method returns the number of seconds since the schedule was started.
+            '''
+
+        return monotonic () - self.start_time
+
+
+    #----------------------------------------------------------------------------------
+
+    def wait_for_next (self):
+        ''' This method waits until the next sample is due, then returns the time at
+            which it was due, in seconds since the schedule started. If the schedule
+            is stopped while waiting, None is returned instead.
+            '''
+
+        while True:
+            # Clear the wake-up first, so a change made after this can't be missed
+            self.wake_event.clear ()
+            if self.stopped:
+                return None
+
+            deadline = self.apply_overrun_policy ()
+            remaining = deadline - monotonic ()
+
+            # Sleep through most of the wait; if something changes the schedule in
+            # the meantime, start over and figure out the deadline again
+            if remaining > self.spin_time:
+                if self.wake_event.wait (remaining - self.spin_time):
+                    continue
+
+            # Watch the clock for the last little bit
+            while monotonic () < deadline:
+                pass
+
+            # If something changed the schedule while we were watching, start over
+            if self.stopped or deadline != self.next_deadline:
+                continue
+
+            break
+
+        lateness = monotonic () - deadline
+        self.samples += 1
+        self.total_lateness += lateness
+        self.max_lateness = max (self.max_lateness, lateness)
+        if lateness > self.late_tolerance ():
+            self.late += 1
+
+        self.next_deadline = deadline + self.interval
+
+        return deadline - self.start_time
+
+
+    #----------------------------------------------------------------------------------
+
+    def apply_overrun_policy (self):
+        ''' This method checks whether whole sample times have gone by since the next
+            sample was due; if they have, the overrun policy decides which deadline
+            is the next one. The deadline is returned.
+            '''
+
+        now = monotonic ()
+        if self.interval <= 0.0 or now - self.next_deadline < self.interval:
+            return self.next_deadline
+
+        num_missed = int ((now - self.next_deadline) / self.interval)
+
+        if self.overrun_policy == 'skip':
+            self.next_deadline += num_missed * self.interval
+            self.missed += num_missed
+
+        elif self.overrun_policy == 'rephase':
+            self.next_deadline = now
+            self.missed += num_missed
+
+        # For 'catch_up' the missed samples are taken, late, one after another
+
+        return self.next_deadline
+
+
+    #----------------------------------------------------------------------------------
+
+    def timing_report (self):
+        ''' This method returns a dictionary with the timing counts for the run.
+            '''
+
+        if self.samples > 0:
+            mean_lateness = self.total_lateness / self.samples
+        else:
+            mean_lateness = 0.0
+
+        return {'samples'       : self.samples,
+                'missed'        : self.missed,
+                'late'          : self.late,
+                'mean_lateness' : mean_lateness,
+                'max_lateness'  : self.max_lateness,
+                'overrun_policy': self.overrun_policy}
+
+
+    #----------------------------------------------------------------------------------
+
+    def timing_text (self):
+        ''' This method returns a one line summary of the timing report suitable for
+            the status box.
+            '''
+
+        report = self.timing_report ()
+
+        return 'Timing: ' + str (report['samples']) + ' samples, ' \
+               + str (report['missed']) + ' missed, ' + str (report['late']) \
+               + ' late (worst ' + '{:.1f}'.format (report['max_lateness'] * 1000.0) \
+               + ' ms, policy ' + report['overrun_policy'] + ')'
+
+
+#======================================================================================
+
+class latency_stats (object):
+    ''' Class which keeps track of how long each kind of command to the board takes.
+
+    For each kind of command, given by name, the time it spent waiting in the queue
+    and the time it took once it was sent are kept for the last few times it was
+    carried out, along with counts of how many times it was carried out and how many
+    of those went wrong. The typical time a command takes is used to decide whether
+    it can be fit in before the next row of data is due.
+    '''
+
+    def __init__ (self, window = 64):
+
+        self.window = window
+        self.recent = {}
+        self.counts = {}
+        self.failures = {}
+
+
+    #----------------------------------------------------------------------------------
+
+    def add (self, name, queue_time, service_time, failed = False):
+        ''' This method records one command of the given kind: how long it waited
+            to be sent and how long it took after that, both in seconds.
+            '''
+
+        if name not in self.recent:
+            self.recent[name] = collections.deque (maxlen = self.window)
+            self.counts[name] = 0
+            self.failures[name] = 0
+
+        self.recent[name].append ((queue_time, service_time))
+        self.counts[name] += 1
+        if failed:
+            self.failures[name] += 1
+
+
+    #----------------------------------------------------------------------------------
+
+    def expected (self, name):
+        ''' This method returns the median time a kind of command has taken after it
+            was sent, lately, or None if it hasn't been seen.
+            '''
+
+        if name not in self.recent:
+            return None
+
+        service_times = sorted ([service_time for queue_time, service_time
+                                 in self.recent[name]])
+        return service_times[len (service_times) // 2]
+
+
+    #----------------------------------------------------------------------------------
+
+    def report (self):
+        ''' This method returns a dictionary which holds, for each kind of command,
+            a dictionary of its counts and times, the times in milliseconds.
+            '''
+
+        report = {}
+        for name, recent in self.recent.items ():
+            queue_times = [queue_time for queue_time, service_time in recent]
+            service_times = [service_time for queue_time, service_time in recent]
+            report[name] = {'count'          : self.counts[name],
+                            'failures'       : self.failures[name],
+                            'queue_ms_mean'  : 1000.0 * sum (queue_times)
+                                               / len (queue_times),
+                            'queue_ms_max'   : 1000.0 * max (queue_times),
+                            'service_ms_median' : 1000.0 * self.expected (name),
+                            'service_ms_max' : 1000.0 * max (service_times)}
+
+        return report
+
+
+    #----------------------------------------------------------------------------------
+
+    def latency_text (self):
+        ''' This method returns a one line summary of the command times suitable for
+            the status box, or an empty string if no commands have been recorded.
+            '''
+
+        report = self.report ()
+        if not report:
+            return ''
+
+        return 'Command latency: ' + '; '.join ([repr (name) + ' '
+            + str (report[name]['count']) + 'x, '
+            + '{:.1f}'.format (report[name]['service_ms_median']) + ' ms typical, '
+            + '{:.1f}'.format (report[name]['service_ms_max']) + ' ms worst, queued '
+            + '{:.1f}'.format (report[name]['queue_ms_max']) + ' ms worst'
+            + ('' if report[name]['failures'] == 0
+               else ', ' + str (report[name]['failures']) + ' failed')
+            for name in sorted (report.keys ())])
@@ -0,0 +1,703 @@
+#**************************************************************************************
+# File: PolyDAQ_Sim_Board.py
+#   This module holds a stand-in for a PolyDAQ 2 board at the other end of a serial
+#   port. It lets the data acquisition code be run and timed without hardware.
+#
+#   Run as a program with --serve, it puts one or more simulated boards on Linux 
+#   pseudo-terminals, which the GUI finds in its list of ports; run without, it times
+#   the different scan modes against a simulated board. Use --help for the options.
+#
+#**************************************************************************************
+
+import os
+import time
+import math
+import random
+import bisect
+import select
+import threading
+
+import new_config as config
+import PolyDAQ_Protocol
+
+
+# The single character commands which ask the PolyDAQ for one channel's A/D reading
+CHANNEL_COMMANDS = '0123456789ABCDEFXYZ'
+
+# The shapes of signal a simulated channel can put out
+WAVEFORM_SHAPES = ['sine', 'square', 'triangle', 'ramp', 'constant']
+
+
+def waveform_value (shape, cycles):
+    ''' This function returns the value, from -1 to 1, of a waveform of the given
+        shape after the given number of cycles.
+        '''
+
+    fraction = cycles - math.floor (cycles)
+
+    if shape == 'sine':
+        return math.sin (2.0 * math.pi * cycles)
+    elif shape == 'square':
+        return 1.0 if fraction < 0.5 else -1.0
+    elif shape == 'triangle':
+        return 4.0 * abs (fraction - 0.5) - 1.0
+    elif shape == 'ramp':
+        return 2.0 * fraction - 1.0
+    elif shape == 'constant':
+        return 0.0
+
+    raise ValueError ('Unknown waveform shape ' + repr (shape))
+
+
+#======================================================================================
+
+class sim_polydaq (object):
+    ''' Class which pretends to be a serial port with a PolyDAQ 2 on the other end.
+
+    An object of this class has the same methods as the serial.Serial object which
+    the data acquisition thread uses, so it can be put in place of the real port. The
+    board is modeled as doing one thing at a time: each command spends half the USB
+    link latency getting to the board, waits for the board to finish what it was
+    doing before, takes some time per A/D conversion, and then spends the other half
+    of the link latency plus its time on the wire getting back. That's enough to show
+    how much each serial round trip costs.
+
+    The rest of the settings make the board less well behaved, for testing:
+
+        jitter            Standard deviation of a random extra delay, in seconds,
+                          added to the link latency each way
+        command_latency   A dictionary of extra seconds the board spends on each kind
+                          of command, by its first character, as in {'L' : 0.5}
+        waveforms         A dictionary of the signal on each channel, by channel
+                          command. Each is a dictionary which may hold 'shape' (one
+                          of WAVEFORM_SHAPES), 'amplitude' and 'offset' in A/D
+                          counts, 'frequency' in Hz and 'phase' in cycles; channels
+                          not listed get a sine wave of their own
+        drop_rate         Fraction of responses which are lost on the way back
+        garble_rate       Fraction of responses which get one character mangled
+        spike_rate        Fraction of responses held up for an extra spike_time
+                          seconds, as when the USB host controller hiccups
+        seed              Seed for the random numbers, so a run can be repeated
+    '''
+
+    def __init__ (self, baud_rate = 115200, link_latency = 0.004,
+                  conversion_time = 0.00005, noise = 2.0, stream_error_rate = 0.0,
+                  clock_drift = 30e-6, clock_start_us = 0, jitter = 0.0,
+                  command_latency = None, waveforms = None, drop_rate = 0.0,
+                  garble_rate = 0.0, spike_rate = 0.0, spike_time = 0.05,
+                  seed = None):
+
+        # The port timeout works like it does in pyserial: None waits forever, zero
+        # returns right away, and anything else is the longest wait in seconds
+        self.timeout = 0
+        self.name = 'SIM'
+
+        # Timing model of the link and the board
+        self.baud_rate = baud_rate
+        self.link_latency = link_latency
+        self.conversion_time = conversion_time
+        self.noise = noise
+        self.jitter = jitter
+        self.command_latency = command_latency or {}
+        self.waveforms = waveforms or {}
+
+        # Faults to inject, and counts of how many were
+        self.drop_rate = drop_rate
+        self.garble_rate = garble_rate
+        self.spike_rate = spike_rate
+        self.spike_time = spike_time
+        self.dropped = 0
+        self.garbled = 0
+        self.spiked = 0
+
+        # All the randomness comes from here, so a seed makes a run repeatable
+        self.random = random.Random (seed)
+
+        # The board starts up averaging one reading per channel until told otherwise
+        self.oversampling = 1
+        self.version_string = 'PolyDAQ 2 (simulated)\r\n'
+
+        # Characters sent to the board which haven't made a whole command yet,
+        # responses which are still on their way back, and responses which have
+        # arrived and are waiting to be read
+        self.command_text = ''
+        self.pending = []
+        self.received = ''
+
+        # Streaming state: which channels to send, how often, and when the next
+        # frame is due. The error rate is the fraction of frames which get a byte
+        # mangled on the way, to exercise the host's resync code
+        self.stream_channels = None
+        self.stream_interval = None
+        self.stream_next_time = None
+        self.stream_sequence = 0
+        self.stream_error_rate = stream_error_rate
+
+        # The board's microsecond clock, which starts at clock_start_us and runs a
+        # little fast or slow; and whether readings are sent with their times
+        self.clock_drift = clock_drift
+        self.clock_start_us = clock_start_us
+        self.timestamps = False
+
+        self.start_time = time.time ()
+        self.board_free_time = self.start_time
+        self.line_free_time = self.start_time
+
+        # Responses come back in the order they were sent, however the jitter falls
+        self.last_ready_time = self.start_time
+
+
+    #----------------------------------------------------------------------------------
+
+    def wire_time (self, text):
+        ''' This method returns the time it takes to send a string over the serial
+            line: ten bit times (start, eight data, stop) for each character.
+            '''
+
+        return len (text) * 10.0 / self.baud_rate
+
+
+    #----------------------------------------------------------------------------------
+
+    def a2d_reading (self, channel):
+        ''' This method makes up an A/D reading for one channel from its waveform, 
+            plus a bit of noise. Unless told otherwise, each channel puts out a slow
+            sine wave with a different frequency and phase.
+            '''
+
+        index = CHANNEL_COMMANDS.index (channel)
+        waveform = self.waveforms.get (channel, {})
+
+        now = time.time () - self.start_time
+        cycles = waveform.get ('frequency', 0.1 * (index + 1)) * now \
+                 + waveform.get ('phase', index / (2.0 * math.pi))
+        value = waveform.get ('offset', 2048.0) + waveform.get ('amplitude', 1000.0) \
+                * waveform_value (waveform.get ('shape', 'sine'), cycles) \
+                + self.random.gauss (0.0, self.noise)
+
+        return max (0, min (4095, int (value)))
+
+
+    #----------------------------------------------------------------------------------
+
+    def link_delay (self):
+        ''' This method returns how long something takes to cross the USB link one
+            way: half the link latency plus a random bit of jitter.
+            '''
+
+        if self.jitter > 0.0:
+            return self.link_latency / 2.0 + abs (self.random.gauss (0.0, self.jitter))
+
+        return self.link_latency / 2.0
+
+
+    #----------------------------------------------------------------------------------
+
+    def board_clock (self, a_time):
+        ''' This method returns what the board's clock read at a given time.
+            '''
+
+        return int (self.clock_start_us + (a_time - self.start_time)
+                    * (1.0 + self.clock_drift) * 1e6) % PolyDAQ_Protocol.BOARD_CLOCK_WRAP
+
+
+    #----------------------------------------------------------------------------------
+
+    def reading_text (self, channel, read_time):
+        ''' This method makes the text of a reading of one channel, with the time it
+            was made after it if timestamps are on.
+            '''
+
+        if self.timestamps:
+            return PolyDAQ_Protocol.stamped_reading (self.a2d_reading (channel),
+                                                     self.board_clock (read_time))
+
+        return str (self.a2d_reading (channel))
+
+
+    #----------------------------------------------------------------------------------
+
+    def respond (self, command, conversions, response):
+        ''' This method queues a response to a command, figuring out when the host
+            will be able to read it from the timing model. The response may be a 
+            function, which is given the time at which the board starts work on the
+            command and returns the text. The time at which the command reached the 
+            board is returned.
+            '''
+
+        arrive_time = time.time () + self.wire_time (command) + self.link_delay ()
+        work_time = max (arrive_time, self.board_free_time)
+        done_time = work_time + conversions * self.conversion_period () \
+                    + self.command_latency.get (command[:1], 0.0)
+        self.board_free_time = done_time
+
+        if callable (response):
+            response = response (work_time)
+        self.send (done_time, response)
+
+        return arrive_time
+
+
+    #----------------------------------------------------------------------------------
+
+    def conversion_period (self):
+        ''' This method returns how long one reading of one channel takes.
+            '''
+
+        return max (1, self.oversampling) * self.conversion_time
+
+
+    #----------------------------------------------------------------------------------
+
+    def send (self, done_time, response):
+        ''' This method puts a response on the wire back to the host as soon as the
+            wire is free after done_time. Only one response at a time can be on the 
+            wire. This is where responses get lost, mangled or held up if faults are
+            being injected.
+            '''
+
+        if response:
+            send_time = max (done_time, self.line_free_time)
+            self.line_free_time = send_time + self.wire_time (response)
+            ready_time = max (self.line_free_time + self.link_delay (),
+                              self.last_ready_time)
+
+            if self.random.random () < self.drop_rate:
+                self.dropped += 1
+                return
+
+            if self.random.random () < self.garble_rate:
+                self.garbled += 1
+                where = self.random.randrange (len (response))
+                response = response[:where] + chr (self.random.randrange (32, 127)) \
+                           + response[where + 1:]
+
+            if self.random.random () < self.spike_rate:
+                self.spiked += 1
+                ready_time += self.spike_time
+
+            self.last_ready_time = ready_time
+            bisect.insort (self.pending, (ready_time, response))
+
+
+    #----------------------------------------------------------------------------------
+
+    def send_stream_frames (self):
+        ''' This method makes the stream frames which the board would have sent by
+            now. If the wire is so far behind that the board's transmit buffer would
+            have filled up, the frame is dropped, but its sequence number is still
+            used up so the host can tell that it's missing.
+            '''
+
+        now = time.time ()
+        while self.stream_channels is not None and self.stream_next_time <= now:
+            scan_time = self.stream_next_time
+            self.stream_next_time += self.stream_interval
+
+            if self.line_free_time - scan_time < 0.05:
+                readings = [self.a2d_reading (a_ch) for a_ch in self.stream_channels]
+                frame = PolyDAQ_Protocol.encode_stream_frame (self.stream_sequence,
+                            self.board_clock (scan_time), readings)
+
+                if self.random.random () < self.stream_error_rate:
+                    where = self.random.randrange (len (frame))
+                    frame = frame[:where] + chr (self.random.randrange (256)) \
+                            + frame[where + 1:]
+
+                self.send (scan_time + len (readings) * self.conversion_period (),
+                           frame)
+
+            self.stream_sequence = (self.stream_sequence + 1) % 256
+
+
+    #----------------------------------------------------------------------------------
+
+    def handle_commands (self):
+        ''' This method takes whole commands off the front of the text which has been
+            written to the board and answers them.
+            '''
+
+        while self.command_text:
+            first = self.command_text[0]
+
+            # Commands which carry parameters end with a newline; wait for it
+            if first in (PolyDAQ_Protocol.SCAN_COMMAND, 'O',
+                         PolyDAQ_Protocol.STREAM_START_COMMAND,
+                         PolyDAQ_Protocol.TIMESTAMP_COMMAND):
+                if '\n' not in self.command_text:
+                    return
+                command, self.command_text = self.command_text.split ('\n', 1)
+
+                if first == 'O':
+                    try:
+                        self.oversampling = int (command[1:])
+                    except ValueError:
+                        pass
+                    self.respond (command, 0, '')
+                elif first == PolyDAQ_Protocol.TIMESTAMP_COMMAND:
+                    self.timestamps = (command[1:] == '1')
+                    self.respond (command, 0, '')
+                elif first == PolyDAQ_Protocol.STREAM_START_COMMAND:
+                    try:
+                        interval_string, channels = command[1:].split (':', 1)
+                        interval = int (interval_string) / 1e6
+                    except ValueError:
+                        continue
+                    self.stream_interval = max (interval, 1e-4)
+                    self.stream_channels = [a_ch for a_ch in channels
+                                            if a_ch in CHANNEL_COMMANDS]
+                    self.stream_sequence = 0
+                    self.stream_next_time = self.respond (command, 0, '')
+                else:
+                    channels = [a_ch for a_ch in command[1:] if a_ch in CHANNEL_COMMANDS]
+                    self.respond (command, len (channels),
+                                  lambda work_time: self.batch_text (channels, work_time))
+                continue
+
+            # A tagged channel command is four characters long: the tag character,
+            # two digits of sequence number, and the channel
+            if first == PolyDAQ_Protocol.TAG_CHARACTER:
+                if len (self.command_text) < 4:
+                    return
+                command, self.command_text = self.command_text[:4], self.command_text[4:]
+                try:
+                    sequence = int (command[1:3], 16)
+                except ValueError:
+                    continue
+                if command[3] in CHANNEL_COMMANDS:
+                    self.respond (command, 1, lambda work_time:
+                                  PolyDAQ_Protocol.tagged_response (sequence,
+                                  self.reading_text (command[3], work_time)))
+                continue
+
+            self.command_text = self.command_text[1:]
+
+            if first in CHANNEL_COMMANDS:
+                self.respond (first, 1, lambda work_time:
+                              self.reading_text (first, work_time) + '\r\n')
+            elif first == 'v':
+                self.respond (first, 0, self.version_string)
+            elif first == PolyDAQ_Protocol.PING_COMMAND:
+                self.respond (first, 0, lambda work_time:
+                              PolyDAQ_Protocol.ping_response (self.board_clock (work_time)))
+            elif first in 'LM':
+                self.respond (first, 20, 'Bridge ' + first + ' balance done\r\n')
+            elif first == PolyDAQ_Protocol.STREAM_STOP_COMMAND:
+                self.send_stream_frames ()
+                self.stream_channels = None
+            elif first == 'R':
+                self.oversampling = 1
+                self.timestamps = False
+                self.stream_channels = None
+                self.respond (first, 0, '')
+
+
+    #----------------------------------------------------------------------------------
+
+    def batch_text (self, channels, work_time):
+        ''' This method makes the response to a batched scan which the board starts
+            work on at work_time; each channel is read one conversion after the last.
+            '''
+
+        readings = [self.a2d_reading (a_ch) for a_ch in channels]
+        if not self.timestamps:
+            return PolyDAQ_Protocol.batch_scan_response (readings)
+
+        period = self.conversion_period ()
+        return PolyDAQ_Protocol.batch_scan_response (readings,
+                    [self.board_clock (work_time + index * period)
+                     for index in range (len (channels))])
+
+
+    #----------------------------------------------------------------------------------
+
+    def collect_arrivals (self):
+        ''' This method moves responses whose time has come into the receive buffer.
+            '''
+
+        self.send_stream_frames ()
+
+        now = time.time ()
+        while self.pending and self.pending[0][0] <= now:
+            self.received += self.pending.pop (0)[1]
+
+
+    #----------------------------------------------------------------------------------
+
+    def wait_for (self, enough):
+        ''' This method waits, as the port timeout allows, until the function
+            enough() says the receive buffer holds what the caller wants.
+            '''
+
+        if self.timeout is None:
+            deadline = None
+        else:
+            deadline = time.time () + self.timeout
+
+        self.collect_arrivals ()
+        while not enough ():
+            now = time.time ()
+            if deadline is not None and now >= deadline:
+                return
+            if self.pending:
+                wake_time = self.pending[0][0]
+            elif self.stream_channels is not None:
+                wake_time = self.stream_next_time
+            elif deadline is None:
+                return
+            else:
+                wake_time = deadline
+            if deadline is not None:
+                wake_time = min (wake_time, deadline)
+            time.sleep (max (0.0, wake_time - now))
+            self.collect_arrivals ()
+
+
+    #----------------------------------------------------------------------------------
+    # The rest of the methods are the ones the data acquisition thread uses on a real
+    # serial.Serial object.
+
+    def write (self, data):
+        self.command_text += data
+        self.handle_commands ()
+        return len (data)
+
+    def read (self, size = 1):
+        self.wait_for (lambda: len (self.received) >= size)
+        data, self.received = self.received[:size], self.received[size:]
+        return data
+
+    def readline (self):
+        self.wait_for (lambda: '\n' in self.received)
+        if '\n' in self.received:
+            end = self.received.index ('\n') + 1
+        else:
+            end = len (self.received)
+        data, self.received = self.received[:end], self.received[end:]
+        return data
+
+    def inWaiting (self):
+        self.collect_arrivals ()
+        return len (self.received)
+
+    def flushInput (self):
+        self.collect_arrivals ()
+        self.received = ''
+
+    def close (self):
+        self.stream_channels = None
+        del self.pending[:]
+        self.received = ''
+
+
+#======================================================================================
+
+class sim_pty_server (threading.Thread):
+    ''' Class which puts a simulated board at the end of a pseudo-terminal.
+
+    Code which opens a real serial port by name, or which needs a file descriptor to
+    wait on, can't be handed a sim_polydaq object. This thread makes a pseudo-terminal,
+    whose far end can be opened like any serial port by the name in port_name, and
+    passes everything written to it to a simulated board and everything the board
+    sends back to it. It only works where there are pseudo-terminals: Linux and the
+    Mac.
+
+    Pseudo-terminals get names like /dev/pts/5 which change from one run to the next,
+    so unless told not to, the server also makes a link to its pseudo-terminal with a
+    name starting with config.sim_port_prefix, such as /tmp/ttyPolyDAQsim0. The GUI
+    lists ports with such names along with the real ones.
+    '''
+
+    def __init__ (self, board = None, poll_time = 0.001, make_link = True):
+
+        # The pty module doesn't exist on Windows, so don't ask for it until needed
+        import pty
+        import tty
+
+        threading.Thread.__init__ (self, name = "SimPtyServer")
+        self.daemon = True
+
+        if board is None:
+            board = sim_polydaq ()
+        self.board = board
+        self.poll_time = poll_time
+
+        # Raw mode stops the terminal driver from fiddling with carriage returns
+        self.master, self.slave = pty.openpty ()
+        tty.setraw (self.slave)
+        self.port_name = os.ttyname (self.slave)
+
+        # Make a link with the first free name; a link left behind by a server which
+        # is gone doesn't count
+        self.link_name = None
+        if make_link:
+            number = 0
+            while os.path.exists (config.sim_port_prefix + str (number)):
+                number += 1
+            self.link_name = config.sim_port_prefix + str (number)
+            if os.path.lexists (self.link_name):
+                os.remove (self.link_name)
+            os.symlink (self.port_name, self.link_name)
+
+        self.keep_running = True
+
+
+    #----------------------------------------------------------------------------------
+
+    def run (self):
+        ''' This is the run method for the thread. It passes commands to the board as
+            they come in, and passes the board's responses back as soon as the timing
+            model says they've arrived.
+            '''
+
+        while self.keep_running:
+            wait_time = self.poll_time
+            if self.board.pending:
+                wait_time = max (0.0, min (wait_time,
+                                           self.board.pending[0][0] - time.time ()))
+
+            readable, writable, broken = select.select ([self.master], [], [], wait_time)
+            if readable:
+                try:
+                    data = os.read (self.master, 1024)
+                except OSError:
+                    break
+                self.board.write (PolyDAQ_Protocol.serial_text (data))
+
+            waiting = self.board.inWaiting ()
+            if waiting:
+                os.write (self.master,
+                          PolyDAQ_Protocol.serial_bytes (self.board.read (waiting)))
+
+
+    #----------------------------------------------------------------------------------
+
+    def stop (self):
+        ''' This method stops the thread and closes the pseudo-terminal.
+            '''
+
+        self.keep_running = False
+        self.join ()
+        os.close (self.master)
+        os.close (self.slave)
+
+        if self.link_name is not None and os.path.lexists (self.link_name):
+            os.remove (self.link_name)
+
+
+#======================================================================================
+# This code runs only if this file is called as a program on the command line. With
+# --serve it puts simulated boards on pseudo-terminals until Ctrl-C is pressed; 
+# otherwise it times polled, batched and pipelined scans of a few channel counts 
+# against the simulated board so the difference can be seen without a PolyDAQ 
+# plugged in. The same options shape the simulated board either way, and --seed
+# makes a run repeatable.
+
+if __name__ == '__main__':
+
+    import argparse
+    import signal
+    import sys
+
+    parser = argparse.ArgumentParser (description = 'Simulated PolyDAQ 2 board')
+    parser.add_argument ('--serve', action = 'store_true',
+                         help = 'serve boards on pseudo-terminals rather than benchmark')
+    parser.add_argument ('--boards', type = int, default = 1,
+                         help = 'number of boards to serve')
+    parser.add_argument ('--latency', type = float, default = 0.004,
+                         help = 'USB link round trip latency, seconds')
+    parser.add_argument ('--jitter', type = float, default = 0.0,
+                         help = 'standard deviation of extra link delay, seconds')
+    parser.add_argument ('--balance-time', type = float, default = 0.0,
+                         help = 'extra time a bridge balance takes, seconds')
+    parser.add_argument ('--noise', type = float, default = 2.0,
+                         help = 'standard deviation of reading noise, A/D counts')
+    parser.add_argument ('--waveform', choices = WAVEFORM_SHAPES, default = None,
+                         help = 'signal shape on every channel')
+    parser.add_argument ('--frequency', type = float, default = 0.1,
+                         help = 'frequency of the --waveform signal, Hz')
+    parser.add_argument ('--drop-rate', type = float, default = 0.0,
+                         help = 'fraction of responses lost')
+    parser.add_argument ('--garble-rate', type = float, default = 0.0,
+                         help = 'fraction of responses with a character mangled')
+    parser.add_argument ('--spike-rate', type = float, default = 0.0,
+                         help = 'fraction of responses held up by --spike-time')
+    parser.add_argument ('--spike-time', type = float, default = 0.05,
+                         help = 'how long a held up response is delayed, seconds')
+    parser.add_argument ('--seed', type = int, default = None,
+                         help = 'seed for the random numbers')
+    args = parser.parse_args ()
+
+    waveforms = {}
+    if args.waveform is not None:
+        for a_ch in CHANNEL_COMMANDS:
+            waveforms[a_ch] = {'shape' : args.waveform, 'frequency' : args.frequency}
+
+    def make_board (board_number):
+        ''' This function makes one simulated board with the options given. Each
+            board gets its own seed, so boards served together aren't identical.
+            '''
+
+        if args.seed is None:
+            seed = None
+        else:
+            seed = args.seed + board_number
+
+        return sim_polydaq (link_latency = args.latency, jitter = args.jitter,
+                            noise = args.noise, waveforms = waveforms,
+                            command_latency = {'L' : args.balance_time,
+                                               'M' : args.balance_time},
+                            drop_rate = args.drop_rate, garble_rate = args.garble_rate,
+                            spike_rate = args.spike_rate, spike_time = args.spike_time,
+                            seed = seed)
+
+    if args.serve:
+        servers = [sim_pty_server (make_board (number))
+                   for number in range (args.boards)]
+        for a_server in servers:
+            a_server.start ()
+            print ('Simulated PolyDAQ on ' + a_server.link_name + ' -> '
+                   + a_server.port_name)
+
+        # Being killed is as good as Ctrl-C, so the links still get cleaned up
+        signal.signal (signal.SIGTERM, lambda signal_number, frame: sys.exit (0))
+        try:
+            while True:
+                time.sleep (1.0)
+        except (KeyboardInterrupt, SystemExit):
+            pass
+
+        for a_server in servers:
+            a_server.stop ()
+            print (a_server.link_name + ': ' + str (a_server.board.dropped)
+                   + ' dropped, ' + str (a_server.board.garbled) + ' garbled, '
+                   + str (a_server.board.spiked) + ' delayed')
+
+    else:
+        import PolyDAQ_A2D_thread
+        import PolyDAQ_Pipeline
+
+        all_channels = ['9', '8', '7', '6', 'A', 'B', 'E', 'F']
+        scan_methods = ['scan_polled', 'scan_batch', 'scan_pipelined']
+        scan_time = 2.0
+
+        print ('Channels   polled rows/s   batched rows/s   pipelined rows/s')
+        for num_channels in (1, 2, 4, 6, 8):
+            rates = []
+            for scan_method in scan_methods:
+                acq_thread = PolyDAQ_A2D_thread.data_acq_thread (0.0)
+                acq_thread.serial_port = make_board (0)
+                acq_thread.pipeline = PolyDAQ_Pipeline.pipelined_transport \
+                                      (acq_thread.serial_port, 4)
+                acq_thread.set_measurands (all_channels[:num_channels])
+                acq_thread.start_taking_data ()
+
+                rows = 0
+                start = time.time ()
+                while time.time () - start < scan_time:
+                    getattr (acq_thread, scan_method) ()
+                    rows += 1
+                rates.append (rows / (time.time () - start))
+
+            print ('{:8d}   {:13.1f}   {:14.1f}   {:16.1f}'.format (num_channels,
+                                                                    *rates))
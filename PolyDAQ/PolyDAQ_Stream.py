@@ -0,0 +1,88 @@
+#**************************************************************************************
+# File: PolyDAQ_Stream.py
+#   This module implements a thread which reads the binary frames a PolyDAQ sends in
+#   streaming mode, checks them, and hands each whole row of readings to whoever is
+#   storing the data.
+#
+#**************************************************************************************
+
+import threading
+
+import serial
+
+import PolyDAQ_Protocol
+
+
+#======================================================================================
+
+class stream_reader_thread (threading.Thread):
+    ''' Class which runs a thread that decodes a PolyDAQ's stream of data frames.
+
+    In streaming mode the board sends data without being asked, so somebody has to be
+    reading the serial port all the time or the frames pile up. This thread does just
+    that: it reads whatever bytes have arrived, feeds them to a frame decoder, and
+    calls a function with the board time and readings of each good frame. The thread
+    runs until stop() is called, or until the port stops working; then it calls
+    error_function, if there is one, and quits.
+    '''
+
+    def __init__ (self, serial_port, serial_lock, num_channels, row_function,
+                  read_timeout = 0.05, error_function = None):
+
+        threading.Thread.__init__ (self, name = "StreamReaderThread")
+        self.daemon = True
+
+        self.serial_port = serial_port
+        self.serial_lock = serial_lock
+        self.row_function = row_function
+        self.read_timeout = read_timeout
+        self.error_function = error_function
+
+        self.decoder = PolyDAQ_Protocol.stream_frame_decoder (num_channels)
+        self.keep_running = True
+
+
+    #----------------------------------------------------------------------------------
+
+    def run (self):
+        ''' This is the run method for the thread. It reads from the serial port,
+            waiting up to read_timeout for bytes to show up, and passes every good
+            frame on.
+            '''
+
+        while self.keep_running:
+            # Only hold the serial port lock while actually reading, so that other
+            # threads can still get a word in
+            port_failed = False
+            self.serial_lock.acquire ()
+            try:
+                self.serial_port.timeout = self.read_timeout
+                data = self.serial_port.read (max (1, self.serial_port.inWaiting ()))
+                self.serial_port.timeout = 0
+            except (serial.SerialException, OSError, IOError):
+                port_failed = True
+            finally:
+                self.serial_lock.release ()
+
+            # A port which has gone away can't be read again; whoever started this
+            # thread has to sort it out with a new port and a new thread
+            if port_failed:
+                self.keep_running = False
+                if self.error_function is not None:
+                    self.error_function ()
+                return
+
+            for sequence, timestamp_us, readings in self.decoder.feed (data):
+                self.row_function (timestamp_us, readings)
+
+
+    #----------------------------------------------------------------------------------
+
+    def stop (self):
+        ''' This method asks the thread to finish up and waits until it has.
+            '''
+
+        self.keep_running = False
+        if threading.current_thread () is not self:
+            self.join ()
+
@@ -0,0 +1,222 @@
+#**************************************************************************************
+# File: PolyDAQ_Thermocouple.py
+#   This module converts between thermocouple voltages and temperatures with the NIST
+#   ITS-90 polynomials for Type K, J and T thermocouples, and works out temperatures
+#   from the output of the AD8495 thermocouple amplifiers on the PolyDAQ board.
+#
+#   The AD8495 multiplies the thermocouple voltage by 122.4, and adds a voltage which
+#   rises by 5 mV for every degree the amplifier itself is above 0 C to stand in for
+#   the voltage the cold junction would have made. Together these give an output of
+#   about 5 mV per degree, which is what the plain linear calibration assumes. But a
+#   Type K thermocouple isn't linear, and the cold junction compensation is only
+#   right near room temperature, so the linear calibration can be off by a couple of
+#   degrees or more away from there. Here the thermocouple voltage is worked out from
+#   the amplifier output, the real cold junction voltage put in its place, and the
+#   temperature found from the NIST inverse polynomial.
+#
+#   All the functions work on NumPy arrays, so a whole table of readings is done at
+#   once.
+#
+#**************************************************************************************
+
+import numpy
+
+
+# The AD8495's gain, and how much its output rises per degree of its own temperature
+AD8495_GAIN = 122.4
+AD8495_VOLTS_PER_DEGREE = 0.005
+
+
+# The NIST ITS-90 reference polynomials for each type of thermocouple. The forward
+# polynomials give the voltage in millivolts from the temperature in degrees C, and
+# the inverse ones the temperature from the voltage. Each is a list of ranges, each
+# range a tuple of its lowest and highest input and its coefficients, constant
+# first; where two ranges meet, the upper one is used. Type K's forward polynomial
+# from 0 C up has an exponential term as well, a0 * exp (a1 * (t - a2) ** 2)
+NIST_POLYNOMIALS = {
+    'K' : {
+        'forward' : [
+            (-270.0, 0.0, [0.0, 3.9450128025e-02, 2.3622373598e-05,
+                           -3.2858906784e-07, -4.9904828777e-09, -6.7509059173e-11,
+                           -5.7410327428e-13, -3.1088872894e-15, -1.0451609365e-17,
+                           -1.9889266878e-20, -1.6322697486e-23]),
+            (0.0, 1372.0, [-1.7600413686e-02, 3.8921204975e-02, 1.8558770032e-05,
+                           -9.9457592874e-08, 3.1840945719e-10, -5.6072844889e-13,
+                           5.6075059059e-16, -3.2020720003e-19, 9.7151147152e-23,
+                           -1.2104721275e-26])],
+        'exponential' : (1.185976e-01, -1.183432e-04, 1.269686e+02),
+        'inverse' : [
+            (-5.891, 0.0, [0.0, 2.5173462e+01, -1.1662878e+00, -1.0833638e+00,
+                           -8.9773540e-01, -3.7342377e-01, -8.6632643e-02,
+                           -1.0450598e-02, -5.1920577e-04]),
+            (0.0, 20.644, [0.0, 2.508355e+01, 7.860106e-02, -2.503131e-01,
+                           8.315270e-02, -1.228034e-02, 9.804036e-04, -4.413030e-05,
+                           1.057734e-06, -1.052755e-08]),
+            (20.644, 54.886, [-1.318058e+02, 4.830222e+01, -1.646031e+00,
+                              5.464731e-02, -9.650715e-04, 8.802193e-06,
+                              -3.110810e-08])]},
+    'J' : {
+        'forward' : [
+            (-210.0, 760.0, [0.0, 5.0381187815e-02, 3.0475836930e-05,
+                             -8.5681065720e-08, 1.3228195295e-10, -1.7052958337e-13,
+                             2.0948090697e-16, -1.2538395336e-19, 1.5631725697e-23]),
+            (760.0, 1200.0, [2.964562568e+02, -1.497612779e+00, 3.178710392e-03,
+                             -3.184768670e-06, 1.572081900e-09,
+                             -3.069136905e-13])],
+        'inverse' : [
+            (-8.095, 0.0, [0.0, 1.9528268e+01, -1.2286185e+00, -1.0752178e+00,
+                           -5.9086933e-01, -1.7256713e-01, -2.8131513e-02,
+                           -2.3963370e-03, -8.3823321e-05]),
+            (0.0, 42.919, [0.0, 1.978425e+01, -2.001204e-01, 1.036969e-02,
+                           -2.549687e-04, 3.585153e-06, -5.344285e-08,
+                           5.099890e-10]),
+            (42.919, 69.553, [-3.11358187e+03, 3.00543684e+02, -9.94773230e+00,
+                              1.70276630e-01, -1.43033468e-03, 4.73886084e-06])]},
+    'T' : {
+        'forward' : [
+            (-270.0, 0.0, [0.0, 3.8748106364e-02, 4.4194434347e-05, 1.1844323105e-07,
+                           2.0032973554e-08, 9.0138019559e-10, 2.2651156593e-11,
+                           3.6071154205e-13, 3.8493939883e-15, 2.8213521925e-17,
+                           1.4251594779e-19, 4.8768662286e-22, 1.0795539270e-24,
+                           1.3945027062e-27, 7.9795153927e-31]),
+            (0.0, 400.0, [0.0, 3.8748106364e-02, 3.3292227880e-05, 2.0618243404e-07,
+                          -2.1882256846e-09, 1.0996880928e-11, -3.0815758772e-14,
+                          4.5479135290e-17, -2.7512901673e-20])],
+        'inverse' : [
+            (-5.603, 0.0, [0.0, 2.5949192e+01, -2.1316967e-01, 7.9018692e-01,
+                           4.2527777e-01, 1.3304473e-01, 2.0241446e-02,
+                           1.2668171e-03]),
+            (0.0, 20.872, [0.0, 2.592800e+01, -7.602961e-01, 4.637791e-02,
+                           -2.165394e-03, 6.048144e-05, -7.293422e-07])]},
+    }
+
+
+#--------------------------------------------------------------------------------------
+# This function evaluates a set of ranges of polynomials, as kept in NIST_POLYNOMIALS,
+# for an array of inputs. Inputs outside all the ranges, and NaNs, give NaN.
+
+def piecewise_polyval (ranges, inputs):
+
+    inputs = numpy.asarray (inputs, dtype = numpy.float64)
+    outputs = numpy.empty (inputs.shape, dtype = numpy.float64)
+    outputs.fill (numpy.nan)
+
+    for low, high, coefficients in ranges:
+        in_range = (inputs >= low) & (inputs <= high)
+        outputs[in_range] = numpy.polyval (coefficients[::-1], inputs[in_range])
+
+    return outputs
+
+
+#--------------------------------------------------------------------------------------
+# This function returns a thermocouple type's entry in NIST_POLYNOMIALS, or raises a
+# ValueError if there isn't one.
+
+def nist_polynomials (kind):
+
+    try:
+        return NIST_POLYNOMIALS[kind]
+    except KeyError:
+        raise ValueError ('No polynomials for thermocouple type ' + repr (kind))
+
+
+#--------------------------------------------------------------------------------------
+# This function returns the voltage, in millivolts, which a thermocouple of the given
+# type makes with its hot junction at each of an array of temperatures in degrees C
+# and its cold junction at 0 C.
+
+def thermocouple_emf (kind, temperatures):
+
+    polynomials = nist_polynomials (kind)
+    temperatures = numpy.asarray (temperatures, dtype = numpy.float64)
+    emf = piecewise_polyval (polynomials['forward'], temperatures)
+
+    if 'exponential' in polynomials:
+        a0, a1, a2 = polynomials['exponential']
+        not_below_zero = temperatures >= 0.0
+        emf[not_below_zero] += a0 * numpy.exp (a1 * (temperatures[not_below_zero]
+                                                     - a2) ** 2)
+
+    return emf
+
+
+#--------------------------------------------------------------------------------------
+# This function returns the temperature, in degrees C, at which a thermocouple of the
+# given type makes each of an array of voltages in millivolts with its cold junction
+# at 0 C. Voltages beyond the range of the NIST inverse polynomials are taken as the
+# end of the range, so a broken thermocouple which drives its amplifier to one of the
+# rails reads as an obviously wrong temperature rather than looking like a gap in the
+# data; only a NaN voltage, which is a gap, gives NaN.
+
+def thermocouple_temperature (kind, emf):
+
+    ranges = nist_polynomials (kind)['inverse']
+    emf = numpy.clip (numpy.asarray (emf, dtype = numpy.float64), ranges[0][0],
+                      ranges[-1][1])
+
+    return piecewise_polyval (ranges, emf)
+
+
+#--------------------------------------------------------------------------------------
+# This function works out the temperatures from an array of AD8495 output voltages.
+# The zero voltage is what the amplifier puts out when the thermocouple is at 0 C;
+# it's the same zero the linear calibration uses. The cold junction temperature, the
+# temperature of the amplifier, may be one number or an array the same shape as the
+# voltages.
+
+def ad8495_temperature (kind, volts, zero_volts, cold_junction_temperature,
+                        gain = AD8495_GAIN):
+
+    cold_junction_temperature = numpy.asarray (cold_junction_temperature,
+                                               dtype = numpy.float64)
+
+    # Take the amplifier's own stand-in for the cold junction voltage back out, and
+    # put in the voltage the cold junction really makes at its temperature
+    emf = (numpy.asarray (volts, dtype = numpy.float64) - zero_volts) * 1000.0 / gain \
+          - cold_junction_temperature * AD8495_VOLTS_PER_DEGREE * 1000.0 / gain \
+          + thermocouple_emf (kind, cold_junction_temperature)
+
+    return thermocouple_temperature (kind, emf)
+
+
+#======================================================================================
+# This test code runs only if this file is called as a program on the command line. It
+# checks the forward polynomials over each type's whole NIST range, that the inverse
+# polynomials undo them, and shows how far the linear calibration is off at a few
+# temperatures.
+
+if __name__ == '__main__':
+
+    for kind in sorted (NIST_POLYNOMIALS.keys ()):
+        low = NIST_POLYNOMIALS[kind]['inverse'][0][0]
+        high = NIST_POLYNOMIALS[kind]['inverse'][-1][1]
+        temperatures = numpy.linspace (NIST_POLYNOMIALS[kind]['forward'][0][0],
+                                       NIST_POLYNOMIALS[kind]['forward'][-1][1], 2001)
+        emf = thermocouple_emf (kind, temperatures)
+
+        # Each block of forward coefficients must join onto the next one
+        for a_range in NIST_POLYNOMIALS[kind]['forward'][1:]:
+            join = thermocouple_emf (kind, [a_range[0] - 1e-6, a_range[0]])
+            if abs (join[1] - join[0]) > 0.001:
+                print ('Type ' + kind + ': forward polynomials jump from '
+                       + '{:.3f}'.format (join[0]) + ' to ' + '{:.3f}'.format (join[1])
+                       + ' mV at ' + '{:.0f}'.format (a_range[0]) + ' C')
+
+        in_range = (emf >= low) & (emf <= high)
+        error = thermocouple_temperature (kind, emf[in_range]) - temperatures[in_range]
+        print ('Type ' + kind + ': 100 C makes ' + '{:.3f}'.format
+               (float (thermocouple_emf (kind, 100.0))) + ' mV; inverse within '
+               + '{:.3f}'.format (numpy.abs (error).max ()) + ' C from '
+               + '{:.0f}'.format (temperatures[in_range].min ()) + ' to '
+               + '{:.0f}'.format (temperatures[in_range].max ()) + ' C')
+
+    print ('Linear 5 mV/C calibration error for Type K, amplifier at 25 C:')
+    for a_temperature in (-50.0, 0.0, 25.0, 100.0, 200.0, 300.0):
+        volts = 1.25 + AD8495_GAIN / 1000.0 * (thermocouple_emf ('K', a_temperature)
+                                               - thermocouple_emf ('K', 25.0)) \
+                + 25.0 * AD8495_VOLTS_PER_DEGREE
+        linear = (volts - 1.25) / AD8495_VOLTS_PER_DEGREE
+        print ('  {:6.1f} C reads {:7.2f} C linear, {:7.2f} C linearized'.format
+               (a_temperature, float (linear),
+                float (ad8495_temperature ('K', volts, 1.25, 25.0))))
+
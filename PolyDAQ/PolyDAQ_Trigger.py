@@ -0,0 +1,163 @@
+#**************************************************************************************
+# File: PolyDAQ_Trigger.py
+#   This module implements triggered capture. Rows of data wait in a buffer which only
+#   holds the last few seconds, until a reading on one channel meets the trigger
+#   condition; then the rows from a little before the trigger to a little after it
+#   are kept, and everything else is thrown away. A transient test can then sit
+#   waiting for its event for as long as it takes without filling up the memory or
+#   the data file with idle readings.
+#
+#**************************************************************************************
+
+import collections
+
+import PolyDAQ_Data_Store
+
+
+# The kinds of trigger there are. A 'level' trigger fires on the first reading at or
+# above the level; 'rising' fires when the readings go from below the level to at
+# or above it, and 'falling' when they go from above the level to at or below it; a
+# 'window' trigger fires on the first reading outside the range from the level to
+# the upper level
+TRIGGER_KINDS = ['level', 'rising', 'falling', 'window']
+
+
+#======================================================================================
+
+class capture_trigger (object):
+    ''' Class which decides which rows of data are kept in a triggered capture.
+
+    Each row is handed to process(), which returns a list of the rows to be kept,
+    often none. Before the trigger fires, the state is 'armed' and rows are held in a
+    buffer from which those older than pre_time seconds are dropped. When a reading
+    from the trigger channel meets the condition, the state becomes 'triggered' and
+    the buffered rows, which end with the one which fired the trigger, are returned
+    all at once. Rows up to post_time seconds after the trigger are then returned as
+    they come; after that the state is 'done' and no more rows are kept.
+
+    The channel is given as its index in the list of measurands, and the levels are
+    in calibrated units. The rows the data acquisition thread hands over hold raw
+    A/D readings, so it sets calibrator to the trigger channel's calibration
+    function, which is used on that channel's reading before it's compared with the
+    levels; if calibrator is None the readings are compared as they are. A row in
+    which the trigger channel wasn't read, so its value is NaN or the marker for a
+    reading which wasn't due, can't fire the trigger.
+    '''
+
+    def __init__ (self, channel, kind = 'rising', level = 0.0, upper_level = None,
+                  pre_time = 1.0, post_time = 5.0):
+
+        if kind not in TRIGGER_KINDS:
+            raise ValueError ('Unknown trigger kind ' + repr (kind))
+        if kind == 'window' and (upper_level is None or upper_level < level):
+            raise ValueError ('A window trigger needs an upper level above its level')
+
+        self.channel = channel
+        self.kind = kind
+        self.level = level
+        self.upper_level = upper_level
+        self.pre_time = pre_time
+        self.post_time = post_time
+        self.calibrator = None
+
+        self.arm ()
+
+
+    #----------------------------------------------------------------------------------
+
+    def arm (self):
+        ''' This method gets the trigger ready for a new capture, forgetting any rows
+            it was holding.
+            '''
+
+        self.state = 'armed'
+        self.pre_rows = collections.deque ()
+        self.last_value = None
+        self.trigger_time = None
+        self.end_time = None
+
+
+    #----------------------------------------------------------------------------------
+
+    def fires (self, value):
+        ''' This method returns True if a reading from the trigger channel meets the
+            trigger condition, given the reading before it.
+            '''
+
+        if self.kind == 'level':
+            return value >= self.level
+
+        if self.kind == 'window':
+            return value < self.level or value > self.upper_level
+
+        # An edge needs a reading before this one to have crossed from
+        if self.last_value is None:
+            return False
+
+        if self.kind == 'rising':
+            return self.last_value < self.level <= value
+
+        return self.last_value > self.level >= value
+
+
+    #----------------------------------------------------------------------------------
+
+    def process (self, row_time, values):
+        ''' This method takes one row of data, as a time and a list of values, and
+            returns a list of the rows which are to be kept now, each a tuple of the
+            same two things.
+            '''
+
+        row = (row_time, values)
+
+        if self.state == 'triggered':
+            if row_time <= self.end_time:
+                return [row]
+            self.state = 'done'
+
+        if self.state == 'done':
+            return []
+
+        # Armed: hold on to the row, forgetting rows from before the pre-trigger time.
+        # A microsecond's slack keeps rounding from losing a row right at the start
+        self.pre_rows.append (row)
+        while self.pre_rows[0][0] < row_time - self.pre_time - 1e-6:
+            self.pre_rows.popleft ()
+
+        value = values[self.channel]
+        if value != value or value == PolyDAQ_Data_Store.NOT_DUE:
+            return []
+        if self.calibrator is not None:
+            value = self.calibrator (value)
+
+        fired = self.fires (value)
+        self.last_value = value
+        if not fired:
+            return []
+
+        self.state = 'triggered'
+        self.trigger_time = row_time
+        self.end_time = row_time + self.post_time
+
+        kept_rows = list (self.pre_rows)
+        self.pre_rows.clear ()
+
+        return kept_rows
+
+
+    #----------------------------------------------------------------------------------
+
+    def status_text (self):
+        ''' This method returns a line saying how the capture is going, for the
+            status box.
+            '''
+
+        if self.state == 'armed':
+            return 'Trigger armed; waiting for the event'
+        if self.state == 'triggered':
+            return 'Triggered at ' + '{:.3f}'.format (self.trigger_time) \
+                   + ' s; capturing until ' + '{:.3f}'.format (self.end_time) + ' s'
+
+        return 'Triggered at ' + '{:.3f}'.format (self.trigger_time) \
+               + ' s; capture complete'
+
@@ -74,10 +74,101 @@ station = 1 # select station 1-5.  The value -1 triggers an error message,
 # USB-serial cable at 115200 baud; the PolyDAQ 1 talks at 9600 baud.
 baud_rate = 115200
 
+# If True, every serial port is asked at once whether it's a PolyDAQ when the GUI
+# starts, and only the ports which answer with a version containing polydaq_greeting
+# within discovery_timeout seconds are listed, along with what they said. If none
+# answers, all the ports are listed as they are when this is False.
+discover_ports = True
+discovery_timeout = 0.3
+polydaq_greeting = 'PolyDAQ'
+
 # Oversampling: the number of measurements to be taken at each channel and averaged
 # each time.  A simple filter to reduce some noise.  The number ranges from 0-99
 oversampling = 10
 
+# How long, in seconds, to wait for a PolyDAQ 2 to say it's done balancing a strain
+# gauge bridge before giving up on it. Data taking is held off while it balances.
+balance_timeout = 5.0
+
+# Commands such as balances are sent in the gaps between rows of data, if they can be
+# expected to be done before the next row is due. One which has waited this many
+# seconds for a gap big enough is sent anyway, and rows wait for it instead.
+command_max_wait = 1.0
+
+# Whoever asks the data acquisition thread to do something with the port, such as
+# opening it or timing a few rows, gives up after a command's timeout and
+# command_max_wait more, or after call_max_wait seconds for a job with no timeout of
+# its own, so a thread stuck on a dead port can't hang the GUI
+call_max_wait = 30.0
+
+# How a row of data is read from the board. 'poll' sends one channel command at a
+# time and waits for each reading, which works with every PolyDAQ. 'batch' sends the
+# whole channel list as one scan command and gets every reading back in one line;
+# it needs board firmware which understands the S (scan) command. 'pipeline' keeps
+# several tagged channel commands (#<seq><channel>) in flight at once and needs
+# firmware which answers them with the same tag. 'stream' tells the board once what
+# to send and how often (the G command), and the board then pushes binary frames
+# with its own timestamps until it's told to stop.
+scan_mode = 'poll'
+
+# How many tagged commands may be in flight at once in pipeline mode. Keep this
+# small enough that the board's serial receive buffer can't overflow.
+pipeline_depth = 4
+
+# What to do when the computer falls behind by one or more whole sample times.
+# 'skip' forgets the missed samples and stays on the original schedule; 'catch_up'
+# takes the missed samples one right after another; 'rephase' forgets the missed 
+# samples and starts a new schedule from the moment it caught up.
+overrun_policy = 'skip'
+
+# How many rows the ring buffer between the data acquisition thread and the GUI can
+# hold; this must be a power of two. At 1000 rows per second, 65536 rows lets the 
+# GUI fall about a minute behind before rows stop being saved to the file.
+ring_buffer_rows = 65536
+
+# If True, data is taken in a separate process rather than a thread in the GUI's
+# process, so plotting and file writing can't make the samples late. The rows come
+# back to the GUI through shared memory.
+acquisition_process = False
+
+# To record from several PolyDAQ boards at once, list their serial ports here, for
+# example ['/dev/ttyUSB0', '/dev/ttyUSB1']; choosing any port in the GUI then opens
+# all of them. Each channel below may then have a 'board' entry giving the number of
+# the board it's on, counting from 0; channels without one are on board 0. Leave the
+# list empty to use one board on the port chosen in the GUI.
+board_ports = []
+
+# If True, the board is asked to follow each reading with the time at which it was
+# made, from its own clock, and is pinged every clock_sync_interval seconds so its
+# clock can be lined up with the computer's. Each row then gets the time at which
+# its first channel was read, free of USB and scheduling jitter. The board must have
+# firmware which understands the T and P commands.
+board_timestamps = False
+clock_sync_interval = 1.0
+
+# Simulated boards (run PolyDAQ_Sim_Board.py --serve) make links to their ports with
+# names which start with this; the GUI lists any it finds along with the real ports.
+sim_port_prefix = '/tmp/ttyPolyDAQsim'
+
+# If True and the serial port stops working during a run, as it does when a USB cable
+# is bumped, the run is put on hold and the board is looked for every
+# reconnect_poll_time seconds, under the old port name or any new one matching
+# reconnect_port_patterns, since a board plugged back in may get a new name. When
+# it's found, the run carries on into the same data and file, with an empty row
+# marking the gap.
+auto_reconnect = True
+reconnect_poll_time = 0.5
+reconnect_port_patterns = ['/dev/ttyUSB*', sim_port_prefix + '*']
+
+# When a port is opened or the channels are changed, a few rows are read as fast as
+# possible to find out how quickly these channels can really be read. Sample times
+# shorter than that, with rate_probe_margin to spare, are marked too fast in the
+# list of rates. The answer is saved in rate_cache_file for each board, scan mode,
+# oversampling and set of channels, so each is only measured once.
+rate_probe_rows = 5
+rate_probe_margin = 1.25
+rate_cache_file = os.path.expanduser('~') + '/.PolyDAQ_rate_cache.json'
+
 # The path to the directory in which data will be saved. 
 data_file_path = os.path.expanduser('~') + '/Desktop/PolyDAQ_Data_Files' #'.'
 
@@ -88,6 +179,11 @@ data_file_name = time.strftime("%a_%m.%d.%y_%I.%M%p")
 # The extension for the data file name; .csv is most commonly used.
 data_file_extension = 'csv'
 
+# If True, the raw A/D readings are also saved, in a compact binary file beside the
+# data file with this extension, so the run can be recalibrated later if need be
+record_raw_counts = True
+raw_file_extension = 'raw'
+
 # The software name is displayed in the main window
 software_name = 'PolyDAQ Ver. 2.2, Released September 12, 2017 (Python 2.7) ' #+ str (date.today ())
 
@@ -100,6 +196,13 @@ software_name = 'PolyDAQ Ver. 2.2, Released September 12, 2017 (Python 2.7) ' #+
 # strings
 rates = [0.001, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0]
 
+# A channel below may have an 'interval' entry, giving the time in seconds between
+# its readings, if it needn't be read as often as the sample time chosen in the GUI;
+# thermocouples, which change slowly, might have 'interval' : 1.0 while voltages are
+# sampled every 0.001 s. Such a channel is only read in some of the rows, and the
+# other rows have a blank in its column of the data file. Channels without an
+# 'interval' are read in every row.
+
 # The xlabel is the label for the time axis under the lowest graph on the page.
 xlabel = 'Time (s)'
 
@@ -308,74 +411,120 @@ plots.append (newplot)
 
 #--------------------------------------------------------------------------------------
 ####################################
+# Calibrations: how to turn the number each channel's A/D converter sends back into 
+# a reading in real units. Each board has been calibrated on its own, so there is a
+# set of calibrations for each station, along with some which are the same for every
+# board. Each channel's calibration is a dictionary holding either 'coefficients', a
+# list of the coefficients of a polynomial in the A/D reading, the constant first;
+# or 'pieces', a list of (limit, coefficients) pairs in which the first piece whose
+# limit is at least the A/D reading is used, and a limit of None takes the rest; or
+# 'thermocouple', the type of a thermocouple read through an AD8495 amplifier, along
+# with the amplifier's 'zero_volts', 'gain' and cold junction settings.
+# PolyDAQ_Calibration.py turns these into a function for each channel when the 
+# channels are chosen, so nothing here is looked up while data is being taken.
+
+# The type of thermocouple plugged into the thermocouple channels: 'K', 'J' or 'T'.
+# Readings are converted with the NIST polynomials for that type, from lookup tables
+# made when the channels are chosen, so this costs nothing while data is being
+# taken. A reading beyond the range of the polynomials, as from a broken
+# thermocouple, is given the temperature at the end of the range. None goes back to
+# the plain linear calibration of 5 mV per degree C
+thermocouple_type = 'K'
+
+# The thermocouple amplifiers' gain, and the temperature of their cold junction in
+# degrees C: that of the board, which is taken to be room temperature. If a channel
+# measures the board's temperature in degrees C, give its command as the cold
+# junction channel, and when it's read along with the thermocouples, each row's
+# thermocouple readings are worked out with that row's cold junction temperature
+thermocouple_gain = 122.4
+cold_junction_temperature = 25.0
+cold_junction_channel = None
+
+# The thermocouple amplifiers put out about 5 mV per degree C, on top of a zero which
+# is a bit different on each channel, into a 12 bit A/D converter with a 3.3 V 
+# reference. The zero is the amplifier's output with the thermocouple at 0 C
+def thermocouple (zero_volts):
+    if thermocouple_type is None:
+        return {'coefficients' : [-zero_volts / 0.005, (3.3) / 4095 / 0.005]}
+    return {'thermocouple' : thermocouple_type, 'zero_volts' : zero_volts,
+            'gain' : thermocouple_gain,
+            'cold_junction_temperature' : cold_junction_temperature,
+            'cold_junction_channel' : cold_junction_channel}
+
+# The millivolt channels use one quadratic for readings up to 150 and another above
+def millivolts (low_coefficients, high_coefficients):
+    return {'pieces' : [(150, low_coefficients), (None, high_coefficients)]}
+
+# These channels are calibrated the same way on every board
+common_calibrations = {
+    # Voltage 1 and 2
+    'A' : {'coefficients' : [-8.8537, 0.00513]},
+    'B' : {'coefficients' : [-8.8537, 0.00513]},
+    }
+
+# The name of this set of calibrations. It's saved with each run's raw readings, so
+# that the run can later be worked out again with a corrected set; give it a new name
+# whenever the constants below are changed
+calibration_set = 'constants 2017-09'
+
+# Thermocouples 1 to 4 are channels 9 to 6; Millivoltage 1 and 2 are E and F
+calibrations = {
+    1 : {'9' : thermocouple (1.24974),
+         '8' : thermocouple (1.2522),
+         '7' : thermocouple (1.25),
+         '6' : thermocouple (1.24775),
+         'E' : millivolts ([-0.1793, 0.01136, -1.71396e-5],
+                           [-0.04801, 0.008051, -4.5337e-9]),
+         'F' : millivolts ([-0.21979, 0.010282, -1.03404e-5],
+                           [-0.13588, 0.008067, -3.72858e-9])},
+    2 : {'9' : thermocouple (1.2539),
+         '8' : thermocouple (1.24965),
+         '7' : thermocouple (1.25015),
+         '6' : thermocouple (1.2534),
+         'E' : millivolts ([-0.1881, 0.011422, -1.80897e-5],
+                           [-0.030353, 0.0080179, 2.0686e-9]),
+         'F' : millivolts ([-0.18104, 0.011726, -1.95506e-5],
+                           [-0.02149, 0.008031, 5.69066e-10])},
+    3 : {'9' : thermocouple (1.25475),
+         '8' : thermocouple (1.249),
+         '7' : thermocouple (1.246),
+         '6' : thermocouple (1.25125),
+         'E' : millivolts ([-0.20884, 0.010041, -9.0919e-6],
+                           [-0.09074, 0.0080214, 1.6738e-9]),
+         'F' : millivolts ([-0.19212, 0.01053, -1.2052e-5],
+                           [-0.06840, 0.008028, 1.57139e-9])},
+    4 : {'9' : thermocouple (1.25475),
+         '8' : thermocouple (1.25397),
+         '7' : thermocouple (1.250615),
+         '6' : thermocouple (1.252265),
+         'E' : millivolts ([-0.1957, 0.010877, -1.42525e-5],
+                           [-0.05407, 0.0080229, 1.791559e-9]),
+         'F' : millivolts ([-0.17914, 0.011398, -1.75013e-5],
+                           [-0.03039, 0.008034, 1.24726e-9])},
+    5 : {'9' : thermocouple (1.25375),
+         '8' : thermocouple (1.249),
+         '7' : thermocouple (1.24885),
+         '6' : thermocouple (1.252),
+         'E' : millivolts ([-0.25476, 0.009567, -6.5858e-6],
+                           [-0.15493, 0.0080173, 1.9942e-9]),
+         'F' : millivolts ([-0.16209, 0.012318, -2.37306e-5],
+                           [0.02078, 0.008028, 1.39109e-9])},
+    }
+
+
+# If True, each channel's calibration is worked out for all 4096 readings the A/D 
+# converter can send when the channels are chosen, and readings are then looked up 
+# in those tables rather than worked out one at a time
+calibration_tables = False
+
+
+# This function converts one A/D reading from a channel at this station. It's kept
+# for programs which call it directly; the PolyDAQ program itself looks up each
+# channel's calibration once, when the channels are chosen.
 def calibrationEquation (a2d_reading, measurand):
 
-
-   
-
-    if (measurand == '9'): #Thermocouple 1
-        if station == 1: value = a2d_reading*(3.3)/4095/.005 - 1.24974/.005  # station 1
-        if station == 2: value = a2d_reading*(3.3)/4095/.005 - 1.2539/.005   # station 2
-        if station == 3: value = a2d_reading*(3.3)/4095/.005 - 1.25475/.005  # station 3
-        if station == 4: value = a2d_reading*(3.3)/4095/.005 - 1.25475/.005  # station 4 
-        if station == 5: value = a2d_reading*(3.3)/4095/.005 - 1.25375/.005  # station 5
-    elif (measurand == '8'): # Thermocouple 2
-        if station == 1: value = a2d_reading*(3.3)/4095./0.005 - 1.2522/.005 # station 1
-        if station == 2: value = a2d_reading*(3.3)/4095/.005 - 1.24965/.005  # station 2
-        if station == 3: value = a2d_reading*(3.3)/4095/.005 - 1.249/.005    # station 3
-        if station == 4: value = a2d_reading*(3.3)/4095/.005 - 1.25397/.005  # station 4
-        if station == 5: value = a2d_reading*(3.3)/4095/.005 - 1.249/.005  # station 5
-    elif (measurand == '7'): # Thermocouple 3
-        if station == 1: value = a2d_reading*(3.3)/4095./0.005 - 1.25/.005   # station 1
-        if station == 2: value = a2d_reading*(3.3)/4095/.005 - 1.25015/.005  # station 2
-        if station == 3: value = a2d_reading*(3.3)/4095/.005 - 1.246/.005    # station 3
-        if station == 4: value = a2d_reading*(3.3)/4095/.005 - 1.250615/.005  # station 4
-        if station == 5: value = a2d_reading*(3.3)/4095/.005 - 1.24885/.005  # station 5
-    elif (measurand == '6'): # Thermocouple 4
-        if station == 1: value = a2d_reading*(3.3)/4095./0.005- 1.24775/.005 # station 1
-        if station == 2: value = a2d_reading*(3.3)/4095/.005 - 1.2534/.005   # station 2
-        if station == 3: value = a2d_reading*(3.3)/4095/.005 - 1.25125/.005  # station 3
-        if station == 4: value = a2d_reading*(3.3)/4095/.005 - 1.252265/.005  # station 4
-        if station == 5: value = a2d_reading*(3.3)/4095/.005 - 1.252/.005  # station 5 
-        
-    elif (measurand == 'A'): # Voltage 1
-        value = a2d_reading*0.00513 - 8.8537
-    elif (measurand == 'B'): # Voltage 2
-        value = a2d_reading*0.00513 - 8.8537
-
-    elif (measurand == 'E'): # Millivoltage 1
-    
-        if (a2d_reading <= 150): 
-            if station == 1: value = (-1.71396e-5)*a2d_reading ** 2 + 0.01136*a2d_reading - 0.1793 #station 1
-            if station == 2: value = (-1.80897e-5)*a2d_reading ** 2 + 0.011422*a2d_reading - 0.1881 #station 2
-            if station == 3: value = (-9.0919e-6)*a2d_reading ** 2 + 0.010041*a2d_reading - 0.20884 #station 3
-            if station == 4: value = (-1.42525e-5)*a2d_reading ** 2 + 0.010877*a2d_reading - 0.1957 #station 4
-            if station == 5: value = (-6.5858e-6)*a2d_reading ** 2 + 0.009567*a2d_reading - 0.25476 #station 5
-            
-        else:  
-            if station == 1: value = (-4.5337e-9)*a2d_reading ** 2 + 0.008051*a2d_reading - 0.04801 #station 1
-            if station == 2: value = (2.0686e-9)*a2d_reading ** 2 + 0.0080179*a2d_reading - 0.030353 #station 2    
-            if station == 3: value = (1.6738e-9)*a2d_reading ** 2 + 0.0080214*a2d_reading - 0.09074 #station 3
-            if station == 4: value = (1.791559e-9)*a2d_reading ** 2 + 0.0080229*a2d_reading - 0.05407 #station 4
-            if station == 5: value = (1.9942e-9)*a2d_reading ** 2 + 0.0080173*a2d_reading - 0.15493 #station 5
-
-    elif (measurand == 'F'): # Millivoltage 2
- 
-        if (a2d_reading <= 150): 
-            if station == 1: value = (-1.03404e-5)*a2d_reading ** 2 + 0.010282*a2d_reading - 0.21979 #station 1
-            if station == 2: value = (-1.95506e-5)*a2d_reading ** 2 + 0.011726*a2d_reading - 0.18104 #station 2
-            if station == 3: value = (-1.2052e-5)*a2d_reading ** 2 + 0.01053*a2d_reading - 0.19212 #station 3
-            if station == 4: value = (-1.75013e-5)*a2d_reading ** 2 + 0.011398*a2d_reading - 0.17914 #station 4
-            if station == 5: value = (-2.37306e-5)*a2d_reading ** 2 + 0.012318*a2d_reading - 0.16209 #station 5
-            
-        else:  
-            if station == 1: value = (-3.72858e-9)*a2d_reading ** 2 + 0.008067*a2d_reading - 0.13588   # station 1   
-            if station == 2: value = (5.69066e-10)*a2d_reading ** 2 + 0.008031*a2d_reading - 0.02149 #station 2
-            if station == 3: value = (1.57139e-9)*a2d_reading ** 2 + 0.008028*a2d_reading - 0.06840 #station 3            
-            if station == 4: value = (1.24726e-9)*a2d_reading ** 2 + 0.008034*a2d_reading - 0.03039 #station 4
-            if station == 5: value = (1.39109e-9)*a2d_reading ** 2 + 0.008028*a2d_reading + 0.02078 #station 5
-
-    return value
+    import PolyDAQ_Calibration
+    return PolyDAQ_Calibration.default_registry ().calibrator (measurand) (a2d_reading)
 
 ####################################
 
@@ -387,6 +536,10 @@ def init_text ():
     astring = 'Station:    ' + str(station) + '\n'    \
                 + 'Baud rate:    ' + str (baud_rate) + '\n'                                     \
                 + 'Oversampling: ' + str(oversampling) + '\n'                                \
+                + 'Scan mode:    ' + str(scan_mode) + '\n'                                   \
+                + 'Acq process:  ' + str(acquisition_process) + '\n'                         \
+                + 'Board ports:  ' + str(board_ports) + '\n'                                 \
+                + 'Timestamps:   ' + str(board_timestamps) + '\n'                            \
 			+ 'File path:    ' + data_file_path + '\n'                                \
 			+ 'Extension:    ' + data_file_extension + '\n'                           \
 			+ 'Data rates:   ' + str (rates) + '\n'                                   \
@@ -401,7 +554,9 @@ def init_text ():
 				+  str (plot['ymax']) + '\n' + '        Channels:\n'
         for channel in plot['channels']:
             astring += '            ' + channel['name'] + ' (' + channel['abbrev']    \
-					+ '):' +  '   Command: ' + channel['command'] + '\n' #\
+					+ '):' +  '   Command: ' + channel['command']              \
+					+ ('   Every ' + str (channel['interval']) + ' s'           \
+					   if 'interval' in channel else '') + '\n' #\
 #					+  '                Slope:   ' + str (channel['slope']) + '\n'    \
 #					+  '                Offset:  ' + str (channel['offset']) + '\n'
 